@@ -1,11 +1,30 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
+import gc
+import io
+import logging
 import os
+import random
+import secrets
+import tempfile
+import threading
+import time
+import numpy as np
 from werkzeug.utils import secure_filename
-from harmonizer import MIDIHarmonizer
+from harmonizer import MIDIHarmonizer, DETERMINISTIC_MODES, HARMONIZATION_MODES
+from jobs import DONE, JobQueue, JobStore, QueueFullError
+from metrics import REGISTRY, REQUEST_SECONDS, Gauge
+from result_cache import ResultCache
+from retention import RetentionSweeper
+
+# Pipeline messages are logged at INFO/DEBUG; set LOG_LEVEL=INFO to see them
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'WARNING').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Harmonizer-Seed'])
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
@@ -18,16 +37,192 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Job database: HARMONIZER_JOB_DB, or jobs.sqlite3 next to this module
+# (not the working directory the server happens to start in)
+app.config['JOB_DB'] = os.environ.get(
+    'HARMONIZER_JOB_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite3')
+)
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_MAX_PENDING'] = 16  # queued + running before new jobs get 429
+app.config['CACHE_MAX_BYTES'] = 256 * 1024 * 1024  # harmonized results kept in outputs/
+app.config['UPLOAD_RETENTION'] = 24 * 3600   # seconds before uploads are deleted
+app.config['OUTPUT_RETENTION'] = 24 * 3600   # seconds before job results are deleted
+app.config['CLEANUP_INTERVAL'] = 3600        # seconds between retention sweeps
+# Synchronous harmonizations running at once per process; requests wait up
+# to HARMONIZE_WAIT seconds for a slot, then get 503
+app.config['MAX_CONCURRENT_HARMONIZATIONS'] = int(os.environ.get('MAX_CONCURRENT_HARMONIZATIONS', 4))
+app.config['HARMONIZE_WAIT'] = 10
+
+# Initialize harmonizer (music21 and TensorFlow are only imported by the
+# code paths that use them). HARMONIZER_CHORD_MODEL points at a trained
+# chord model; it is loaded on first use in each worker.
+# HARMONIZER_MARKOV_MODEL points at trained Markov chord tables (.npz)
+harmonizer = MIDIHarmonizer(
+    os.environ.get('HARMONIZER_CHORD_MODEL'), os.environ.get('HARMONIZER_MARKOV_MODEL')
+)
+
+def warm_up():
+    """
+    Pre-build shared tables and freeze the objects created so far out of the
+    garbage collector. Run in the parent of a pre-forking server (e.g.
+    gunicorn --preload) so workers share these pages copy-on-write.
+    """
+    harmonizer.warm_up()
+    gc.freeze()
+
+if os.environ.get('HARMONIZER_WARM_UP', '1') != '0':
+    warm_up()
+
+def run_job(input_path, output_path, options, progress):
+    harmonizer.harmonize(input_path, output_path, progress=progress, **options)
+
+# Background harmonization jobs (persisted, resumed after a restart)
+job_queue = JobQueue(
+    JobStore(app.config['JOB_DB']),
+    run_job,
+    app.config['OUTPUT_FOLDER'],
+    workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_MAX_PENDING'],
+)
+
+# Content-addressed cache of /api/harmonize results (input bytes + options)
+result_cache = ResultCache(app.config['OUTPUT_FOLDER'], app.config['CACHE_MAX_BYTES'])
+
+# Age out old uploads and job results; cache entries are bounded by the
+# cache itself, and inputs of unfinished jobs are never removed
+retention_sweeper = RetentionSweeper(
+    {
+        app.config['UPLOAD_FOLDER']: app.config['UPLOAD_RETENTION'],
+        app.config['OUTPUT_FOLDER']: app.config['OUTPUT_RETENTION'],
+    },
+    interval=app.config['CLEANUP_INTERVAL'],
+    keep=lambda: [job['input_path'] for job in job_queue.store.unfinished()],
+    skip=result_cache.owns,
+)
+
+harmonize_slots = threading.BoundedSemaphore(app.config['MAX_CONCURRENT_HARMONIZATIONS'])
+
+def start_background_tasks(recover_jobs=True):
+    """Resume unfinished jobs and start the retention sweeper."""
+    if recover_jobs:
+        job_queue.recover()
+    retention_sweeper.start()
+
+def init_worker(recover_jobs=True):
+    """
+    Per-process setup for pre-forking servers, called after fork (see
+    gunicorn.conf.py). Threads do not survive fork, so background tasks
+    start here rather than in the parent, and the global RNGs are reseeded
+    so workers do not replay the parent's random sequence.
+    """
+    random.seed()
+    np.random.seed()
+    start_background_tasks(recover_jobs)
+
+# Under a pre-forking server each worker starts them in init_worker instead
+if os.environ.get('HARMONIZER_PREFORK') != '1':
+    start_background_tasks()
 
-# Initialize harmonizer
-harmonizer = MIDIHarmonizer()
+# Point-in-time values, refreshed on every /api/metrics scrape. Like all
+# metrics they are per worker process, except the job count (job database)
+# and the cache size (cache folder)
+CACHE_EVENTS = Gauge('harmonizer_result_cache_events', 'Result cache lookups since start.', ['result'])
+CACHE_BYTES = Gauge('harmonizer_result_cache_bytes', 'Bytes held by the result cache.')
+JOBS_PENDING = Gauge('harmonizer_jobs_pending', 'Background jobs queued or running (all workers).')
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+            status=str(response.status_code)
+        )
+    return response
+
+def busy_response():
+    response = jsonify({'error': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_int_list(value, low, high):
+    """Integers in [low, high] from a JSON list or number or a comma-separated string; None if invalid."""
+    items = value.split(',') if isinstance(value, str) else value if isinstance(value, list) else [value]
+    try:
+        numbers = [int(item) for item in items]
+    except (TypeError, ValueError):
+        return None
+    if not numbers or any(n < low or n > high for n in numbers):
+        return None
+    return numbers
+
+def parse_harmonize_options(data):
+    """
+    Validate optional harmonizer settings; returns (options, error_message).
+    Sampled runs without a seed get a fresh one, so every result can be
+    reproduced (and cached) from the seed returned to the client.
+    """
+    options = {}
+    if 'mode' in data:
+        if data['mode'] not in HARMONIZATION_MODES:
+            return None, f"Invalid mode. Use one of: {', '.join(HARMONIZATION_MODES)}"
+        options['mode'] = data['mode']
+    if data.get('seed') is not None:
+        try:
+            options['seed'] = int(data['seed'])
+        except (TypeError, ValueError):
+            return None, 'Seed must be an integer'
+    # Where the melody is taken from in multi-track input
+    if data.get('track') is not None:
+        track = parse_int_list(data['track'], 0, 65535)
+        if track is None or len(track) != 1:
+            return None, 'Track must be a non-negative integer'
+        options['track'] = track[0]
+    for name, high in (('channels', 15), ('programs', 127)):
+        if data.get(name) is not None:
+            values = parse_int_list(data[name], 0, high)
+            if values is None:
+                return None, f'{name.capitalize()} must be integers between 0 and {high}'
+            options[name] = values
+    # Length of an incomplete first bar (quarter lengths)
+    if data.get('pickup') is not None:
+        try:
+            options['pickup'] = float(data['pickup'])
+        except (TypeError, ValueError):
+            return None, 'Pickup must be a number of quarter notes'
+        if not 0 <= options['pickup'] < 64:
+            return None, 'Pickup must be a number of quarter notes'
+    if options.get('mode') in DETERMINISTIC_MODES:
+        options.pop('seed', None)   # deterministic search, the seed is unused
+    elif 'seed' not in options:
+        options['seed'] = secrets.randbelow(2 ** 32)
+    return options, None
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'MIDI Harmonizer API is running'})
+    return jsonify({
+        'status': 'healthy',
+        'message': 'MIDI Harmonizer API is running',
+        'cache': result_cache.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    stats = result_cache.stats()
+    CACHE_EVENTS.set(stats['hits'], result='hit')
+    CACHE_EVENTS.set(stats['misses'], result='miss')
+    CACHE_BYTES.set(stats['bytes'])
+    JOBS_PENDING.set(job_queue.pending)
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
@@ -65,29 +260,166 @@ def harmonize():
     if not os.path.exists(input_path):
         return jsonify({'error': 'File not found'}), 404
     
+    options, error = parse_harmonize_options(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
     try:
-        # Generate harmonized MIDI
-        output_filename = f"harmonized_{filename}"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+        with open(input_path, 'rb') as f:
+            input_bytes = f.read()
+        
+        # Identical input + options + chord sources -> identical result,
+        # whatever the file is called
+        cache_key = result_cache.make_key(input_bytes, {**options, **harmonizer.chord_sources()})
+        cached = result_cache.get(cache_key) is not None
         
-        harmonizer.harmonize(input_path, output_path)
+        if not cached:
+            if not harmonize_slots.acquire(timeout=app.config['HARMONIZE_WAIT']):
+                return busy_response()
+            # Generate harmonized MIDI
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=app.config['OUTPUT_FOLDER'])
+            os.close(fd)
+            try:
+                harmonizer.harmonize(io.BytesIO(input_bytes), temp_path, **options)
+                result_cache.put(cache_key, temp_path)
+            finally:
+                harmonize_slots.release()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
         
+        output_filename = f"{cache_key}.mid"
         return jsonify({
             'message': 'Harmonization successful',
             'output_filename': output_filename,
-            'download_url': f'/api/download/{output_filename}'
+            'download_url': f'/api/download/{output_filename}?name=harmonized_{filename}',
+            'seed': options.get('seed'),
+            'cached': cached
         }), 200
     
     except Exception as e:
         return jsonify({'error': f'Harmonization failed: {str(e)}'}), 500
 
+@app.route('/api/harmonize/stream', methods=['POST'])
+def harmonize_stream():
+    """
+    One-shot harmonization: the MIDI file is the request body (raw bytes or
+    a multipart 'file' field), options come from the query string, and the
+    harmonized MIDI is returned directly. Nothing is written to disk.
+    """
+    if 'file' in request.files:
+        file = request.files['file']
+        filename = secure_filename(file.filename or '')
+        input_bytes = file.read()
+    else:
+        filename = secure_filename(request.args.get('filename', ''))
+        input_bytes = request.get_data()
+    
+    if not input_bytes:
+        return jsonify({'error': 'No MIDI data provided'}), 400
+    if filename and not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type. Please upload a MIDI file'}), 400
+    
+    options, error = parse_harmonize_options(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    if not harmonize_slots.acquire(timeout=app.config['HARMONIZE_WAIT']):
+        return busy_response()
+    try:
+        output = io.BytesIO()
+        harmonizer.harmonize(io.BytesIO(input_bytes), output, **options)
+        output.seek(0)
+    except Exception as e:
+        return jsonify({'error': f'Harmonization failed: {str(e)}'}), 500
+    finally:
+        harmonize_slots.release()
+    
+    response = send_file(
+        output,
+        mimetype='audio/midi',
+        as_attachment=True,
+        download_name=f"harmonized_{filename or 'melody.mid'}"
+    )
+    if options.get('seed') is not None:
+        response.headers['X-Harmonizer-Seed'] = str(options['seed'])
+    return response
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    data = request.get_json()
+    
+    if not data or 'filename' not in data:
+        return jsonify({'error': 'No filename provided'}), 400
+    
+    filename = secure_filename(data['filename'])
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    
+    if not os.path.exists(input_path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    options, error = parse_harmonize_options(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        job_id = job_queue.submit(filename, input_path, options)
+    except QueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    
+    return jsonify({
+        'message': 'Harmonization queued',
+        'job_id': job_id,
+        'seed': options.get('seed'),
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    response = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'progress': job['progress'],
+        'total': job['total'],
+        'seed': job['options'].get('seed'),
+    }
+    if job['error']:
+        response['error'] = job['error']
+    if job['status'] == DONE:
+        response['download_url'] = f'/api/jobs/{job_id}/result'
+    return jsonify(response), 200
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.status(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != DONE:
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    if not os.path.exists(job['output_path']):
+        return jsonify({'error': 'Job result has expired'}), 410
+    
+    return send_file(
+        os.path.abspath(job['output_path']),
+        as_attachment=True,
+        download_name=f"harmonized_{job['filename']}"
+    )
+
 @app.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
     try:
-        filepath = os.path.join(app.config['OUTPUT_FOLDER'], secure_filename(filename))
-        return send_file(filepath, as_attachment=True)
+        filepath = os.path.abspath(os.path.join(app.config['OUTPUT_FOLDER'], secure_filename(filename)))
+        download_name = secure_filename(request.args.get('name', '')) or None
+        return send_file(filepath, as_attachment=True, download_name=download_name)
     except Exception as e:
         return jsonify({'error': f'Download failed: {str(e)}'}), 404
 
 if __name__ == '__main__':
+    # Development server; for production use gunicorn -c gunicorn.conf.py (see wsgi.py)
     app.run(debug=True, host='0.0.0.0', port=5000)
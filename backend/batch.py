@@ -0,0 +1,194 @@
+"""
+Batch Harmonization
+===================
+Harmonize a directory (or glob) of MIDI files across a process pool.
+
+Each worker process builds one MIDIHarmonizer in its initializer, so
+heavy imports and key tables are set up once per worker rather than once
+per file. Results stream back as files finish, each with a status and
+timing.
+
+Usage (from backend/):
+    python batch.py INPUT [INPUT ...] -o OUTPUT_DIR [-j WORKERS] [--mode optimal|satb]
+                    [--seed N] [--track N | --channels C [C ...] | --programs P [P ...]]
+                    [--pickup QUARTERS] [--markov-model chords.npz] [--chunked] [--report report.jsonl]
+
+INPUT is a directory (searched recursively for .mid/.midi) or a glob.
+Outputs keep each file's path below the directory, or below the glob's
+leading non-wildcard directories. A batch in which two inputs would
+write the same output file is rejected before any file is harmonized.
+--chunked harmonizes each file in phrase-sized windows with bounded
+memory (sampled mode only, see chunked.py), for very long inputs.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+MIDI_EXTENSIONS = ('.mid', '.midi')
+
+BatchResult = namedtuple('BatchResult', ['input_path', 'output_path', 'status', 'seconds', 'error'])
+
+# Per-process harmonizer, created by _init_worker
+_worker_harmonizer = None
+
+
+def _init_worker(markov_model_path=None):
+    global _worker_harmonizer
+    from harmonizer import MIDIHarmonizer
+    _worker_harmonizer = MIDIHarmonizer(markov_model_path=markov_model_path)
+
+
+def _harmonize_file(input_path, output_path, options):
+    """Harmonize one file in a worker and report status and timing."""
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        _worker_harmonizer.harmonize(input_path, output_path, **options)
+        return BatchResult(input_path, output_path, 'ok', time.perf_counter() - start, None)
+    except Exception as e:
+        return BatchResult(input_path, output_path, 'error', time.perf_counter() - start, f"{type(e).__name__}: {e}")
+
+
+def glob_root(pattern):
+    """Leading directories of a glob pattern that hold no wildcard ('' if none)."""
+    parts = os.path.dirname(pattern).split(os.sep)
+    root = []
+    for part in parts:
+        if glob.has_magic(part):
+            break
+        root.append(part)
+    return os.sep.join(root)
+
+
+def collect_inputs(patterns):
+    """
+    Expand directories and globs into (input_path, relative_output_name) pairs.
+    Directory and glob inputs keep their sub-directory layout (below the
+    directory, or below glob_root) in the output. A file matched twice is
+    listed once.
+    """
+    inputs = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for name in sorted(files):
+                    if name.lower().endswith(MIDI_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        _add_input(inputs, seen, path, os.path.relpath(path, pattern))
+        else:
+            root = glob_root(pattern) or os.curdir
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if path.lower().endswith(MIDI_EXTENSIONS):
+                    _add_input(inputs, seen, path, os.path.relpath(path, root))
+    return inputs
+
+
+def _add_input(inputs, seen, path, relative_name):
+    key = os.path.normcase(os.path.realpath(path))
+    if key not in seen:
+        seen.add(key)
+        inputs.append((path, relative_name))
+
+
+def output_paths(inputs, output_dir):
+    """
+    Output path of each (input_path, relative_name) pair. Raises ValueError
+    if two inputs would write the same file.
+    """
+    paths = []
+    claimed = {}
+    for input_path, relative_name in inputs:
+        directory, name = os.path.split(relative_name)
+        output_path = os.path.join(output_dir, directory, f"harmonized_{name}")
+        key = os.path.normcase(os.path.normpath(output_path))
+        if key in claimed:
+            raise ValueError(
+                f"{claimed[key]} and {input_path} would both be written to {output_path}; "
+                "harmonize them in separate batches or output directories"
+            )
+        claimed[key] = input_path
+        paths.append(output_path)
+    return paths
+
+
+def harmonize_batch(patterns, output_dir, workers=None, markov_model_path=None, **options):
+    """
+    Harmonize every MIDI file matched by `patterns` into `output_dir`.
+
+    `workers` defaults to the CPU count; `markov_model_path` is a trained
+    Markov chord model each worker loads. Extra keyword arguments are passed
+    to MIDIHarmonizer.harmonize (mode, seed, ...). Yields a BatchResult per
+    file in completion order. Raises ValueError, before any file is
+    harmonized, if two inputs would write the same output file.
+    """
+    inputs = collect_inputs(patterns)
+    if not inputs:
+        return
+    outputs = output_paths(inputs, output_dir)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(markov_model_path,)) as executor:
+        futures = [
+            executor.submit(_harmonize_file, input_path, output_path, options)
+            for (input_path, _), output_path in zip(inputs, outputs)
+        ]
+
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--mode', choices=('sampled', 'optimal', 'satb'), default='sampled')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--track', type=int, default=None, help='take the melody from this track index')
+    parser.add_argument('--channels', type=int, nargs='+', help='take the melody from these MIDI channels (0-15)')
+    parser.add_argument('--programs', type=int, nargs='+', help='take the melody from these General MIDI programs')
+    parser.add_argument('--pickup', type=float, default=None, help='length of an incomplete first bar in quarter notes')
+    parser.add_argument('--markov-model', help='trained Markov chord model (.npz, see markov_model.py)')
+    parser.add_argument('--chunked', action='store_true', help='bounded-memory harmonization (sampled mode only)')
+    parser.add_argument('--report', help='write one JSON line per file to this path')
+    args = parser.parse_args(argv)
+
+    report = open(args.report, 'w') if args.report else None
+    succeeded = failed = 0
+    start = time.perf_counter()
+
+    try:
+        for result in harmonize_batch(
+            args.inputs, args.output_dir, args.workers, args.markov_model, mode=args.mode, seed=args.seed,
+            track=args.track, channels=args.channels, programs=args.programs, pickup=args.pickup,
+            chunked=args.chunked,
+        ):
+            if result.status == 'ok':
+                succeeded += 1
+                print(f"[ok]    {result.seconds:7.3f}s  {result.input_path} -> {result.output_path}")
+            else:
+                failed += 1
+                print(f"[error] {result.seconds:7.3f}s  {result.input_path}: {result.error}")
+            if report:
+                report.write(json.dumps(result._asdict()) + '\n')
+                report.flush()
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if report:
+            report.close()
+
+    print(f"\n{succeeded} harmonized, {failed} failed in {time.perf_counter() - start:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
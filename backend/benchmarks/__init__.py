@@ -0,0 +1,4 @@
+"""
+Benchmarks for the harmonization pipeline.
+Run from the backend/ directory, e.g. `python -m benchmarks.phrase_scaling`.
+"""
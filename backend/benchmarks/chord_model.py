@@ -0,0 +1,102 @@
+"""
+Chord Prediction Benchmark
+==========================
+Notes/s of the sampled path with chords from the Markov tables and from
+a learned chord model, plus model inference on its own:
+
+- markov:  harmonize_melody(chords='markov')
+- model:   harmonize_melody(chords='model'), features and one forward
+           pass per melody included
+- batched: --clients threads predicting at once through one
+           ChordPredictor; reports how many forward passes served them
+
+The model comes from --model (a saved Keras model) or, with --untrained,
+from build_chord_model() with random weights (same cost, meaningless
+chords). Without TensorFlow only the Markov path is measured.
+
+Usage (from backend/):
+    python -m benchmarks.chord_model [--sizes 1000 10000] [--model chords.keras | --untrained]
+                                     [--clients 8]
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chord_model import ChordPredictor, build_chord_model, melody_windows
+from harmonizer import MIDIHarmonizer, PhraseDetector
+from benchmarks.synthetic import synthetic_melody
+
+SEED = 1
+
+
+def best_time(function, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_predictor(args):
+    """ChordPredictor for the requested model, or None (with the reason printed)."""
+    if not (args.model or args.untrained):
+        print("No --model or --untrained given: measuring the Markov path only")
+        return None
+    try:
+        predictor = ChordPredictor(args.model) if args.model else ChordPredictor(model=build_chord_model())
+        predictor.model   # load now, outside the timings
+    except ImportError as e:
+        print(f"TensorFlow is not available ({e}): measuring the Markov path only")
+        return None
+    return predictor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--model', help='saved Keras chord model')
+    parser.add_argument('--untrained', action='store_true', help='use a randomly initialized model')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent callers for the batching test')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    harmonizer = MIDIHarmonizer()
+    harmonizer.chord_predictor = make_predictor(args)
+
+    print(f"{'events':>8} {'path':>8} {'seconds':>9} {'notes/s':>12}")
+    for size in args.sizes:
+        melody = synthetic_melody(size, seed=size)
+        detected_key = harmonizer.analyze_key(melody)
+        boundaries = PhraseDetector.boundary_mask(melody)
+        notes = melody.note_count
+
+        paths = ['markov'] + (['model'] if harmonizer.chord_predictor else [])
+        for path in paths:
+            seconds = best_time(lambda: harmonizer.harmonize_melody(
+                melody, detected_key, boundaries, seed=SEED, chords=path
+            ), args.repeats)
+            print(f"{size:>8} {path:>8} {seconds:>9.4f} {notes / seconds:>12,.0f}")
+
+        if not harmonizer.chord_predictor:
+            continue
+
+        predictor = harmonizer.chord_predictor
+        _, windows = melody_windows(melody, detected_key, boundaries)
+        sequential = best_time(lambda: [predictor.predict(windows) for _ in range(args.clients)], args.repeats)
+
+        passes_before = predictor.forward_passes
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            concurrent = best_time(
+                lambda: list(pool.map(lambda _: predictor.predict(windows), range(args.clients))), args.repeats
+            )
+        passes = (predictor.forward_passes - passes_before) / args.repeats
+        print(f"{'':>8} inference x{args.clients}: sequential {notes * args.clients / sequential:,.0f} notes/s, "
+              f"concurrent {notes * args.clients / concurrent:,.0f} notes/s in {passes:.1f} forward passes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
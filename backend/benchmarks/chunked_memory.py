@@ -0,0 +1,139 @@
+"""
+Chunked Harmonization Memory Benchmark
+======================================
+Writes synthetic MIDI files of growing length straight to disk (a melody
+over held accompaniment chords in one track, plus a conductor track) and
+harmonizes each with harmonize(chunked=True) under tracemalloc:
+
+- peak traced memory must stay under --ceiling MB at every length, and
+  the longest file may not peak more than --growth times the shortest;
+- the in-memory path is measured next to it up to --compare-max notes;
+- on the shortest file both paths must write the same bytes.
+
+Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python -m benchmarks.chunked_memory [--notes 10000 40000 160000] [--ceiling 32]
+                                        [--growth 1.5] [--compare-max 40000]
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from harmonizer import MIDIHarmonizer
+from midi_writer import variable_int
+
+TICKS_PER_BEAT = 480
+SEED = 1
+MB = 1024 * 1024
+
+# Degrees of C major for the melody (two octaves) and the accompaniment roots
+MELODY_PITCHES = [60, 62, 64, 65, 67, 69, 71, 72, 74, 76, 77, 79]
+CHORD_ROOTS = [48, 53, 55, 57]
+
+
+def write_long_file(path, notes, seed=SEED):
+    """Write a `notes`-note melody over whole-bar triads, event by event."""
+    rng = random.Random(seed)
+    with open(path, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>LHHH', 6, 1, 2, TICKS_PER_BEAT))
+        conductor = (b'\x00\xff\x58\x04\x04\x02\x18\x08' + b'\x00\xff\x51\x03' + (500000).to_bytes(3, 'big')
+                     + b'\x00\xff\x2f\x00')
+        f.write(b'MTrk' + struct.pack('>L', len(conductor)) + conductor)
+
+        # Track length is patched in once the events are written
+        f.write(b'MTrk\x00\x00\x00\x00')
+        start = f.tell()
+        events = []      # (tick, is_on, pitch) of the current bar
+        tick = 0
+        last_tick = 0
+        written = 0
+        while written < notes:
+            bar_end = tick + 4 * TICKS_PER_BEAT
+            root = rng.choice(CHORD_ROOTS)
+            for pitch in (root, root + 4, root + 7):
+                events += [(tick, True, pitch), (bar_end, False, pitch)]
+            while tick < bar_end and written < notes:
+                length = rng.choice([240, 480, 480, 960])
+                pitch = rng.choice(MELODY_PITCHES)
+                events += [(tick, True, pitch), (min(tick + length, bar_end), False, pitch)]
+                tick = min(tick + length, bar_end)
+                written += 1
+            tick = bar_end
+
+            data = bytearray()
+            for event_tick, on, pitch in sorted(events, key=lambda e: (e[0], e[1])):
+                data += variable_int(event_tick - last_tick)
+                data += bytes((0x90 if on else 0x80, pitch, 80 if on else 0))
+                last_tick = event_tick
+            f.write(data)
+            events = []
+        f.write(b'\x00\xff\x2f\x00')
+        length = f.tell() - start
+        f.seek(start - 4)
+        f.write(struct.pack('>L', length))
+
+
+def measure(function):
+    """(seconds, peak traced MB) of one call."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / MB
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--notes', type=int, nargs='+', default=[10000, 40000, 160000])
+    parser.add_argument('--ceiling', type=float, default=32.0, help='peak traced memory limit (MB)')
+    parser.add_argument('--growth', type=float, default=1.5, help='allowed peak ratio, longest to shortest file')
+    parser.add_argument('--compare-max', type=int, default=40000, help='measure the in-memory path up to this size')
+    args = parser.parse_args(argv)
+
+    harmonizer = MIDIHarmonizer()
+    failures = []
+    peaks = []
+    print(f"{'notes':>8} {'file MB':>8} {'chunked s':>10} {'peak MB':>8} {'in-memory s':>12} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for notes in sorted(args.notes):
+            path = os.path.join(directory, f'{notes}.mid')
+            write_long_file(path, notes)
+            chunked_path = os.path.join(directory, 'chunked.mid')
+            seconds, peak = measure(lambda: harmonizer.harmonize(path, chunked_path, seed=SEED, chunked=True))
+            peaks.append(peak)
+            line = f"{notes:>8} {os.path.getsize(path) / MB:>8.1f} {seconds:>10.2f} {peak:>8.1f}"
+
+            if notes <= args.compare_max:
+                full_path = os.path.join(directory, 'full.mid')
+                full_seconds, full_peak = measure(lambda: harmonizer.harmonize(path, full_path, seed=SEED))
+                line += f" {full_seconds:>12.2f} {full_peak:>8.1f}"
+                if notes == min(args.notes):
+                    with open(chunked_path, 'rb') as a, open(full_path, 'rb') as b:
+                        if a.read() != b.read():
+                            failures.append(f"{notes} notes: chunked output differs from the in-memory path")
+            print(line)
+
+            if peak > args.ceiling:
+                failures.append(f"{notes} notes: peak {peak:.1f} MB is over the {args.ceiling:.0f} MB ceiling")
+
+    if len(peaks) > 1 and peaks[-1] > args.growth * peaks[0]:
+        failures.append(f"peak grew {peaks[-1] / peaks[0]:.2f}x with the input (limit {args.growth}x)")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: chunked peak memory stays bounded")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
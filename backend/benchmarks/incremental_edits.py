@@ -0,0 +1,113 @@
+"""
+Incremental Re-Harmonization Benchmark
+======================================
+Applies small random edits (re-pitched notes, split notes) to synthetic
+melodies of growing size and compares IncrementalHarmonizer.update
+against harmonizing the edited melody from scratch. Every update is
+checked against the full result (same key and seed); the script exits
+non-zero on any mismatch. The
+first columns time one full-run harmonize_melody on the unedited melody
+(best of --repeats) so a regression of the full path shows up as well.
+
+Usage (from backend/):
+    python -m benchmarks.incremental_edits [--sizes 1000 10000 100000] [--edits 20] [--repeats 3]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from harmonizer import MIDIHarmonizer, PhraseDetector
+from incremental import IncrementalHarmonizer, MelodyEdit
+from key_context import get_key_context
+from melody import Melody, REST
+from benchmarks.synthetic import synthetic_melody
+
+SEED = 1
+
+
+def random_edit(melody, rng, max_events=3, split_rate=0.25):
+    """
+    Re-pitch a few consecutive events (occasionally turning one into a
+    rest), or at `split_rate` split one event in two, which changes the
+    mean duration the phrase detector measures long notes against.
+    """
+    start = int(rng.integers(0, len(melody)))
+    if rng.random() < split_rate:
+        onset, half = melody.onsets[start], melody.durations[start] / 2
+        replacement = Melody([onset, onset + half], [half, half], [melody.pitches[start], 55 + rng.integers(0, 20)])
+        return MelodyEdit(start, start + 1, replacement)
+    stop = min(len(melody), start + int(rng.integers(1, max_events + 1)))
+    pitches = 55 + rng.integers(0, 20, stop - start)
+    pitches[rng.random(stop - start) < 0.1] = REST
+    replacement = Melody(melody.onsets[start:stop], melody.durations[start:stop], pitches)
+    return MelodyEdit(start, stop, replacement)
+
+
+def time_full_run(harmonizer, melody, key, repeats):
+    """Best-of-N wall time of boundary_mask + harmonize_melody, in seconds."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        mask = PhraseDetector.boundary_mask(melody)
+        harmonizer.harmonize_melody(melody, key, mask, seed=SEED, chords='markov')
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def same_voice(a, b):
+    return (np.array_equal(a.onsets, b.onsets) and np.array_equal(a.durations, b.durations)
+            and np.array_equal(a.pitches, b.pitches))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--edits', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    harmonizer = MIDIHarmonizer()
+    incremental = IncrementalHarmonizer(harmonizer)
+    key = get_key_context(0, 'major')
+    rng = np.random.default_rng(0)
+    mismatches = 0
+
+    print(f"{'events':>10} {'run s':>10} {'us/event':>10} {'full s':>10} {'update ms':>10} "
+          f"{'phrases':>10} {'recomputed':>10}")
+    for size in args.sizes:
+        melody = synthetic_melody(size)
+        run_seconds = time_full_run(harmonizer, melody, key, args.repeats)
+        state = incremental.harmonize(melody, key, seed=SEED)
+        update_seconds = []
+        full_seconds = []
+        recomputed = []
+
+        for _ in range(args.edits):
+            edit = random_edit(state.melody, rng)
+            start = time.perf_counter()
+            state = incremental.update(state, edit)
+            update_seconds.append(time.perf_counter() - start)
+            recomputed.append(state.recomputed)
+
+            start = time.perf_counter()
+            mask = PhraseDetector.boundary_mask(state.melody)
+            harmony, bass = harmonizer.harmonize_melody(state.melody, key, mask, seed=SEED, chords='markov')
+            full_seconds.append(time.perf_counter() - start)
+            if not (same_voice(harmony, state.harmony) and same_voice(bass, state.bass)):
+                mismatches += 1
+
+        print(f"{size:>10} {run_seconds:>10.3f} {run_seconds / size * 1e6:>10.1f} "
+              f"{np.median(full_seconds):>10.3f} {np.median(update_seconds) * 1e3:>10.2f} "
+              f"{len(state.starts):>10} {np.mean(recomputed):>10.1f}")
+
+    if mismatches:
+        print(f"{mismatches} incremental updates differ from a full harmonization")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
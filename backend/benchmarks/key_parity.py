@@ -0,0 +1,77 @@
+"""
+Key Detection Parity Check
+==========================
+Compares the profile key detector against music21's analyze('key') on a
+corpus and reports agreement and speed. Both analyzers see the same
+melody notes. Exits non-zero when agreement falls below --min-agreement.
+
+Usage (from backend/):
+    python -m benchmarks.key_parity [MIDI_DIR] [--limit 100] [--min-agreement 0.95]
+
+Without MIDI_DIR the Bach chorales bundled with music21 are used.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from harmonizer import MIDIHarmonizer
+from melody import Melody
+
+
+def corpus_melodies(midi_dir, limit):
+    """Yield (name, Melody) pairs from a MIDI directory or the music21 corpus."""
+    if midi_dir:
+        paths = sorted(glob.glob(os.path.join(midi_dir, '**', '*.mid*'), recursive=True))
+        for path in paths[:limit]:
+            yield os.path.basename(path), Melody.from_midi(path)
+        return
+
+    from music21 import corpus
+    for path in corpus.getComposer('bach')[:limit]:
+        yield os.path.basename(str(path)), Melody.from_stream(corpus.parse(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('midi_dir', nargs='?')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--min-agreement', type=float, default=0.95)
+    args = parser.parse_args()
+
+    harmonizer = MIDIHarmonizer()
+    total = agree = 0
+    profile_seconds = music21_seconds = 0.0
+
+    for name, melody in corpus_melodies(args.midi_dir, args.limit):
+        if melody.note_count == 0:
+            continue
+
+        start = time.perf_counter()
+        fast_key = harmonizer.analyze_key(melody, method='profile')
+        profile_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        slow_key = harmonizer.analyze_key(melody, method='music21')
+        music21_seconds += time.perf_counter() - start
+
+        total += 1
+        if fast_key is slow_key:
+            agree += 1
+        else:
+            print(f"  mismatch {name}: profile={fast_key} music21={slow_key}")
+
+    if total == 0:
+        print("No melodies found.")
+        return 1
+
+    agreement = agree / total
+    print(f"Agreement: {agree}/{total} ({agreement:.1%})")
+    print(f"profile: {profile_seconds * 1e3 / total:.3f} ms/file, music21: {music21_seconds * 1e3 / total:.3f} ms/file")
+    return 0 if agreement >= args.min_agreement else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Live Replay Check
+=================
+Replays a melody through the live path of streaming.py (NoteAssembler,
+StreamingHarmonizer.note_on and PortOutput, one live_step per input
+message) on a simulated clock and checks what reaches the output port:
+
+- every melody note gets a harmony note that starts at the same beat;
+- every harmony and bass note starts at the beat of a melody note;
+- each harmony note ends when its melody note is released, and no
+  harmony or bass note is cut to zero length.
+
+Also reports the per-message latency of live_step. Exits non-zero if a
+check fails.
+
+Usage (from backend/):
+    python -m benchmarks.live_replay [--size 2000] [--replay melody.mid] [--bpm 120]
+"""
+
+import argparse
+import sys
+import time
+
+import mido
+import numpy as np
+
+from harmonizer import MIDIHarmonizer
+from key_context import get_key_context
+from melody import REST
+from meter import MeterIndex
+from streaming import NoteAssembler, PortOutput, StreamingHarmonizer, live_step, replay_messages
+from benchmarks.synthetic import synthetic_melody
+
+SEED = 1
+MELODY_CHANNEL = 0
+
+
+class RecordingPort:
+    """Output port stand-in that logs (beat, message) with the simulated clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append((self.clock.beat, message))
+
+
+class Clock:
+    """Simulated time: `beat` is set by the replay loop, calls return seconds."""
+
+    def __init__(self, seconds_per_beat):
+        self.seconds_per_beat = seconds_per_beat
+        self.beat = 0.0
+
+    def __call__(self):
+        return self.beat * self.seconds_per_beat
+
+
+def synthetic_messages(size):
+    """(beat, message) of a synthetic melody, some notes released early (gaps shorter than a rest)."""
+    melody = synthetic_melody(size, seed=SEED)
+    rng = np.random.default_rng(SEED)
+    messages = []
+    for onset, duration, pitch in zip(melody.onsets.tolist(), melody.durations.tolist(), melody.pitches.tolist()):
+        if pitch == REST:
+            continue
+        release = onset + duration * (0.9 if rng.random() < 0.3 else 1.0)
+        messages.append((onset, 1, mido.Message('note_on', channel=MELODY_CHANNEL, note=pitch, velocity=80)))
+        messages.append((release, 0, mido.Message('note_off', channel=MELODY_CHANNEL, note=pitch)))
+    messages.sort(key=lambda m: (m[0], m[1]))
+    return [(beat, message) for beat, _, message in messages]
+
+
+def sounding_notes(sent, channel):
+    """(start beat, end beat) of every note on `channel` in a port log."""
+    open_notes = {}
+    notes = []
+    for beat, message in sent:
+        if message.channel != channel:
+            continue
+        if message.type == 'note_on' and message.velocity > 0:
+            open_notes.setdefault(message.note, []).append(beat)
+        elif open_notes.get(message.note):
+            notes.append((open_notes[message.note].pop(0), beat))
+    return sorted(notes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help='events of the synthetic melody')
+    parser.add_argument('--replay', help='MIDI file to replay instead of a synthetic melody')
+    parser.add_argument('--bpm', type=float, default=120.0)
+    args = parser.parse_args(argv)
+
+    seconds_per_beat = 60.0 / args.bpm
+    messages = (list(replay_messages(args.replay, realtime=False)) if args.replay
+                else synthetic_messages(args.size))
+    clock = Clock(seconds_per_beat)
+    port = RecordingPort(clock)
+    output = PortOutput(port, seconds_per_beat, clock=clock)
+    meter = MeterIndex(tempos=[(0.0, seconds_per_beat * 1e6)])
+    streamer = StreamingHarmonizer(MIDIHarmonizer(), get_key_context(0, 'major'), seed=SEED, meter=meter)
+    assembler = NoteAssembler()
+
+    melody_notes = []        # (onset, release) as played
+    latencies = []
+    for beat, message in messages:
+        clock.beat = beat
+        output.poll()
+        held = assembler.held
+        start = time.perf_counter()
+        live_step(beat, message, assembler, streamer, output)
+        latencies.append(time.perf_counter() - start)
+        if held is not None and assembler.held is not held:
+            melody_notes.append((held[0], beat))
+    output.poll(flush=True)
+
+    harmony = sounding_notes(port.sent, 1)
+    bass = sounding_notes(port.sent, 2)
+    melody_onsets = {onset for onset, _ in melody_notes}
+    failures = []
+    if [start for start, _ in harmony] != [onset for onset, _ in melody_notes]:
+        failures.append("harmony onsets do not line up with the melody onsets")
+    if harmony != melody_notes:
+        failures.append("harmony notes do not end with their melody notes")
+    if any(start not in melody_onsets for start, _ in bass):
+        failures.append("a bass note starts between melody onsets")
+    cut = sum(end <= start for start, end in harmony + bass)
+    if cut:
+        failures.append(f"{cut} harmony/bass notes are cut to zero length")
+
+    latencies = np.array(latencies) * 1e3
+    print(f"{len(melody_notes)} melody notes, {len(harmony)} harmony, {len(bass)} bass; "
+          f"live_step latency median {np.median(latencies):.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: live harmony starts and ends with the melody")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
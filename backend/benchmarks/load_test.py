@@ -0,0 +1,95 @@
+"""
+API Load Test
+=============
+Sends concurrent POST /api/harmonize/stream requests to a running instance
+(dev server or gunicorn, see wsgi.py) and reports, per concurrency level,
+throughput (requests/s) and p50/p99 latency, plus the status codes seen
+(503s mean the server's concurrency limit turned requests away).
+
+Each request carries a synthetic melody of --notes events and a distinct
+seed, so results are not served from any cache.
+
+Usage (from backend/, with the server running):
+    python -m benchmarks.load_test [--url http://127.0.0.1:5000]
+                                   [--concurrency 1 4 16] [--requests 64] [--notes 200]
+"""
+
+import argparse
+import collections
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.pipeline import melody_midi_bytes
+from benchmarks.synthetic import synthetic_melody
+
+
+def send(url, body, seed, timeout):
+    """One harmonization request; returns (status, seconds)."""
+    request = urllib.request.Request(
+        f'{url}/api/harmonize/stream?seed={seed}', data=body, method='POST',
+        headers={'Content-Type': 'audio/midi'},
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 'error'
+    return status, time.perf_counter() - start
+
+
+def run_level(url, body, concurrency, total, timeout):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda seed: send(url, body, seed, timeout), range(total)))
+        elapsed = time.perf_counter() - start
+
+    statuses = collections.Counter(status for status, _ in results)
+    latencies = np.array([seconds for status, seconds in results if status == 200])
+    return {
+        'concurrency': concurrency,
+        'requests_per_second': statuses[200] / elapsed,
+        'p50': float(np.percentile(latencies, 50)) if len(latencies) else float('nan'),
+        'p99': float(np.percentile(latencies, 99)) if len(latencies) else float('nan'),
+        'statuses': dict(statuses),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=64, help='requests per concurrency level')
+    parser.add_argument('--notes', type=int, default=200, help='events in the test melody')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    body = melody_midi_bytes(synthetic_melody(args.notes, seed=args.notes))
+    url = args.url.rstrip('/')
+    status, _ = send(url, body, 0, args.timeout)   # warm-up, and fail fast if nothing is listening
+    if status != 200:
+        print(f"Warm-up request to {url} failed: {status}")
+        return 1
+
+    print(f"{args.requests} requests per level, {args.notes}-event melody, {url}")
+    print(f"{'concurrency':>11} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    failed = False
+    for concurrency in args.concurrency:
+        level = run_level(url, body, concurrency, args.requests, args.timeout)
+        statuses = ', '.join(f'{code}: {count}' for code, count in sorted(level['statuses'].items(), key=str))
+        print(f"{concurrency:>11} {level['requests_per_second']:>8.1f} "
+              f"{level['p50'] * 1000:>8.1f} {level['p99'] * 1000:>8.1f}  {statuses}")
+        failed |= 'error' in level['statuses']
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
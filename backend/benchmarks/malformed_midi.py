@@ -0,0 +1,130 @@
+"""
+Malformed MIDI Check
+====================
+Feeds corrupt variants of a small two-track file to harmonize(chunked=True)
+and checks that each one fails cleanly: with OSError, EOFError or
+ValueError (the errors mido.MidiFile raises), within --timeout seconds.
+The outcome of the in-memory path (mido.MidiFile) is printed next to it.
+The intact file must harmonize on both paths.
+
+Exits non-zero if a check fails.
+
+Usage (from backend/):
+    python -m benchmarks.malformed_midi [--timeout 5]
+"""
+
+import argparse
+import io
+import signal
+import struct
+import sys
+
+import mido
+
+from harmonizer import MIDIHarmonizer
+
+SEED = 1
+CLEAN_ERRORS = (OSError, EOFError, ValueError)
+
+CONDUCTOR = b'\x00\xff\x58\x04\x04\x02\x18\x08' + b'\x00\xff\x51\x03\x07\xa1\x20' + b'\x00\xff\x2f\x00'
+MELODY = (b'\x00\x90\x3c\x50' + b'\x83\x60\x80\x3c\x00' + b'\x00\x90\x3e\x50' + b'\x83\x60\x3e\x00'
+          + b'\x00\x90\x40\x50' + b'\x87\x40\x80\x40\x00' + b'\x00\xff\x2f\x00')
+
+
+def header(tracks=2):
+    return b'MThd' + struct.pack('>LHHH', 6, 1, tracks, 480)
+
+
+def track(events, length=None):
+    return b'MTrk' + struct.pack('>L', len(events) if length is None else length) + events
+
+
+def midi_file(melody=MELODY, tracks=2):
+    return header(tracks) + track(CONDUCTOR) + track(melody)
+
+
+def cases():
+    """(name, bytes) of each corrupt file."""
+    intact = midi_file()
+    return [
+        ('empty file', b''),
+        ('not a MIDI file', b'RIFF' + intact[4:]),
+        ('header cut short', intact[:10]),
+        ('bad track chunk name', header() + b'MTrx' + track(CONDUCTOR)[4:] + track(MELODY)),
+        ('more tracks than present', midi_file(tracks=3)),
+        ('truncated inside a delta time', intact[:-len(MELODY) + 5]),
+        ('truncated inside a note', intact[:-len(MELODY) + 2]),
+        ('truncated inside a meta event', intact[:-3]),
+        ('track length past end of file', header() + track(CONDUCTOR) + track(MELODY, len(MELODY) + 64)),
+        ('running status with no status', midi_file(b'\x00\x3c\x50' + MELODY)),
+        ('undefined status byte', midi_file(b'\x00\xf4' + MELODY)),
+        ('data byte over 127', midi_file(b'\x00\x90\x3c\xd0' + MELODY)),
+        ('meta length past end of track', midi_file(MELODY[:-4] + b'\x00\xff\x01\x40abc')),
+    ]
+
+
+class Timeout(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise Timeout()
+
+
+def outcome(function, timeout):
+    """'ok', an exception instance, or Timeout() for one call."""
+    signal.signal(signal.SIGALRM, _alarm)
+    signal.alarm(timeout)
+    try:
+        function()
+        return 'ok'
+    except Exception as e:
+        return e
+    finally:
+        signal.alarm(0)
+
+
+def describe(result):
+    return result if result == 'ok' else f"{type(result).__name__}: {result}"[:60]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timeout', type=int, default=5, help='seconds allowed per file')
+    args = parser.parse_args(argv)
+
+    harmonizer = MIDIHarmonizer()
+    failures = []
+
+    def chunked(data):
+        return lambda: harmonizer.harmonize(io.BytesIO(data), io.BytesIO(), seed=SEED, chunked=True)
+
+    def in_memory(data):
+        return lambda: mido.MidiFile(file=io.BytesIO(data))
+
+    intact = midi_file()
+    for name, run in (('chunked', chunked(intact)), ('in-memory', in_memory(intact))):
+        result = outcome(run, args.timeout)
+        if result != 'ok':
+            failures.append(f"intact file: {name} path failed with {describe(result)}")
+
+    print(f"{'case':<32} {'chunked':<62} {'mido.MidiFile'}")
+    for name, data in cases():
+        result = outcome(chunked(data), args.timeout)
+        print(f"{name:<32} {describe(result):<62} {describe(outcome(in_memory(data), args.timeout))}")
+        if result == 'ok':
+            failures.append(f"{name}: chunked path accepted the file")
+        elif isinstance(result, Timeout):
+            failures.append(f"{name}: chunked path did not finish in {args.timeout} s")
+        elif not isinstance(result, CLEAN_ERRORS):
+            failures.append(f"{name}: chunked path raised {type(result).__name__}")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: every malformed file fails cleanly on the chunked path")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
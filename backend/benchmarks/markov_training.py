@@ -0,0 +1,127 @@
+"""
+Markov Chord Model Benchmark
+============================
+Trains MarkovChordModel on a synthetic roman-numeral corpus (progressions
+drawn from the functional-harmony tables, one .txt file each) and reports:
+
+- training: files/s with one worker process and with --workers;
+- storage: .npz size, save and load times;
+- fit: mean held-out log-likelihood per chord for each order (higher
+  orders should not do worse on data from a first-order source);
+- sampling: notes/s of harmonize_melody (sampled path) with the trained
+  models against the built-in tables.
+
+Usage (from backend/):
+    python -m benchmarks.markov_training [--files 2000] [--orders 1 2 3] [--workers 4]
+                                         [--size 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from harmonizer import ChordProgressionGenerator, MIDIHarmonizer, PhraseDetector
+from key_context import MAJOR_TRANSITIONS
+from markov_model import CHORD_IDS, MODES, MarkovChordModel, collect_corpus, read_roman_numerals, train
+from benchmarks.synthetic import synthetic_melody
+
+SEED = 1
+PROGRESSIONS_PER_FILE = 8
+PROGRESSION_LENGTH = 16
+
+
+def write_corpus(directory, files, seed=SEED):
+    """Write `files` roman-numeral files of progressions sampled from the built-in tables."""
+    rng = random.Random(seed)
+    generator = ChordProgressionGenerator()
+    for i in range(files):
+        lines = []
+        for _ in range(PROGRESSIONS_PER_FILE):
+            mode = rng.choice(MODES)
+            chord = 'I' if mode == 'major' else 'i'
+            progression = [chord]
+            for _ in range(PROGRESSION_LENGTH - 1):
+                chord = generator.get_next_chord(chord, mode, rng)
+                progression.append(chord)
+            lines.append(f"{mode}: {' '.join(progression)}")
+        with open(os.path.join(directory, f'{i:05d}.txt'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def held_out_log_likelihood(model, paths):
+    """Mean log-likelihood per chord over the progressions in `paths`."""
+    total, chords = 0.0, 0
+    for path in paths:
+        for mode, chord_ids in read_roman_numerals(path):
+            total += model.log_likelihood(mode, chord_ids)
+            chords += len(chord_ids)
+    return total / chords
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--orders', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--size', type=int, default=10000, help='melody events for the sampling test')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = os.path.join(directory, 'corpus')
+        os.mkdir(corpus)
+        write_corpus(corpus, args.files)
+        paths = collect_corpus([corpus])
+        held_out = paths[:max(1, len(paths) // 10)]
+        training = paths[len(held_out):]
+
+        print(f"{'order':>5} {'1 worker s':>10} {f'{args.workers} workers s':>12} {'files/s':>9} "
+              f"{'npz KB':>7} {'save ms':>8} {'load ms':>8} {'loglik':>8}")
+        models = {}
+        for order in args.orders:
+            seconds = {}
+            for workers in (1, args.workers):
+                start = time.perf_counter()
+                model, _, failed = train(training, order, workers=workers)
+                seconds[workers] = time.perf_counter() - start
+                assert not failed, failed
+
+            model_path = os.path.join(directory, f'order{order}.npz')
+            start = time.perf_counter()
+            model.save(model_path)
+            save = time.perf_counter() - start
+            start = time.perf_counter()
+            models[order] = MarkovChordModel.load(model_path)
+            load = time.perf_counter() - start
+
+            print(f"{order:>5} {seconds[1]:>10.3f} {seconds[args.workers]:>12.3f} "
+                  f"{len(training) / seconds[args.workers]:>9,.0f} {os.path.getsize(model_path) / 1024:>7.1f} "
+                  f"{save * 1e3:>8.2f} {load * 1e3:>8.2f} {held_out_log_likelihood(models[order], held_out):>8.3f}")
+
+        # Sanity check: the corpus comes from the built-in tables, so order 1 should recover them
+        learned = models[min(models)].probabilities('major', [CHORD_IDS['major']['I']])[CHORD_IDS['major']['V']]
+        print(f"P(I -> V) built-in {MAJOR_TRANSITIONS['I']['V']:.3f}, learned {learned:.3f}")
+
+        melody = synthetic_melody(args.size, seed=args.size)
+        harmonizer = MIDIHarmonizer()
+        detected_key = harmonizer.analyze_key(melody)
+        boundaries = PhraseDetector.boundary_mask(melody)
+        notes = melody.note_count
+        print(f"{'tables':>12} {'seconds':>9} {'notes/s':>12}")
+        for label, path in [('built-in', None)] + [(f'order {o}', os.path.join(directory, f'order{o}.npz'))
+                                                    for o in args.orders]:
+            if path:
+                harmonizer.load_markov_model(path)
+            best = float('inf')
+            for _ in range(3):
+                start = time.perf_counter()
+                harmonizer.harmonize_melody(melody, detected_key, boundaries, seed=SEED)
+                best = min(best, time.perf_counter() - start)
+            print(f"{label:>12} {best:>9.4f} {notes / best:>12,.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
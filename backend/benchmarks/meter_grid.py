@@ -0,0 +1,137 @@
+"""
+Meter Grid Benchmark
+====================
+Harmonizes synthetic MIDI files in several meters and tempos and checks
+that the harmonic rhythm follows the file's meter:
+
+- every bass note of the sampled path starts a new harmonic slot (none
+  repeats within one), and how many land on a downbeat or mid-bar strong
+  beat;
+- the output file carries the input's time signatures and tempo map.
+
+Also times MeterIndex.grid (one vectorized pass per melody) against
+per-note scalar lookups.
+
+Usage (from backend/):
+    python -m benchmarks.meter_grid [--bars 64] [--size 100000]
+"""
+
+import argparse
+import io
+import sys
+import time
+
+import mido
+import numpy as np
+
+from harmonizer import MIDIHarmonizer
+from melody import Melody
+from meter import DOWNBEAT, STRONG_BEAT, MeterIndex
+from benchmarks.synthetic import synthetic_melody
+
+TICKS_PER_BEAT = 480
+SEED = 1
+
+# (name, time signatures, tempos), offsets in bars of the first signature
+METERS = [
+    ('4/4', [(0, 4, 4)], [(0, 500000)]),
+    ('3/4', [(0, 3, 4)], [(0, 500000)]),
+    ('6/8', [(0, 6, 8)], [(0, 600000)]),
+    ('4/4 fast', [(0, 4, 4)], [(0, 250000)]),
+    ('3/4 -> 6/8', [(0, 3, 4), (0.5, 6, 8)], [(0, 500000), (0.5, 350000)]),
+]
+
+
+def write_test_file(signatures, tempos, bars, seed=SEED):
+    """MIDI file of `bars` bars of eighth/quarter notes under the given meter changes."""
+    rng = np.random.default_rng(seed)
+    bar_length = signatures[0][1] * 4 / signatures[0][2]
+    total = bars * bar_length
+    meta = [(round(fraction * total * TICKS_PER_BEAT), mido.MetaMessage('time_signature', numerator=n, denominator=d))
+            for fraction, n, d in signatures]
+    meta += [(round(fraction * total * TICKS_PER_BEAT), mido.MetaMessage('set_tempo', tempo=tempo))
+             for fraction, tempo in tempos]
+
+    notes = []
+    onset = 0.0
+    while onset < total:
+        duration = float(rng.choice([0.5, 1.0]))
+        notes.append((round(onset * TICKS_PER_BEAT), round((onset + duration) * TICKS_PER_BEAT),
+                      int(60 + rng.choice([0, 2, 4, 5, 7, 9, 11, 12]))))
+        onset += duration
+
+    events = meta + [(start, mido.Message('note_on', note=p, velocity=80)) for start, _, p in notes]
+    events += [(end, mido.Message('note_off', note=p, velocity=0)) for _, end, p in notes]
+    events.sort(key=lambda e: (e[0], e[1].type == 'note_on'))
+
+    track = mido.MidiTrack()
+    tick = 0
+    for event_tick, message in events:
+        track.append(message.copy(time=event_tick - tick))
+        tick = event_tick
+    midi_file = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    midi_file.tracks.append(track)
+    buffer = io.BytesIO()
+    midi_file.save(file=buffer)
+    return buffer.getvalue()
+
+
+def check_meter(harmonizer, data):
+    """(bass notes, bass notes repeating a slot, share on strong beats, meta events preserved) for one file."""
+    melody = Melody.from_midi(io.BytesIO(data))
+    output = io.BytesIO()
+    harmonizer.harmonize(io.BytesIO(data), output, seed=SEED)
+    result = mido.MidiFile(file=io.BytesIO(output.getvalue()))
+
+    bass_onsets = []
+    tick = 0
+    for message in result.tracks[-1]:
+        tick += message.time
+        if message.type == 'note_on' and message.velocity:
+            bass_onsets.append(tick / TICKS_PER_BEAT)
+    grid = melody.meter.grid(bass_onsets)
+    repeated = np.count_nonzero(np.diff(grid.slots) <= 0)
+    strong = np.mean(grid.strengths >= STRONG_BEAT)
+
+    def meter_events(midi_file):
+        events, tick = [], 0
+        for message in midi_file.tracks[0]:
+            tick += message.time
+            if message.type in ('time_signature', 'set_tempo'):
+                events.append((tick, message.type, getattr(message, 'numerator', None), getattr(message, 'tempo', None)))
+        return sorted(events)
+
+    kept = meter_events(result) == meter_events(mido.MidiFile(file=io.BytesIO(data)))
+    return len(bass_onsets), int(repeated), float(strong), kept
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bars', type=int, default=64)
+    parser.add_argument('--size', type=int, default=100000, help='events for the grid timing')
+    args = parser.parse_args(argv)
+
+    harmonizer = MIDIHarmonizer()
+    print(f"{'meter':>12} {'bass notes':>10} {'repeated':>8} {'strong':>7} {'meta kept':>9}")
+    for name, signatures, tempos in METERS:
+        data = write_test_file(signatures, tempos, args.bars)
+        notes, repeated, strong, kept = check_meter(harmonizer, data)
+        print(f"{name:>12} {notes:>10} {repeated:>8} {strong:>7.0%} {str(kept):>9}")
+
+    melody = synthetic_melody(args.size, seed=args.size)
+    meter = MeterIndex([(0.0, 3, 4), (melody.onsets[-1] / 2, 6, 8)], [(0.0, 500000), (melody.onsets[-1] / 3, 400000)])
+    start = time.perf_counter()
+    grid = meter.grid(melody.onsets)
+    vectorized = time.perf_counter() - start
+    start = time.perf_counter()
+    scalar = [meter.slot(onset) for onset in melody.onsets.tolist()]
+    per_note = time.perf_counter() - start
+    assert scalar == grid.slots.tolist()
+    downbeats = np.count_nonzero(grid.strengths == DOWNBEAT)
+    print(f"grid of {len(melody)} onsets ({downbeats} downbeats): {vectorized * 1e3:.1f} ms vectorized, "
+          f"{per_note * 1e3:.1f} ms with per-note bisection")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Phrase Detection Scaling Benchmark
+==================================
+Times PhraseDetector.boundary_mask on synthetic melodies of growing size
+and reports time per event. Linear scaling shows up as a flat
+microseconds-per-event column.
+
+Usage (from backend/):
+    python -m benchmarks.phrase_scaling [--sizes 1000 10000 100000 1000000]
+"""
+
+import argparse
+import time
+
+from harmonizer import PhraseDetector
+from benchmarks.synthetic import synthetic_melody
+
+
+def time_boundary_mask(melody, repeats=5):
+    """Best-of-N wall time of one boundary_mask call, in seconds."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        PhraseDetector.boundary_mask(melody)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'events':>10} {'seconds':>10} {'us/event':>10}")
+    for size in args.sizes:
+        melody = synthetic_melody(size)
+        seconds = time_boundary_mask(melody, args.repeats)
+        print(f"{size:>10} {seconds:>10.4f} {seconds / size * 1e6:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
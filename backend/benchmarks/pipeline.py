@@ -0,0 +1,217 @@
+"""
+Harmonization Pipeline Benchmark
+================================
+Times every stage of MIDIHarmonizer.harmonize on synthetic melodies:
+
+- parse:     Melody.from_midi on an in-memory MIDI file
+- key:       analyze_key (profile detector)
+- phrases:   PhraseDetector.boundary_mask
+- harmonize: harmonize_melody (chord, harmony and bass passes)
+- write:     write_midi to an in-memory file
+
+For each size and mode it reports wall time and throughput (notes/s) per
+stage, then re-runs the stages under tracemalloc for peak memory and the
+number of memory blocks each stage allocated and kept. Results can be
+saved as JSON and compared against an earlier run; the comparison exits
+non-zero when a stage got slower than --tolerance allows.
+
+Usage (from backend/):
+    python -m benchmarks.pipeline [--sizes 100 1000 10000 100000] [--modes major minor]
+                                  [--harmonization sampled] [--output results.json]
+                                  [--compare baseline.json] [--tolerance 1.25]
+"""
+
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import mido
+import numpy as np
+
+from harmonizer import HARMONIZATION_MODES, MIDIHarmonizer, PhraseDetector
+from melody import Melody
+from midi_writer import TICKS_PER_BEAT, voice_track, write_midi
+from benchmarks.synthetic import synthetic_melody
+
+STAGES = ('parse', 'key', 'phrases', 'harmonize', 'write')
+SEED = 1
+
+
+def melody_midi_bytes(melody):
+    """A single-track MIDI file holding just the melody, as the upload would."""
+    midi_file = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+    midi_file.tracks.append(voice_track('Melody', melody, 0, 0))
+    buffer = io.BytesIO()
+    midi_file.save(file=buffer)
+    return buffer.getvalue()
+
+
+def pipeline_stages(harmonizer, data, harmonization):
+    """Yield (stage name, callable) pairs; each callable runs one stage on the previous results."""
+    results = {}
+
+    def parse():
+        results['melody'] = Melody.from_midi(io.BytesIO(data))
+
+    def key():
+        results['key'] = harmonizer.analyze_key(results['melody'])
+
+    def phrases():
+        results['mask'] = PhraseDetector.boundary_mask(results['melody'])
+
+    def harmonize():
+        results['voices'] = harmonizer.harmonize_melody(
+            results['melody'], results['key'], results['mask'], seed=SEED, mode=harmonization
+        )
+
+    def write():
+        write_midi(results['melody'], *results['voices'], results['key'], io.BytesIO())
+
+    return list(zip(STAGES, (parse, key, phrases, harmonize, write)))
+
+
+def time_stages(harmonizer, data, harmonization, repeats):
+    """Best-of-N seconds per stage."""
+    best = dict.fromkeys(STAGES, float('inf'))
+    for _ in range(repeats):
+        for name, stage in pipeline_stages(harmonizer, data, harmonization):
+            start = time.perf_counter()
+            stage()
+            best[name] = min(best[name], time.perf_counter() - start)
+    return best
+
+
+def memory_stages(harmonizer, data, harmonization):
+    """Peak traced bytes and net allocated blocks per stage."""
+    memory = {}
+    tracemalloc.start()
+    try:
+        for name, stage in pipeline_stages(harmonizer, data, harmonization):
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            stage()
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+            memory[name] = {'peak_bytes': peak - base, 'allocated_blocks': blocks}
+    finally:
+        tracemalloc.stop()
+    return memory
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, modes, harmonization, repeats, rest_probability, memory=True):
+    harmonizer = MIDIHarmonizer()
+    runs = []
+    for mode in modes:
+        for size in sizes:
+            melody = synthetic_melody(size, mode=mode, rest_probability=rest_probability, seed=size)
+            data = melody_midi_bytes(melody)
+            notes = melody.note_count
+            seconds = time_stages(harmonizer, data, harmonization, repeats)
+            stage_memory = memory_stages(harmonizer, data, harmonization) if memory else {}
+
+            stages = {
+                name: {
+                    'seconds': seconds[name],
+                    'notes_per_second': notes / seconds[name] if seconds[name] > 0 else None,
+                    **stage_memory.get(name, {}),
+                }
+                for name in STAGES
+            }
+            total = sum(seconds.values())
+            runs.append({
+                'events': size, 'notes': notes, 'mode': mode, 'stages': stages,
+                'total_seconds': total, 'notes_per_second': notes / total if total > 0 else None,
+            })
+            print_run(runs[-1])
+    return runs
+
+
+def print_run(result):
+    print(f"\n{result['mode']} {result['events']} events ({result['notes']} notes): "
+          f"{result['total_seconds']:.4f}s, {result['notes_per_second']:,.0f} notes/s")
+    print(f"  {'stage':<10} {'seconds':>10} {'notes/s':>14} {'peak KiB':>10} {'blocks':>8}")
+    for name, stage in result['stages'].items():
+        peak = stage.get('peak_bytes')
+        print(f"  {name:<10} {stage['seconds']:>10.4f} {stage['notes_per_second'] or 0:>14,.0f} "
+              f"{peak / 1024 if peak is not None else float('nan'):>10.1f} {stage.get('allocated_blocks', ''):>8}")
+
+
+def compare(runs, baseline_path, tolerance):
+    """Print per-stage time ratios against a saved run; returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = {(r['mode'], r['events']): r for r in json.load(f)['runs']}
+
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (ratio = now / before, tolerance {tolerance:.2f}x)")
+    for result in runs:
+        before = baseline.get((result['mode'], result['events']))
+        if not before:
+            continue
+        ratios = []
+        for name in STAGES:
+            if name not in before['stages']:
+                continue
+            ratio = result['stages'][name]['seconds'] / max(before['stages'][name]['seconds'], 1e-9)
+            flag = ''
+            if ratio > tolerance:
+                regressions += 1
+                flag = '!'
+            ratios.append(f"{name} {ratio:.2f}x{flag}")
+        print(f"  {result['mode']} {result['events']}: " + ', '.join(ratios))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--modes', nargs='+', choices=('major', 'minor'), default=['major', 'minor'])
+    parser.add_argument('--harmonization', choices=HARMONIZATION_MODES, default='sampled')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--rest-probability', type=float, default=0.05)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    runs = run(args.sizes, args.modes, args.harmonization, args.repeats, args.rest_probability,
+               memory=not args.no_memory)
+
+    if args.output:
+        report = {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'harmonization': args.harmonization,
+            'repeats': args.repeats,
+            'runs': runs,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to: {args.output}")
+
+    if args.compare:
+        return 1 if compare(runs, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
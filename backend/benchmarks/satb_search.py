@@ -0,0 +1,105 @@
+"""
+Four-Part Search Benchmark
+==========================
+Times harmonize_melody in 'satb' mode against the two-voice paths
+('sampled' and 'optimal') on synthetic melodies of growing size, and
+checks the four-part output against the voice-leading rules:
+
+- parallel fifths/octaves between every voice pair at each chord change,
+  counted with VoiceLeadingChecker (the scalar reference);
+- voice crossing (bass < tenor <= alto <= soprano) and spacing: alto-tenor
+  and tenor-bass are enforced by the voicing tables, soprano-alto is a
+  soft cost and reported on its own ('soprano spacing');
+- alto/tenor/bass ranges.
+
+Per-note time should stay flat as melodies grow (linear cost).
+
+Usage (from backend/):
+    python -m benchmarks.satb_search [--sizes 100 1000 10000 100000] [--repeats 3]
+"""
+
+import argparse
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from harmonizer import MIDIHarmonizer, PhraseDetector, VoiceLeadingChecker
+from satb import ALTO_RANGE, BASS_RANGE, MAX_BASS_SPACING, MAX_UPPER_SPACING, TENOR_RANGE
+from benchmarks.synthetic import synthetic_melody
+
+MODES = ('sampled', 'optimal', 'satb')
+SEED = 1
+
+
+def time_mode(harmonizer, melody, detected_key, boundaries, mode, repeats):
+    """Best-of-N seconds for harmonize_melody, plus the voices of the last run."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        voices = harmonizer.harmonize_melody(melody, detected_key, boundaries, seed=SEED, mode=mode)
+        best = min(best, time.perf_counter() - start)
+    return best, voices
+
+
+def rule_violations(melody, alto, tenor, bass):
+    """Count rule violations of a four-part harmonization, by rule."""
+    # Soprano sounding at each chord change (the melody note starting at or before it)
+    notes = melody.note_mask
+    onsets = melody.onsets[notes]
+    melody_pitches = melody.pitches[notes].astype(np.int64)
+    entering = melody_pitches[np.searchsorted(onsets, alto.onsets, side='right') - 1]
+    # ...and the last one before the next change
+    leaving = melody_pitches[np.searchsorted(onsets, np.append(alto.onsets[1:], np.inf), side='left') - 1]
+
+    parts = np.stack([entering, alto.pitches, tenor.pitches, bass.pitches], axis=1).astype(np.int64)
+    violations = dict.fromkeys(('parallels', 'crossing', 'spacing', 'range', 'soprano spacing'), 0)
+
+    for k in range(1, len(parts)):
+        prev = [int(leaving[k - 1])] + parts[k - 1, 1:].tolist()
+        curr = parts[k].tolist()
+        for upper, lower in itertools.combinations(range(4), 2):
+            if (VoiceLeadingChecker.is_parallel_fifth(prev[upper], prev[lower], curr[upper], curr[lower])
+                    or VoiceLeadingChecker.is_parallel_octave(prev[upper], prev[lower], curr[upper], curr[lower])):
+                violations['parallels'] += 1
+
+    soprano, a, t, b = parts.T
+    violations['crossing'] = int(np.count_nonzero((a > soprano) | (t > a) | (b >= t)))
+    violations['spacing'] = int(np.count_nonzero((a - t > MAX_UPPER_SPACING) | (t - b > MAX_BASS_SPACING)))
+    violations['soprano spacing'] = int(np.count_nonzero(soprano - a > MAX_UPPER_SPACING))
+    violations['range'] = int(sum(
+        np.count_nonzero((voice < low) | (voice > high))
+        for voice, (low, high) in ((a, ALTO_RANGE), (t, TENOR_RANGE), (b, BASS_RANGE))
+    ))
+    return violations, len(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    harmonizer = MIDIHarmonizer().warm_up()
+    print(f"{'events':>8} {'mode':>8} {'seconds':>9} {'us/note':>9} {'notes/s':>12}")
+    for size in args.sizes:
+        melody = synthetic_melody(size, seed=size)
+        detected_key = harmonizer.analyze_key(melody)
+        boundaries = PhraseDetector.boundary_mask(melody)
+        harmonizer.satb_search.key_tables(detected_key)   # built once per key, not part of the search
+        notes = melody.note_count
+
+        for mode in MODES:
+            seconds, voices = time_mode(harmonizer, melody, detected_key, boundaries, mode, args.repeats)
+            print(f"{size:>8} {mode:>8} {seconds:>9.4f} {seconds / notes * 1e6:>9.1f} {notes / seconds:>12,.0f}")
+
+        (alto, tenor), bass = voices
+        violations, chords = rule_violations(melody, alto, tenor, bass)
+        print(f"{'':>8} satb rule check over {chords} chord changes: "
+              + ', '.join(f'{rule} {count}' for rule, count in violations.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Startup Budget Check
+====================
+Imports the Flask app in a fresh interpreter (in a scratch directory, so
+no uploads/outputs/jobs database is touched) and checks that:
+
+- the import, including the warm-up hook, finishes within --budget seconds
+  (best of --repeats runs);
+- none of the heavy optional libraries (music21, TensorFlow, pretty_midi)
+  were imported on the way.
+
+Exits non-zero when either check fails, so it can gate CI.
+
+Usage (from backend/):
+    python -m benchmarks.startup [--budget 1.0] [--repeats 3]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+LAZY_MODULES = ('music21', 'tensorflow', 'pretty_midi')
+
+PROBE = '''
+import json, sys, time
+sys.path.insert(0, {backend!r})
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+'''
+
+
+def measure_import(backend_dir):
+    """Seconds to import app in a new interpreter, and the lazy modules it loaded."""
+    with tempfile.TemporaryDirectory() as scratch:
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE.format(backend=backend_dir, lazy=LAZY_MODULES)],
+            cwd=scratch, capture_output=True, text=True, check=True,
+        )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report['seconds'], report['loaded']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=1.0, help='maximum import time in seconds')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [measure_import(backend_dir) for _ in range(args.repeats)]
+    best = min(seconds for seconds, _ in runs)
+    loaded = sorted({module for _, modules in runs for module in modules})
+
+    print(f"import app: best {best:.3f}s of {args.repeats} (budget {args.budget:.3f}s)")
+    failed = False
+    if best > args.budget:
+        print("FAIL: startup is over budget")
+        failed = True
+    if loaded:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""
+Synthetic Melodies
+==================
+Reproducible random melodies for benchmarks: a stepwise walk over a major
+or minor scale with mixed rhythms and occasional rests.
+"""
+
+import numpy as np
+
+from melody import Melody, REST
+
+SCALE_STEPS = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+}
+
+DURATIONS = np.array([0.5, 1.0, 1.0, 1.5, 2.0])
+
+
+def synthetic_melody(num_events, mode='major', tonic=60, rest_probability=0.05, seed=0):
+    """Random-walk melody of `num_events` events (notes and rests)."""
+    rng = np.random.default_rng(seed)
+    steps = np.array(SCALE_STEPS[mode])
+
+    # Scale-degree random walk kept within two octaves
+    walk = np.cumsum(rng.choice([-2, -1, -1, 1, 1, 2], size=num_events))
+    degrees = np.abs((walk + 7) % 28 - 14)
+    pitches = tonic + 12 * (degrees // 7) + steps[degrees % 7]
+    pitches[rng.random(num_events) < rest_probability] = REST
+
+    durations = rng.choice(DURATIONS, size=num_events)
+    onsets = np.concatenate([[0.0], np.cumsum(durations)[:-1]])
+    return Melody(onsets, durations, pitches)
@@ -0,0 +1,190 @@
+"""
+Learned Chord Prediction
+========================
+Optional sequence model that predicts the chord under each melody note,
+used by the sampled path in place of the melody-weighted Markov draw
+(`MIDIHarmonizer.find_best_chord_for_melody`).
+
+Features are built for the whole melody at once: every note gets a
+vector (pitch class relative to the tonic, log duration, downbeat and
+phrase-end flags, mode) and the model sees a window of WINDOW_BEFORE
+notes before and WINDOW_AFTER notes after it. Its output is a softmax
+over the seven diatonic chords of the key, in KeyContext.numerals order.
+
+Inference is CPU-only. The Keras model is loaded on first use, once per
+process (after fork under a pre-forking server, since TensorFlow does not
+survive fork), and concurrent callers are batched: requests queued while
+a forward pass runs are concatenated into the next one.
+"""
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from meter import DOWNBEAT
+
+logger = logging.getLogger(__name__)
+
+WINDOW_BEFORE = 4
+WINDOW_AFTER = 3
+WINDOW = WINDOW_BEFORE + 1 + WINDOW_AFTER
+
+# 12 relative pitch classes, log2 duration, downbeat, phrase end, minor mode
+NUM_FEATURES = 16
+NUM_CHORDS = 7
+
+# Rows per forward pass; queued requests are merged up to this size
+MAX_BATCH_ROWS = 8192
+
+
+def note_features(melody, note_indices, detected_key, phrase_boundaries):
+    """One feature row per note in `note_indices`, as float32 (notes, NUM_FEATURES)."""
+    n = len(note_indices)
+    features = np.zeros((n, NUM_FEATURES), dtype=np.float32)
+    relative = (melody.pitches[note_indices].astype(np.int64) - detected_key.tonic) % 12
+    features[np.arange(n), relative] = 1.0
+    features[:, 12] = np.log2(np.maximum(melody.durations[note_indices], 1 / 16))
+    features[:, 13] = melody.grid.strengths[note_indices] == DOWNBEAT
+    features[:, 14] = phrase_boundaries[note_indices]
+    features[:, 15] = detected_key.mode == 'minor'
+    return features
+
+
+def melody_windows(melody, detected_key, phrase_boundaries):
+    """
+    Model input for every note of `melody`: (notes, WINDOW, NUM_FEATURES)
+    float32, zero-padded at both ends. Returns (note_indices, windows).
+    """
+    note_indices = np.flatnonzero(melody.note_mask)
+    features = note_features(melody, note_indices, detected_key, phrase_boundaries)
+    padded = np.pad(features, ((WINDOW_BEFORE, WINDOW_AFTER), (0, 0)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (WINDOW, NUM_FEATURES))[:, 0]
+    return note_indices, np.ascontiguousarray(windows)
+
+
+def training_arrays(melody, detected_key, phrase_boundaries, chords):
+    """
+    (windows, labels) for training: `chords` holds one numeral per note
+    of `melody` (e.g. choose_chords output or an annotated corpus).
+    """
+    _, windows = melody_windows(melody, detected_key, phrase_boundaries)
+    labels = np.array([detected_key.numerals.index(detected_key.resolve(c)) for c in chords], dtype=np.int64)
+    return windows, labels
+
+
+def build_chord_model():
+    """Untrained Keras model mapping (WINDOW, NUM_FEATURES) windows to chord probabilities."""
+    keras = _import_keras()
+    model = keras.Sequential([
+        keras.layers.Input(shape=(WINDOW, NUM_FEATURES)),
+        keras.layers.Conv1D(64, 3, padding='same', activation='relu'),
+        keras.layers.Flatten(),
+        keras.layers.Dense(64, activation='relu'),
+        keras.layers.Dense(NUM_CHORDS, activation='softmax'),
+    ])
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def _import_keras():
+    """Import Keras with GPUs hidden, so inference stays on the CPU."""
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+    import tensorflow as tf
+    try:
+        tf.config.set_visible_devices([], 'GPU')
+    except RuntimeError:
+        pass   # devices already initialized by an earlier import
+    return tf.keras
+
+
+class ChordPredictor:
+    """
+    Batched CPU inference for a chord model, loaded from `model_path` on
+    first use (or wrapping an already built `model`).
+    """
+
+    def __init__(self, model_path=None, model=None, max_batch_rows=MAX_BATCH_ROWS):
+        self.model_path = model_path
+        self.max_batch_rows = max_batch_rows
+        self._model = model
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.forward_passes = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = _import_keras().models.load_model(self.model_path)
+                    logger.info("Chord model loaded from %s", self.model_path)
+        return self._model
+
+    def predict(self, windows):
+        """Chord probabilities (rows, NUM_CHORDS) for model input `windows`."""
+        if len(windows) == 0:
+            return np.zeros((0, NUM_CHORDS), dtype=np.float32)
+        return self.submit(windows).result()
+
+    def submit(self, windows):
+        """Queue `windows` for the next forward pass; returns a Future of the probabilities."""
+        future = Future()
+        self._queue.put((windows, future))
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='chord-model', daemon=True)
+                    self._worker.start()
+        return future
+
+    def predict_melody(self, melody, detected_key, phrase_boundaries):
+        """Chord probabilities per melody event (len(melody), NUM_CHORDS); rest rows are zero."""
+        note_indices, windows = melody_windows(melody, detected_key, phrase_boundaries)
+        probabilities = np.zeros((len(melody), NUM_CHORDS), dtype=np.float32)
+        probabilities[note_indices] = self.predict(windows)
+        return probabilities
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            rows = len(pending[0][0])
+            # Merge whatever else queued up during the previous pass
+            while rows < self.max_batch_rows:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+
+            try:
+                batch = np.concatenate([windows for windows, _ in pending])
+                outputs = np.asarray(self.model.predict_on_batch(batch), dtype=np.float32)
+                self.forward_passes += 1
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for windows, future in pending:
+                future.set_result(outputs[start:start + len(windows)])
+                start += len(windows)
+
+
+_PREDICTORS = {}
+_PREDICTORS_LOCK = threading.Lock()
+
+
+def load_chord_predictor(model_path):
+    """Shared ChordPredictor per model file, so each process loads a model once."""
+    model_path = os.path.abspath(model_path)
+    with _PREDICTORS_LOCK:
+        if model_path not in _PREDICTORS:
+            _PREDICTORS[model_path] = ChordPredictor(model_path)
+        return _PREDICTORS[model_path]
@@ -0,0 +1,523 @@
+"""
+Chunked Harmonization
+=====================
+Memory-bounded harmonize() for very long MIDI files: the melody is read,
+harmonized and written in phrase-sized windows, so peak memory depends on
+CHUNK_EVENTS and not on the length of the input.
+
+The file is never loaded as a whole. MThd/MTrk chunk offsets are read
+first and every track is then read lazily in READ_BLOCK blocks, event
+by event, with mido's own message readers (so malformed input fails as
+it does for mido.MidiFile), in three passes:
+
+1. meta scan: time signatures and tempo changes (the MeterIndex) and the
+   first track with pitched notes, one track after the other;
+2. extraction: note events of the selected tracks, merged in tick order,
+   go through a streaming skyline and the same rest/overlap rules as
+   Melody.from_notes. Melody events are spooled to a temporary file while
+   the key histogram, mean duration and counts are accumulated;
+3. harmonization: the spool is read back in blocks. Phrase boundaries
+   are decided BOUNDARY_CONTEXT events behind the read position (each
+   cue looks at its neighbours) with the global mean duration, complete
+   phrases go through MIDIHarmonizer.harmonize_phrases with the PhraseState
+   (current chord, previous harmony, melody and bass pitches) carried from
+   window to window, and the voices are handed to TrackSpools that encode
+   every event no later note can precede.
+
+The output is the same file harmonize() writes (mode 'sampled', Markov
+chords, mido ingest and writer, profile key detection) for the same
+seed. Only pathological input departs from it: a phrase running past
+MAX_PHRASE_EVENTS without a boundary is cut there, and a note held open
+while MAX_PENDING_NOTES later notes finish is dropped.
+"""
+
+import heapq
+import io
+import math
+import tempfile
+from operator import itemgetter
+
+import numpy as np
+from mido.midifiles.midifiles import (
+    read_byte,
+    read_chunk_header,
+    read_file_header,
+    read_message,
+    read_meta_message,
+    read_sysex,
+    read_variable_int,
+)
+
+from extraction import DRUM_CHANNEL, LEGATO_OVERLAP
+from key_detection import get_key_detector
+from melody import MIN_REST_LENGTH, REST, Melody, Voice
+from meter import MeterIndex
+from metrics import NOTES_PROCESSED, span
+from midi_writer import TICKS_PER_BEAT, VOICE_PROGRAMS, TrackSpool, conductor_track, write_spooled_midi
+
+# Melody events per window read back from the spool
+CHUNK_EVENTS = 4096
+
+# A phrase longer than this (events) is harmonized in pieces
+MAX_PHRASE_EVENTS = 4 * CHUNK_EVENTS
+
+# Finished notes waiting on an older note that is still held before it is
+# given up on (the skyline needs notes in onset order)
+MAX_PENDING_NOTES = 4 * CHUNK_EVENTS
+
+# Events on each side a boundary decision looks at (cues see one
+# neighbour, the periodic rule cues two events away)
+BOUNDARY_CONTEXT = 3
+
+# Bytes read from a track at a time
+READ_BLOCK = 1 << 14
+
+# Melody events in the spool file
+EVENT_DTYPE = np.dtype([('onset', '<f8'), ('duration', '<f8'), ('pitch', '<i2')])
+
+# === LAZY MIDI READER ===
+
+class _TrackStream:
+    """
+    File view of the events of one MTrk chunk, read from a seekable binary
+    file READ_BLOCK bytes at a time. Reads stop at the end of the chunk.
+    Only read() is provided, which is all mido's readers use; a read past
+    the end of the chunk raises EOFError.
+    """
+
+    __slots__ = ('source', 'position', 'remaining', 'buffer', 'index')
+
+    def __init__(self, source, offset, length):
+        self.source = source
+        self.position = offset
+        self.remaining = length
+        self.buffer = b''
+        self.index = 0
+
+    @property
+    def exhausted(self):
+        return self.index >= len(self.buffer) and self.remaining <= 0
+
+    def read(self, size):
+        start = self.index
+        if start + size <= len(self.buffer):
+            self.index = start + size
+            return self.buffer[start:self.index]
+        if self.remaining > 0:
+            # Tracks share the file object, so every refill seeks first
+            self.source.seek(self.position)
+            block = self.source.read(max(min(READ_BLOCK, self.remaining), size))
+            self.position += len(block)
+            self.remaining = self.remaining - len(block) if block else 0
+            self.buffer = self.buffer[self.index:] + block
+            self.index = 0
+        if len(self.buffer) - self.index < size:
+            raise EOFError('MIDI track ends in the middle of an event')
+        start = self.index
+        self.index += size
+        return self.buffer[start:self.index]
+
+
+def read_layout(source):
+    """(ticks_per_beat, [(offset, length) of each MTrk chunk]) of a seekable binary file."""
+    source.seek(0)
+    _, num_tracks, ticks_per_beat = read_file_header(source)
+    chunks = []
+    for _ in range(num_tracks):
+        name, length = read_chunk_header(source)
+        if name != b'MTrk':
+            raise OSError('no MTrk header at start of track')
+        chunks.append((source.tell(), length))
+        source.seek(length, io.SEEK_CUR)
+    return ticks_per_beat, chunks
+
+
+def track_messages(source, offset, length):
+    """
+    Yield (tick, message) for every event of one MTrk chunk: the loop of
+    mido's read_track, without keeping the track. Messages are parsed
+    (and rejected) by mido's own readers.
+    """
+    stream = _TrackStream(source, offset, length)
+    tick = 0
+    last_status = None
+    while not stream.exhausted:
+        tick += read_variable_int(stream)
+        status = read_byte(stream)
+        peek = []
+        if status < 0x80:
+            if last_status is None:
+                raise OSError('running status without last_status')
+            peek = [status]
+            status = last_status
+        elif status != 0xFF:
+            # Meta events don't set running status
+            last_status = status
+
+        if status == 0xFF:
+            yield tick, read_meta_message(stream, 0)
+        elif status in (0xF0, 0xF7):
+            yield tick, read_sysex(stream, 0)
+        else:
+            yield tick, read_message(stream, status, peek, 0)
+
+
+def scan_meta(source, chunks):
+    """
+    Pass 1: (time signatures, tempos, first note track). Meter events are
+    (tick, ...) as MeterIndex.from_midi_events takes them; the note track
+    is the first with a finished non-drum note (None if there is none).
+    """
+    time_signatures, tempos = [], []
+    first_note_track = None
+    for track_index, (offset, length) in enumerate(chunks):
+        open_notes = {}
+        for tick, message in track_messages(source, offset, length):
+            if message.type == 'time_signature':
+                time_signatures.append((tick, message.numerator, message.denominator))
+            elif message.type == 'set_tempo':
+                tempos.append((tick, message.tempo))
+            elif (first_note_track is None and message.type in ('note_on', 'note_off')
+                  and message.channel != DRUM_CHANNEL):
+                key = (message.channel, message.note)
+                if message.type == 'note_on' and message.velocity > 0:
+                    open_notes[key] = open_notes.get(key, 0) + 1
+                elif open_notes.get(key):
+                    first_note_track = track_index
+    return time_signatures, tempos, first_note_track
+
+
+# === STREAMING EXTRACTION ===
+
+def _tagged(messages, track_index):
+    for tick, message in messages:
+        yield tick, track_index, message
+
+
+def selected_notes(source, chunks, tracks, channels=None, programs=None):
+    """
+    Yield (onset tick, end tick, pitch) of the selected notes of `tracks`
+    in the order the skyline visits them: by onset, highest first, then
+    track and closing order (as NoteEvents lays them out). Notes pair
+    note-ons and note-offs FIFO per track, channel and note; `channels` and
+    `programs` select as in NoteEvents.select.
+    """
+    merged = heapq.merge(
+        *(_tagged(track_messages(source, *chunks[t]), t) for t in tracks), key=itemgetter(0)
+    )
+    drums = channels is not None and DRUM_CHANNEL in channels
+    channels = None if channels is None else set(channels)
+    programs = None if programs is None else set(programs)
+
+    channel_programs = {}
+    open_notes = {}       # (track, channel, note) -> [[onset, selected, channel, counted], ...] in FIFO order
+    open_onsets = []      # heap of the onsets of open notes, removed lazily
+    open_counts = {}      # onset -> open notes starting there
+    unresolved = []       # notes started at the current tick, before its program changes are known
+    finished = []         # heap of (onset, -pitch, track, sequence, end, note)
+    sequences = [0] * (max(tracks) + 1 if tracks else 0)
+    floor = 0             # open notes started before this tick have been given up on
+    current_tick = 0
+
+    def release(bound):
+        while open_onsets and (open_onsets[0] < floor or not open_counts.get(open_onsets[0])):
+            heapq.heappop(open_onsets)
+        if open_onsets:
+            bound = min(bound, open_onsets[0])
+        while finished and finished[0][0] < bound:
+            onset, negative_pitch, _, _, end, note = heapq.heappop(finished)
+            if note[1]:
+                yield onset, end, -negative_pitch
+
+    for tick, track_index, message in merged:
+        if tick != current_tick:
+            # Program changes at a note's start tick apply to it, in any track
+            for note in unresolved:
+                note[1] = channel_programs.get(note[2], 0) in programs
+            unresolved = []
+            yield from release(tick)
+            current_tick = tick
+            # Give up on the oldest held notes while too many finished ones wait on them
+            while len(finished) > MAX_PENDING_NOTES and open_onsets:
+                floor = open_onsets[0] + 1
+                yield from release(tick)
+
+        kind = message.type
+        if kind == 'program_change':
+            channel_programs[message.channel] = message.program
+            continue
+        if kind not in ('note_on', 'note_off'):
+            continue
+        channel = message.channel
+        key = (track_index, channel, message.note)
+        if kind == 'note_on' and message.velocity > 0:
+            selected = (drums or channel != DRUM_CHANNEL) and (channels is None or channel in channels)
+            note = [tick, selected, channel, selected]
+            if selected and programs is not None:
+                unresolved.append(note)
+            open_notes.setdefault(key, []).append(note)
+            if selected:
+                open_counts[tick] = open_counts.get(tick, 0) + 1
+                heapq.heappush(open_onsets, tick)
+        elif open_notes.get(key):
+            note = open_notes[key].pop(0)
+            sequences[track_index] += 1
+            if note[3]:
+                open_counts[note[0]] -= 1
+                if not open_counts[note[0]]:
+                    del open_counts[note[0]]
+            if note[1] and note[0] >= floor:
+                heapq.heappush(finished, (note[0], -message.note, track_index, sequences[track_index], tick, note))
+
+    for note in unresolved:
+        note[1] = channel_programs.get(note[2], 0) in programs
+    # Notes never closed are dropped (as NoteEvents does)
+    open_onsets.clear()
+    yield from release(math.inf)
+
+
+def skyline_notes(notes, ticks_per_beat, overlap=LEGATO_OVERLAP):
+    """
+    Streaming extraction.skyline over notes in visiting order: yield
+    (onset, duration, pitch) in quarter lengths of every kept note.
+    """
+    ticks_per_beat = float(ticks_per_beat)
+    sounding = []
+    limit = CHUNK_EVENTS
+    for onset_tick, end_tick, pitch in notes:
+        onset, end = onset_tick / ticks_per_beat, end_tick / ticks_per_beat
+        while sounding and sounding[0][1] <= onset + overlap:
+            heapq.heappop(sounding)
+        if not sounding or pitch >= -sounding[0][0]:
+            yield onset, end - onset, pitch
+        heapq.heappush(sounding, (-pitch, end))
+
+        # Ended notes below a long held one are only dropped lazily; prune them
+        if len(sounding) > limit:
+            sounding = [entry for entry in sounding if entry[1] > onset + overlap]
+            heapq.heapify(sounding)
+            limit = max(CHUNK_EVENTS, 2 * len(sounding))
+
+
+def melody_events(notes, min_rest=MIN_REST_LENGTH):
+    """
+    Melody.from_notes over notes already in (onset, highest pitch first)
+    order: yield (onset, duration, pitch) events with rests, one note of
+    lookahead to cut overlaps.
+    """
+    cursor = 0.0
+    previous = None
+    for note in notes:
+        if previous is not None:
+            if note[0] == previous[0]:
+                continue
+            onset, duration, midi = previous
+            if onset - cursor >= min_rest:
+                yield cursor, onset - cursor, REST
+            cursor = min(onset + duration, note[0])
+            yield onset, cursor - onset, midi
+        previous = note
+
+    if previous is not None:
+        onset, duration, midi = previous
+        if onset - cursor >= min_rest:
+            yield cursor, onset - cursor, REST
+        yield onset, duration, midi
+
+
+class MelodySpool:
+    """
+    Melody events in a temporary file plus what key detection and phrase
+    detection need of the whole melody: event and note counts, total
+    duration and the duration-weighted pitch-class histogram.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.events = 0
+        self.notes = 0
+        self.total_duration = 0.0
+        self.histogram = np.zeros(12)
+
+    def write(self, block):
+        block = np.array(block, dtype=EVENT_DTYPE)
+        notes = block['pitch'] != REST
+        self.events += len(block)
+        self.notes += int(np.count_nonzero(notes))
+        self.total_duration += float(block['duration'].sum())
+        self.histogram += np.bincount(
+            block['pitch'][notes] % 12, weights=block['duration'][notes], minlength=12
+        )
+        self.file.write(block.tobytes())
+
+    def fill(self, events):
+        """Spool an iterable of (onset, duration, pitch) events."""
+        block = []
+        for event in events:
+            block.append(event)
+            if len(block) == CHUNK_EVENTS:
+                self.write(block)
+                block = []
+        if block:
+            self.write(block)
+        return self
+
+    @property
+    def mean_duration(self):
+        return self.total_duration / self.events if self.events else 0.0
+
+    def blocks(self):
+        """Read the events back in blocks of CHUNK_EVENTS."""
+        self.file.seek(0)
+        while True:
+            block = np.frombuffer(self.file.read(CHUNK_EVENTS * EVENT_DTYPE.itemsize), dtype=EVENT_DTYPE)
+            if len(block) == 0:
+                return
+            yield block
+
+    def close(self):
+        self.file.close()
+
+
+# === CHUNKED HARMONIZATION ===
+
+def read_melody(source, track=None, channels=None, programs=None, pickup=None):
+    """Passes 1 and 2: (MelodySpool, MeterIndex, ticks_per_beat) of a seekable binary file."""
+    ticks_per_beat, chunks = read_layout(source)
+    if track is not None and not 0 <= track < len(chunks):
+        raise ValueError(f"Track {track} does not exist (the file has {len(chunks)} tracks)")
+
+    time_signatures, tempos, first_note_track = scan_meta(source, chunks)
+    meter = MeterIndex.from_midi_events(float(ticks_per_beat), time_signatures, tempos)
+    if pickup:
+        meter = meter.with_pickup(pickup)
+
+    if track is not None:
+        tracks = [track]
+    elif channels is None and programs is None:
+        tracks = [] if first_note_track is None else [first_note_track]
+    else:
+        tracks = list(range(len(chunks)))
+
+    notes = selected_notes(source, chunks, tracks, channels, programs)
+    spool = MelodySpool().fill(melody_events(skyline_notes(notes, ticks_per_beat)))
+    return spool, meter, ticks_per_beat
+
+
+def harmonize_chunks(harmonizer, spool, meter, detected_key, seed, parts, ticks_per_beat, progress=None):
+    """
+    Pass 3: harmonize the spooled melody window by window, adding the
+    melody, harmony and bass of every finished phrase to `parts`
+    (TrackSpools) and flushing them up to the next phrase.
+    """
+    total = spool.events
+    mean_duration = spool.mean_duration
+    melody_part, harmony_part, bass_part = parts
+
+    onsets = np.zeros(0, dtype=np.float64)
+    durations = np.zeros(0, dtype=np.float64)
+    pitches = np.zeros(0, dtype=np.int16)
+    flags = np.zeros(0, dtype=bool)
+    base = 0              # melody index of the first event in the window
+    decided = 0           # boundary flags are known before this index
+    phrase_start = 0      # first event not harmonized yet
+    last_added = -3       # last periodic boundary
+    notes_done = 0
+    state = harmonizer.initial_phrase_state(detected_key)
+
+    for block in spool.blocks():
+        onsets = np.concatenate([onsets, block['onset']])
+        durations = np.concatenate([durations, block['duration']])
+        pitches = np.concatenate([pitches, block['pitch']])
+        window = Melody(onsets, durations, pitches, meter)
+        at_end = base + len(window) == total
+
+        # Boundaries are final once the events they look at have arrived
+        limit = total if at_end else base + len(window) - BOUNDARY_CONTEXT
+        mask = np.zeros(len(window), dtype=bool)
+        if total >= 4 and limit > decided:
+            mask = harmonizer.phrase_detector.cue_mask(window, mean_duration)
+            last_added = base + harmonizer.phrase_detector.add_periodic_boundaries(
+                window, mask, decided - base, limit - base, last_added - base
+            )
+        mask[:decided - base] = flags[:decided - base]
+        mask[limit - base:] = False
+        flags = mask
+        decided = max(decided, limit)
+
+        stops = (phrase_start + 1 + np.flatnonzero(flags[phrase_start - base:decided - base])).tolist()
+        stops = [stop for stop in stops if stop < total]
+        if at_end:
+            stops.append(total)
+        elif decided - (stops[-1] if stops else phrase_start) > MAX_PHRASE_EVENTS:
+            stops.append(decided)
+
+        harmony, bass = Voice('Harmony'), Voice('Bass')
+        first = phrase_start - base
+        if stops:
+            starts = [phrase_start - base] + [stop - base for stop in stops[:-1]]
+            state = harmonizer.harmonize_phrases(
+                window, starts, stops[-1] - base, detected_key, flags, seed, state, harmony, bass
+            )
+            notes_done += int(np.count_nonzero(pitches[first:stops[-1] - base] != REST))
+            phrase_start = stops[-1]
+            if progress:
+                progress(notes_done, spool.notes)
+        last = phrase_start - base
+        melody_part.add(Melody(onsets[first:last], durations[first:last], pitches[first:last]))
+        harmony_part.add(harmony)
+        bass_part.add(bass)
+
+        # Everything still to come starts at or after the next phrase
+        if phrase_start < total:
+            next_tick = int(np.rint(onsets[phrase_start - base] * ticks_per_beat))
+            for part in parts:
+                part.flush(next_tick)
+
+        keep = max(phrase_start - BOUNDARY_CONTEXT, 0) - base
+        onsets, durations, pitches, flags = onsets[keep:], durations[keep:], pitches[keep:], flags[keep:]
+        base += keep
+
+    return notes_done
+
+
+def harmonize_chunked(harmonizer, input_path, output_path, seed=None, progress=None,
+                      track=None, channels=None, programs=None, pickup=None):
+    """
+    Harmonize a MIDI file in bounded memory (see the module docstring)
+    with `harmonizer`'s Markov tables. `input_path` and `output_path` are
+    paths or seekable/writable binary file objects; the other arguments
+    are harmonize()'s. Returns (output_path, detected key, notes).
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    source = open(input_path, 'rb') if not hasattr(input_path, 'read') else input_path
+    try:
+        with span('parse'):
+            spool, meter, ticks_per_beat = read_melody(source, track, channels, programs, pickup)
+    finally:
+        if source is not input_path:
+            source.close()
+
+    try:
+        with span('key'):
+            detected_key = get_key_detector().detect_histogram(spool.histogram)
+
+        parts = [
+            TrackSpool(name, channel, VOICE_PROGRAMS[name], ticks_per_beat=TICKS_PER_BEAT)
+            for channel, name in enumerate(('Melody', 'Harmony', 'Bass'))
+        ]
+        with span('harmonize'):
+            notes = harmonize_chunks(harmonizer, spool, meter, detected_key, seed, parts, TICKS_PER_BEAT, progress)
+        NOTES_PROCESSED.inc(notes, mode='sampled')
+
+        with span('write'):
+            for part in parts:
+                part.close()
+            conductor = conductor_track(Melody([], [], [], meter), detected_key, ticks_per_beat=TICKS_PER_BEAT)
+            write_spooled_midi(output_path, conductor, parts, TICKS_PER_BEAT)
+    finally:
+        spool.close()
+
+    return output_path, detected_key, notes
@@ -0,0 +1,176 @@
+"""
+Melody Extraction
+=================
+Picks the melody line out of polyphonic, multi-track MIDI input straight
+from the raw note events, without materializing a music21 stream.
+
+Every note of the file is read once with mido into a NoteEvents table of
+parallel arrays (onset, end, pitch, channel, program, track); programs
+come from the program changes of the note's channel, whatever track they
+are in, and the time signature and tempo events of the same pass build
+the file's MeterIndex. Notes can then be selected by track, channel or General MIDI
+program, and the selection is reduced to one line with the skyline
+(highest voice) algorithm:
+
+- notes are visited in onset order, highest first at equal onsets
+  (one sort over the event index);
+- a note is kept unless a higher note is still sounding at its onset;
+  the sounding notes are a max-heap by pitch, ended notes are dropped
+  lazily when they reach the top.
+
+Each note is pushed and popped at most once, so extraction is
+O(n log n) in the number of note events. Chords collapse to their top
+note and accompaniment under a held melody note is skipped.
+"""
+
+import heapq
+
+import numpy as np
+
+from meter import DEFAULT_METER, MeterIndex
+
+# General MIDI percussion (channel 10); its note numbers are not pitches
+DRUM_CHANNEL = 9
+
+# A sounding note only hides a lower onset if it lasts at least this much
+# longer (quarter lengths), so legato overlaps within one line survive
+LEGATO_OVERLAP = 0.25
+
+
+class NoteEvents:
+    """
+    All notes of a MIDI file as parallel arrays. Onsets and ends are in
+    quarter lengths; `tracks` is the index of the track each note is in.
+    `meter` is the file's MeterIndex.
+    """
+
+    __slots__ = ('onsets', 'ends', 'pitches', 'channels', 'programs', 'tracks', 'meter')
+
+    def __init__(self, onsets, ends, pitches, channels, programs, tracks, meter=None):
+        self.onsets = np.asarray(onsets, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.pitches = np.asarray(pitches, dtype=np.int16)
+        self.channels = np.asarray(channels, dtype=np.int8)
+        self.programs = np.asarray(programs, dtype=np.int8)
+        self.tracks = np.asarray(tracks, dtype=np.int32)
+        self.meter = meter or DEFAULT_METER
+
+    def __len__(self):
+        return len(self.pitches)
+
+    @classmethod
+    def from_midi_file(cls, midi_file):
+        """Read every note and the time signature/tempo map of a mido.MidiFile."""
+        ticks_per_beat = float(midi_file.ticks_per_beat)
+        starts, ends, pitches, channels, tracks = [], [], [], [], []
+        program_ticks, program_channels, program_values = [], [], []
+        time_signatures, tempos = [], []
+
+        for track_index, midi_track in enumerate(midi_file.tracks):
+            open_notes = {}
+            tick = 0
+            for msg in midi_track:
+                tick += msg.time
+                if msg.type == 'note_on' and msg.velocity > 0:
+                    open_notes.setdefault((msg.channel, msg.note), []).append(tick)
+                elif msg.type == 'note_off' or msg.type == 'note_on':
+                    open_starts = open_notes.get((msg.channel, msg.note))
+                    if open_starts:
+                        starts.append(open_starts.pop(0))
+                        ends.append(tick)
+                        pitches.append(msg.note)
+                        channels.append(msg.channel)
+                        tracks.append(track_index)
+                elif msg.type == 'program_change':
+                    program_ticks.append(tick)
+                    program_channels.append(msg.channel)
+                    program_values.append(msg.program)
+                elif msg.type == 'time_signature':
+                    time_signatures.append((tick, msg.numerator, msg.denominator))
+                elif msg.type == 'set_tempo':
+                    tempos.append((tick, msg.tempo))
+
+        starts = np.array(starts, dtype=np.int64)
+        channels = np.array(channels, dtype=np.int64)
+        programs = _programs_at(starts, channels, program_ticks, program_channels, program_values)
+        return cls(
+            starts / ticks_per_beat, np.array(ends, dtype=np.int64) / ticks_per_beat,
+            pitches, channels, programs, tracks,
+            MeterIndex.from_midi_events(ticks_per_beat, time_signatures, tempos),
+        )
+
+    def select(self, track=None, channels=None, programs=None):
+        """
+        Boolean mask of the notes to extract the melody from.
+
+        With no arguments this is the first track that has pitched notes
+        (the same part music21's `parts[0]` would give). `track` limits the
+        selection to one track index; `channels` (0-15) and `programs`
+        (General MIDI 0-127) select matching notes in every track, or in
+        `track` if given. Drum-channel notes are left out unless channel 9
+        is asked for explicitly.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if channels is None or DRUM_CHANNEL not in channels:
+            mask &= self.channels != DRUM_CHANNEL
+        if channels is not None:
+            mask &= np.isin(self.channels, list(channels))
+        if programs is not None:
+            mask &= np.isin(self.programs, list(programs))
+
+        if track is not None:
+            mask &= self.tracks == track
+        elif channels is None and programs is None and mask.any():
+            mask &= self.tracks == self.tracks[mask].min()
+        return mask
+
+    def melody_notes(self, track=None, channels=None, programs=None):
+        """Skyline of the selected notes as (onset, duration, pitch) tuples, in onset order."""
+        selected = np.flatnonzero(self.select(track, channels, programs))
+        kept = selected[skyline(self.onsets[selected], self.ends[selected], self.pitches[selected])]
+        return list(zip(
+            self.onsets[kept].tolist(), (self.ends[kept] - self.onsets[kept]).tolist(), self.pitches[kept].tolist()
+        ))
+
+
+def _programs_at(starts, channels, program_ticks, program_channels, program_values):
+    """Program of each note's channel at its start tick (0 before any program change)."""
+    programs = np.zeros(len(starts), dtype=np.int64)
+    if not program_ticks:
+        return programs
+
+    program_ticks = np.array(program_ticks, dtype=np.int64)
+    program_channels = np.array(program_channels, dtype=np.int64)
+    program_values = np.array(program_values, dtype=np.int64)
+    for channel in np.unique(program_channels).tolist():
+        changes = program_channels == channel
+        order = np.argsort(program_ticks[changes], kind='stable')
+        ticks = program_ticks[changes][order]
+        values = program_values[changes][order]
+        notes = channels == channel
+        latest = np.searchsorted(ticks, starts[notes], side='right') - 1
+        programs[notes] = np.where(latest >= 0, values[np.maximum(latest, 0)], 0)
+    return programs
+
+
+def skyline(onsets, ends, pitches, overlap=LEGATO_OVERLAP):
+    """
+    Indices (in onset order) of the notes on the top line: a note is kept
+    unless a higher note is still sounding at its onset, ignoring notes
+    that end within `overlap` of it.
+    """
+    order = np.lexsort((-pitches.astype(np.int64), onsets)).tolist()
+    onsets = onsets.tolist()
+    ends = ends.tolist()
+    pitches = pitches.tolist()
+
+    kept = []
+    sounding = []   # (-pitch, end) of every note visited so far
+    for i in order:
+        onset, pitch = onsets[i], pitches[i]
+        while sounding and sounding[0][1] <= onset + overlap:
+            heapq.heappop(sounding)
+        if not sounding or pitch >= -sounding[0][0]:
+            kept.append(i)
+        heapq.heappush(sounding, (-pitch, ends[i]))
+    return np.array(kept, dtype=np.int64)
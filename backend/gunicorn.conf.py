@@ -0,0 +1,41 @@
+"""
+gunicorn configuration for the harmonizer API (see wsgi.py).
+
+Environment variables:
+    HARMONIZER_BIND      address to listen on (default 0.0.0.0:5000)
+    WEB_CONCURRENCY      worker processes (default: CPU count)
+    HARMONIZER_THREADS   request threads per worker (default 4)
+
+Per-worker harmonization concurrency is capped separately by
+MAX_CONCURRENT_HARMONIZATIONS (see app.py). /api/metrics reports the
+worker that answers the scrape; only harmonizer_jobs_pending counts the
+job database shared by all workers.
+"""
+
+import multiprocessing
+import os
+
+# The app is imported once in the master; background threads start per worker
+os.environ.setdefault('HARMONIZER_PREFORK', '1')
+
+wsgi_app = 'wsgi:application'
+bind = os.environ.get('HARMONIZER_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('HARMONIZER_THREADS', 4))
+preload_app = True
+
+backlog = 256
+timeout = 120               # long synchronous harmonizations
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound memory growth
+max_requests = 1000
+max_requests_jitter = 100
+
+
+def post_fork(server, worker):
+    from app import init_worker
+
+    # Interrupted jobs are resumed once, by the first worker spawned
+    init_worker(recover_jobs=worker.age == 1)
@@ -11,55 +11,247 @@ Phase 1 improvements:
 Author: Trixx (Chinmay Patel)
 """
 
-import mido
 import numpy as np
-from music21 import converter, note, chord, stream, key, instrument, pitch, interval, roman
-import pretty_midi
+import hashlib
+import logging
 import os
 import random
-from collections import defaultdict
+import uuid
+from collections import defaultdict, namedtuple
+
+from chord_model import ChordPredictor, build_chord_model, load_chord_predictor
+from key_context import (
+    CHORD_FIT_WEIGHT,
+    CHORD_MISFIT_WEIGHT,
+    CHORD_TONES,
+    KEY_CONTEXTS,
+    KeyContext,
+    MAJOR_CHORD_TONES,
+    MAJOR_TRANSITIONS,
+    MINOR_CHORD_TONES,
+    MINOR_TRANSITIONS,
+    cumulative,
+    sample,
+)
+from key_detection import KEY_PROFILES, get_key_detector
+from markov_model import CHORD_IDS, NUMERALS, MarkovChordModel
+from melody import Melody, Voice, REST
+from metrics import CADENCES_INSERTED, NOTES_PROCESSED, PARALLELS_FIXED, span
+from midi_writer import write_midi
+from satb import SATBVoiceSearch, voicing_table
+from scoring import choose_top_candidates, row_costs, score_harmony_window
+from voice_search import ViterbiVoiceSearch
+
+logger = logging.getLogger(__name__)
+
+# Ingest paths for harmonize(): 'mido' reads note events straight into a
+# compact Melody, 'music21' runs the full converter.parse object graph.
+INGEST_MODES = ('mido', 'music21')
+
+# Chord/voice selection for harmonize(): 'sampled' draws from the Markov
+# tables note by note, 'optimal' runs a deterministic Viterbi search and
+# 'satb' a deterministic four-part (alto, tenor, bass) voicing search.
+HARMONIZATION_MODES = ('sampled', 'optimal', 'satb')
+
+# Modes that make no random choices (the seed is ignored)
+DETERMINISTIC_MODES = ('optimal', 'satb')
+
+# Chord choice on the sampled path: 'auto' uses the learned chord model
+# when one is loaded and the Markov tables otherwise; 'markov'/'model'
+# force one of them.
+CHORD_PREDICTION_MODES = ('auto', 'markov', 'model')
+
+# Key detection for harmonize(): 'profile' correlates a NumPy pitch-class
+# histogram with precomputed key profiles, 'music21' runs analyze('key').
+KEY_DETECTION_MODES = ('profile', 'music21')
+
+# MIDI export for harmonize(): 'mido' writes the voice arrays directly,
+# 'music21' builds a Score and calls score.write().
+WRITERS = ('mido', 'music21')
+
+# Periodic phrase checkpoints fall on the first beat of every this many bars
+PHRASE_BARS = 2
+
+# Cached (mode, context, melody degree) distributions of a trained Markov model
+MODEL_CACHE_SIZE = 1 << 16
+
+# Voice-leading state carried from one phrase into the next by the sampled
+# path: current chord and when it last changed, the previous harmony and
+# melody pitches (parallel checks), the previous bass note and onset, and
+# the chords before the current one (only kept for higher-order Markov models).
+PhraseState = namedtuple('PhraseState', [
+    'chord', 'last_chord_change', 'harmony_pitch', 'melody_pitch', 'bass_pitch', 'last_bass_offset',
+    'chord_history',
+])
+
+
+def phrase_starts(phrase_boundaries):
+    """Event index of every phrase start: 0 and each event after a boundary."""
+    if len(phrase_boundaries) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([[0], np.flatnonzero(phrase_boundaries[:-1]) + 1])
+
+
+# SplitMix64 increment and finalizer constants (phrase_uniforms)
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+def mix64(z):
+    """SplitMix64 finalizer, element-wise on a uint64 array."""
+    z = (z ^ (z >> np.uint64(30))) * MIX_MULTIPLIERS[0]
+    z = (z ^ (z >> np.uint64(27))) * MIX_MULTIPLIERS[1]
+    return z ^ (z >> np.uint64(31))
+
+
+def phrase_uniforms(seed, melody, phrase_boundaries, starts, stop):
+    """
+    Random draws in [0, 1) for melody events [starts[0], stop), split into
+    phrases beginning at `starts`: (chord draws, harmony draws), one of
+    each per event.
+
+    Every phrase is keyed by the seed and the phrase's own events (onsets,
+    durations, pitches, boundary flags) and each draw is a hash of that key
+    and the event's position in the phrase. Draws do not depend on what
+    came before, so unchanged phrases reproduce their choices after an
+    edit elsewhere, and a whole melody is keyed in one array pass.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    offset = int(starts[0])
+    firsts = starts - offset
+    first_of_phrase = np.zeros(stop - offset, dtype=bool)
+    first_of_phrase[firsts] = True
+    phrase = np.cumsum(first_of_phrase) - 1
+    position = (np.arange(stop - offset) - firsts[phrase]).astype(np.uint64)
+
+    seed_limbs = []
+    while True:
+        seed_limbs.append(seed & 0xFFFFFFFFFFFFFFFF)
+        seed >>= 64
+        if not seed:
+            break
+    seed_key = np.bitwise_xor.reduce(mix64(
+        np.array(seed_limbs, dtype=np.uint64) + GOLDEN_GAMMA * np.arange(1, len(seed_limbs) + 1, dtype=np.uint64)
+    ))
+
+    events = mix64(np.ascontiguousarray(melody.onsets[offset:stop]).view(np.uint64) ^ GOLDEN_GAMMA * (position + 1))
+    events = mix64(events ^ np.ascontiguousarray(melody.durations[offset:stop]).view(np.uint64))
+    events = mix64(events ^ ((melody.pitches[offset:stop].astype(np.int64).view(np.uint64) << np.uint64(1))
+                             | phrase_boundaries[offset:stop].astype(np.uint64)))
+    keys = mix64(np.add.reduceat(events, firsts) ^ seed_key)[phrase]
+
+    counters = GOLDEN_GAMMA * (position * np.uint64(2) + np.uint64(1))
+    chord_draws = mix64(keys + counters)
+    harmony_draws = mix64(keys + counters + GOLDEN_GAMMA)
+    return (
+        (chord_draws >> np.uint64(11)).astype(np.float64) * 2.0 ** -53,
+        (harmony_draws >> np.uint64(11)).astype(np.float64) * 2.0 ** -53,
+    )
+
+
+def model_file_id(path):
+    """
+    Name and SHA-256 prefix of a model's contents (a file, or a directory
+    such as a Keras SavedModel), identifying it in result cache keys.
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+        )
+    else:
+        files = [path]
+    for file_path in files:
+        digest.update(os.path.relpath(file_path, path).encode())
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return f'{os.path.basename(os.path.normpath(path))}:{digest.hexdigest()[:16]}'
+
 
 class ChordProgressionGenerator:
     """
     Markov chain-based chord progression generator using functional harmony.
-    Probabilities based on common practice period music theory.
+    Probabilities based on common practice period music theory, or on a
+    trained MarkovChordModel when `model` is given (its first-order
+    transitions then also drive the Viterbi and SATB searches).
     """
     
-    def __init__(self):
+    def __init__(self, model=None):
+        self.model = model
         # Transition probabilities: from_chord -> {to_chord: probability}
-        # Based on functional harmony analysis of classical music
-        self.major_transitions = {
-            'I': {'I': 0.05, 'ii': 0.15, 'iii': 0.05, 'IV': 0.25, 'V': 0.30, 'vi': 0.15, 'viio': 0.05},
-            'ii': {'I': 0.05, 'ii': 0.05, 'iii': 0.05, 'IV': 0.10, 'V': 0.60, 'vi': 0.05, 'viio': 0.10},
-            'iii': {'I': 0.05, 'ii': 0.10, 'iii': 0.05, 'IV': 0.30, 'V': 0.10, 'vi': 0.35, 'viio': 0.05},
-            'IV': {'I': 0.20, 'ii': 0.15, 'iii': 0.05, 'IV': 0.05, 'V': 0.40, 'vi': 0.05, 'viio': 0.10},
-            'V': {'I': 0.55, 'ii': 0.05, 'iii': 0.05, 'IV': 0.10, 'V': 0.05, 'vi': 0.15, 'viio': 0.05},
-            'vi': {'I': 0.10, 'ii': 0.25, 'iii': 0.10, 'IV': 0.30, 'V': 0.15, 'vi': 0.05, 'viio': 0.05},
-            'viio': {'I': 0.70, 'ii': 0.05, 'iii': 0.05, 'IV': 0.05, 'V': 0.05, 'vi': 0.05, 'viio': 0.05},
+        # (shared tables from key_context, based on functional harmony)
+        if model is None:
+            self.major_transitions = MAJOR_TRANSITIONS
+            self.minor_transitions = MINOR_TRANSITIONS
+        else:
+            self.major_transitions = model.transition_dict('major')
+            self.minor_transitions = model.transition_dict('minor')
+        
+        # Cumulative weights per (mode, chord), so sampling never rebuilds lists
+        self.cum_weights = {
+            mode: {
+                chord: (tuple(probs), cumulative(list(probs.values())))
+                for chord, probs in transitions.items()
+            }
+            for mode, transitions in (('major', self.major_transitions), ('minor', self.minor_transitions))
         }
         
-        self.minor_transitions = {
-            'i': {'i': 0.05, 'iio': 0.10, 'III': 0.10, 'iv': 0.25, 'V': 0.30, 'VI': 0.15, 'viio': 0.05},
-            'iio': {'i': 0.05, 'iio': 0.05, 'III': 0.05, 'iv': 0.10, 'V': 0.60, 'VI': 0.05, 'viio': 0.10},
-            'III': {'i': 0.10, 'iio': 0.05, 'III': 0.05, 'iv': 0.30, 'V': 0.10, 'VI': 0.35, 'viio': 0.05},
-            'iv': {'i': 0.20, 'iio': 0.10, 'III': 0.05, 'iv': 0.05, 'V': 0.45, 'VI': 0.05, 'viio': 0.10},
-            'V': {'i': 0.55, 'iio': 0.05, 'III': 0.05, 'iv': 0.10, 'V': 0.05, 'VI': 0.15, 'viio': 0.05},
-            'VI': {'i': 0.10, 'iio': 0.20, 'III': 0.10, 'iv': 0.30, 'V': 0.20, 'VI': 0.05, 'viio': 0.05},
-            'viio': {'i': 0.70, 'iio': 0.05, 'III': 0.05, 'iv': 0.05, 'V': 0.05, 'VI': 0.05, 'viio': 0.05},
+        # Melody-fit weight of each chord id per melody scale degree (trained model draws)
+        self.fit_weights = {
+            mode: np.array([
+                [CHORD_FIT_WEIGHT if degree in degrees else CHORD_MISFIT_WEIGHT for degrees in tones.values()]
+                for degree in range(7)
+            ])
+            for mode, tones in CHORD_TONES.items()
         }
+        self._model_cache = {}
     
-    def get_next_chord(self, current_chord, mode='major'):
-        """Select next chord based on Markov transition probabilities."""
-        transitions = self.major_transitions if mode == 'major' else self.minor_transitions
+    @property
+    def history_length(self):
+        """Chords before the current one that the model conditions on."""
+        return self.model.order - 1 if self.model is not None else 0
+    
+    def get_next_chord(self, current_chord, mode='major', rng=None, history=()):
+        """
+        Select next chord based on Markov transition probabilities.
+        `rng` (e.g. a seeded np.random.Generator) defaults to the global random module.
+        `history` holds the chords before `current_chord` (used by higher-order models).
+        """
+        mode = 'major' if mode == 'major' else 'minor'
+        table = self.cum_weights[mode]
         
-        if current_chord not in transitions:
+        if current_chord not in table:
             current_chord = 'I' if mode == 'major' else 'i'
         
-        probs = transitions[current_chord]
-        chords = list(probs.keys())
-        weights = list(probs.values())
+        if self.model is not None:
+            return self.sample_chord(mode, tuple(history) + (current_chord,), rng)
         
-        return random.choices(chords, weights=weights)[0]
+        chords, cum_weights = table[current_chord]
+        return sample(chords, cum_weights, rng or random)
+    
+    def sample_chord(self, mode, chords, rng=None, melody_degree=None, uniform=None):
+        """
+        Draw from the trained model the chord that follows `chords` (numerals,
+        most recent last), weighted by fit with `melody_degree` if given.
+        `uniform` is a precomputed draw to use instead of `rng`.
+        """
+        ids = CHORD_IDS[mode]
+        context = tuple(ids[c] for c in chords[-self.model.order:])
+        return sample(NUMERALS[mode], self._model_cum_weights(mode, context, melody_degree), rng or random, uniform)
+    
+    def _model_cum_weights(self, mode, context, melody_degree):
+        """Cumulative weights of a model draw, cached per (mode, context, melody degree)."""
+        key = (mode, context, melody_degree)
+        cum_weights = self._model_cache.get(key)
+        if cum_weights is None:
+            probs = self.model.probabilities(mode, context)
+            if melody_degree is not None:
+                probs = probs * self.fit_weights[mode][melody_degree]
+            cum_weights = cumulative(probs)
+            if len(self._model_cache) < MODEL_CACHE_SIZE:
+                self._model_cache[key] = cum_weights
+        return cum_weights
     
     def get_cadence_chords(self, mode='major'):
         """Return authentic cadence: V -> I (or V -> i in minor)."""
@@ -72,12 +264,13 @@ class ChordProgressionGenerator:
 class VoiceLeadingChecker:
     """
     Checks and enforces voice leading rules from classical music theory.
+    All pitches are MIDI note numbers.
     """
     
     @staticmethod
     def get_interval_semitones(pitch1, pitch2):
         """Get interval in semitones between two pitches."""
-        return abs(pitch1.midi - pitch2.midi) % 12
+        return abs(pitch1 - pitch2) % 12
     
     @staticmethod
     def is_parallel_fifth(prev_voice1, prev_voice2, curr_voice1, curr_voice2):
@@ -91,8 +284,8 @@ class VoiceLeadingChecker:
         # Perfect fifth = 7 semitones
         if prev_interval == 7 and curr_interval == 7:
             # Check if both voices moved in the same direction
-            voice1_direction = curr_voice1.midi - prev_voice1.midi
-            voice2_direction = curr_voice2.midi - prev_voice2.midi
+            voice1_direction = curr_voice1 - prev_voice1
+            voice2_direction = curr_voice2 - prev_voice2
             if voice1_direction * voice2_direction > 0:  # Same direction
                 return True
         return False
@@ -108,8 +301,8 @@ class VoiceLeadingChecker:
         
         # Perfect octave/unison = 0 semitones
         if prev_interval == 0 and curr_interval == 0:
-            voice1_direction = curr_voice1.midi - prev_voice1.midi
-            voice2_direction = curr_voice2.midi - prev_voice2.midi
+            voice1_direction = curr_voice1 - prev_voice1
+            voice2_direction = curr_voice2 - prev_voice2
             if voice1_direction * voice2_direction > 0:
                 return True
         return False
@@ -123,7 +316,7 @@ class VoiceLeadingChecker:
         if prev_pitch is None:
             return 0
         
-        movement = abs(curr_pitch.midi - prev_pitch.midi)
+        movement = abs(curr_pitch - prev_pitch)
         
         if movement == 0:
             return 0.5  # Repeated note - okay but not ideal
@@ -143,61 +336,85 @@ class PhraseDetector:
     """
     
     @staticmethod
-    def detect_boundaries(melody_notes):
+    def boundary_mask(melody):
         """
         Detect phrase boundaries based on musical cues:
         - Long notes (relative to context)
         - Notes before rests
         - Melodic peaks/valleys
-        - Regular intervals (every 4 or 8 measures)
+        - Regular intervals (the first beat of every PHRASE_BARS-th bar of the melody's meter)
+
+        `melody` is a compact Melody. Returns a boolean array with one flag
+        per event; every rule is a single array pass, so this is O(n).
         """
-        boundaries = []
+        n = len(melody)
+        mask = np.zeros(n, dtype=bool)
         
-        if len(melody_notes) < 4:
-            return boundaries
+        if n < 4:
+            return mask
         
-        # Calculate average duration
-        durations = [n.duration.quarterLength for n in melody_notes if hasattr(n, 'duration')]
-        avg_duration = np.mean(durations) if durations else 1.0
+        mask = PhraseDetector.cue_mask(melody, melody.durations.mean())
+        PhraseDetector.add_periodic_boundaries(melody, mask)
+        return mask
+    
+    @staticmethod
+    def cue_mask(melody, mean_duration):
+        """
+        Boundaries from the musical cues alone (long notes, notes before
+        rests, melodic peaks); `mean_duration` is the average event length
+        that "long" is measured against. A flag depends only on its event
+        and the two next to it, so a slice of a longer melody gives the
+        same flags away from its first and last event.
+        """
+        pitches = melody.pitches
+        durations = melody.durations
+        is_rest = pitches == REST
         
-        for i, element in enumerate(melody_notes):
-            is_boundary = False
-            
-            # Check for long notes (1.5x average or longer)
-            if hasattr(element, 'duration') and element.duration.quarterLength >= avg_duration * 1.5:
-                is_boundary = True
-            
-            # Check if next element is a rest
-            if i < len(melody_notes) - 1:
-                next_elem = melody_notes[i + 1]
-                if isinstance(next_elem, note.Rest):
-                    is_boundary = True
-            
-            # Check for melodic peaks (higher than neighbors)
-            if isinstance(element, note.Note) and i > 0 and i < len(melody_notes) - 1:
-                prev_elem = melody_notes[i - 1]
-                next_elem = melody_notes[i + 1]
-                if isinstance(prev_elem, note.Note) and isinstance(next_elem, note.Note):
-                    if element.pitch.midi > prev_elem.pitch.midi and element.pitch.midi > next_elem.pitch.midi:
-                        is_boundary = True
-            
-            if is_boundary:
-                boundaries.append(i)
+        # Long notes (1.5x average or longer)
+        mask = durations >= mean_duration * 1.5
         
-        # Also add boundaries every ~8 beats if none detected nearby
-        if hasattr(melody_notes[0], 'offset'):
-            current_offset = 0
-            for i, elem in enumerate(melody_notes):
-                if hasattr(elem, 'offset'):
-                    current_offset = elem.offset
-                    # Every 8 quarter notes, check if we need a boundary
-                    if current_offset > 0 and current_offset % 8.0 < 1.0:
-                        # Check if there's already a boundary nearby
-                        nearby = any(abs(b - i) <= 2 for b in boundaries)
-                        if not nearby and i not in boundaries:
-                            boundaries.append(i)
+        # Notes followed by a rest
+        mask[:-1] |= is_rest[1:]
         
-        return sorted(set(boundaries))
+        # Melodic peaks (higher than both pitched neighbors)
+        middle = pitches[1:-1]
+        mask[1:-1] |= (
+            ~is_rest[:-2] & ~is_rest[1:-1] & ~is_rest[2:]
+            & (middle > pitches[:-2]) & (middle > pitches[2:])
+        )
+        return mask
+    
+    @staticmethod
+    def add_periodic_boundaries(melody, mask, start=0, stop=None, last_added=-3):
+        """
+        Also add boundaries on the first beat of every PHRASE_BARS-th bar
+        if none detected within 2 events. `mask` holds the cue flags and is
+        updated in place for events [start, stop); `last_added` is the index
+        of the last periodic boundary before `start`. Returns the index of
+        the last one added (or `last_added`).
+        """
+        onsets = melody.onsets
+        grid = melody.grid
+        periodic = (onsets > 0) & (grid.bars % PHRASE_BARS == 0) & (grid.beats == 0)
+        nearby = mask.copy()
+        for shift in (1, 2):
+            nearby[shift:] |= mask[:-shift]
+            nearby[:-shift] |= mask[shift:]
+        
+        # Periodic boundaries also suppress each other within 2 events;
+        # only the (sparse) candidates are walked
+        candidates = periodic & ~nearby
+        for i in (start + np.flatnonzero(candidates[start:stop])).tolist():
+            if i - last_added > 2:
+                mask[i] = True
+                last_added = i
+        
+        return last_added
+    
+    @staticmethod
+    def detect_boundaries(melody):
+        """Sorted list of phrase boundary indices (see boundary_mask)."""
+        return np.flatnonzero(PhraseDetector.boundary_mask(melody)).tolist()
 
 
 class MIDIHarmonizer:
@@ -209,218 +426,223 @@ class MIDIHarmonizer:
     - Chord-tone based harmony
     """
     
-    def __init__(self, model_path=None):
-        """Initialize the MIDI Harmonizer."""
-        self.model = None
+    def __init__(self, model_path=None, markov_model_path=None):
+        """
+        Initialize the MIDI Harmonizer. `model_path` is a learned chord
+        model (see load_model), `markov_model_path` a trained Markov chord
+        model (see load_markov_model).
+        """
+        self.chord_predictor = None
+        self.chord_model_id = None       # see chord_sources
+        self.markov_model_id = None
         self.chord_generator = ChordProgressionGenerator()
         self.voice_checker = VoiceLeadingChecker()
         self.phrase_detector = PhraseDetector()
+        self.voice_search = ViterbiVoiceSearch(self)
+        self.satb_search = SATBVoiceSearch(self)
         
-        # Chord definitions (scale degrees for each chord in major)
-        # Scale degrees: 1=tonic, 2=supertonic, etc. (0-indexed: 0, 1, 2, 3, 4, 5, 6)
-        self.major_chord_tones = {
-            'I': [0, 2, 4],      # 1, 3, 5
-            'ii': [1, 3, 5],     # 2, 4, 6
-            'iii': [2, 4, 6],    # 3, 5, 7
-            'IV': [3, 5, 0],     # 4, 6, 1
-            'V': [4, 6, 1],      # 5, 7, 2
-            'vi': [5, 0, 2],     # 6, 1, 3
-            'viio': [6, 1, 3],   # 7, 2, 4
-        }
+        # Chord definitions (scale degrees for each chord), see key_context
+        self.major_chord_tones = MAJOR_CHORD_TONES
+        self.minor_chord_tones = MINOR_CHORD_TONES
         
-        self.minor_chord_tones = {
-            'i': [0, 2, 4],
-            'iio': [1, 3, 5],
-            'III': [2, 4, 6],
-            'iv': [3, 5, 0],
-            'V': [4, 6, 1],      # Raised 7th for dominant
-            'VI': [5, 0, 2],
-            'viio': [6, 1, 3],
-        }
+        if markov_model_path:
+            self.load_markov_model(markov_model_path)
         
         if model_path and os.path.exists(model_path):
             self.load_model(model_path)
         else:
-            print("Using enhanced rule-based harmonization (Phase 1).")
+            logger.info("Using enhanced rule-based harmonization (Phase 1).")
     
-    def analyze_key(self, midi_stream):
-        """Analyze the key of the MIDI file using music21."""
-        analyzed_key = midi_stream.analyze('key')
-        return analyzed_key
+    def chord_sources(self):
+        """
+        Identity of the chord sources behind the output, for result cache
+        keys: the file ids (see model_file_id) of the learned chord model,
+        or 'rules' when none is loaded, and of the trained Markov model, or
+        'builtin' for the hand-written transition tables.
+        """
+        return {
+            'chord_model': self.chord_model_id if self.chord_predictor is not None else 'rules',
+            'markov_model': self.markov_model_id if self.chord_generator.model is not None else 'builtin',
+        }
     
-    def get_scale_pitches(self, detected_key):
-        """Get all pitches in the scale."""
-        scale = detected_key.getScale()
-        return scale.pitches
+    def warm_up(self):
+        """
+        Build the lazily created lookup tables (key detector profiles, SATB
+        voicing tables) now. Pre-forking servers call this in the parent so
+        workers share the tables copy-on-write instead of each building their own.
+        """
+        for profile in KEY_PROFILES:
+            get_key_detector(profile)
+        for detected_key in KEY_CONTEXTS.values():
+            for numeral in detected_key.numerals:
+                voicing_table(detected_key.chord_pitches[numeral])
+        return self
     
-    def get_chord_from_melody(self, melody_notes, detected_key, current_chord_numeral):
+    def load_melody(self, input_path, ingest='mido', track=None, channels=None, programs=None):
         """
-        Determine which chord best fits the current melody notes.
-        Returns chord tones as pitch objects.
+        Read the melody of a MIDI file into a compact Melody.
+        Returns (melody, midi_stream); midi_stream is None on the mido path.
+        `track`, `channels` and `programs` select the notes the melody is
+        extracted from (see Melody.from_midi; mido ingest only).
         """
-        scale_pitches = self.get_scale_pitches(detected_key)
-        mode = 'major' if detected_key.mode == 'major' else 'minor'
-        chord_tones_map = self.major_chord_tones if mode == 'major' else self.minor_chord_tones
+        if ingest not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode: {ingest!r} (expected one of {INGEST_MODES})")
         
-        if current_chord_numeral not in chord_tones_map:
-            current_chord_numeral = 'I' if mode == 'major' else 'i'
+        if ingest == 'music21':
+            if (track, channels, programs) != (None, None, None):
+                raise ValueError("Track/channel/program selection requires ingest='mido'")
+            from music21 import converter
+            midi_stream = converter.parse(input_path)
+            return Melody.from_stream(midi_stream), midi_stream
         
-        scale_degree_indices = chord_tones_map[current_chord_numeral]
-        chord_pitches = []
-        
-        for idx in scale_degree_indices:
-            if idx < len(scale_pitches):
-                chord_pitches.append(scale_pitches[idx])
-        
-        return chord_pitches
+        return Melody.from_midi(input_path, track, channels, programs), None
     
-    def find_best_chord_for_melody(self, melody_pitch, detected_key, prev_chord):
+    def analyze_key(self, midi_stream, method='profile'):
         """
-        Find the best chord that contains the melody note.
-        Uses Markov chain probabilities weighted by whether chord contains melody.
+        Analyze the key of the MIDI file.
+        Accepts a parsed music21 stream or a compact Melody and returns the
+        shared KeyContext for the detected key.
+
+        `method` is 'profile' (fast histogram/profile correlation) or
+        'music21' (music21's analyze('key') on the stream).
         """
-        mode = 'major' if detected_key.mode == 'major' else 'minor'
-        chord_tones_map = self.major_chord_tones if mode == 'major' else self.minor_chord_tones
-        transitions = self.chord_generator.major_transitions if mode == 'major' else self.chord_generator.minor_transitions
+        if method not in KEY_DETECTION_MODES:
+            raise ValueError(f"Unknown key detection method: {method!r} (expected one of {KEY_DETECTION_MODES})")
         
-        scale_pitches = self.get_scale_pitches(detected_key)
-        scale_names = [p.name for p in scale_pitches]
+        if method == 'profile':
+            melody = midi_stream if isinstance(midi_stream, Melody) else Melody.from_stream(midi_stream)
+            return get_key_detector().detect(melody)
         
-        # Find which scale degree the melody note is
-        melody_name = melody_pitch.name
-        melody_scale_degree = None
-        for i, name in enumerate(scale_names):
-            if name == melody_name:
-                melody_scale_degree = i
-                break
-        
-        if melody_scale_degree is None:
-            # Non-diatonic note, keep current chord
-            return prev_chord
+        from music21 import note, stream
         
-        # Score each possible chord
-        chord_scores = {}
+        if isinstance(midi_stream, Melody):
+            # Only the pitched notes matter for key analysis
+            notes_stream = stream.Stream()
+            for onset, duration, midi in zip(midi_stream.onsets, midi_stream.durations, midi_stream.pitches):
+                if midi != REST:
+                    n = note.Note(midi=int(midi), quarterLength=float(duration))
+                    notes_stream.insert(float(onset), n)
+            midi_stream = notes_stream
         
-        if prev_chord not in transitions:
-            prev_chord = 'I' if mode == 'major' else 'i'
-        
-        for next_chord, transition_prob in transitions[prev_chord].items():
-            chord_degrees = chord_tones_map.get(next_chord, [0, 2, 4])
-            
-            # Check if melody note is in this chord
-            if melody_scale_degree in chord_degrees:
-                # Melody fits chord - high score
-                chord_scores[next_chord] = transition_prob * 2.0
-            else:
-                # Melody doesn't fit - lower score but still possible (passing tone)
-                chord_scores[next_chord] = transition_prob * 0.3
+        analyzed_key = midi_stream.analyze('key')
+        return KeyContext.from_key(analyzed_key)
+    
+    def get_scale_pitches(self, detected_key):
+        """Get the pitch classes (0-11) of the seven scale degrees."""
+        return list(detected_key.scale_pitches)
+    
+    def get_chord_from_melody(self, melody_notes, detected_key, current_chord_numeral):
+        """
+        Determine which chord best fits the current melody notes.
+        Returns chord tones as pitch classes.
+        """
+        return list(detected_key.chord_pitches[detected_key.resolve(current_chord_numeral)])
+    
+    def find_best_chord_for_melody(self, melody_pitch, detected_key, prev_chord, rng=None, history=(),
+                                   uniform=None):
+        """
+        Find the best chord that contains the melody note (a MIDI number).
+        Uses Markov chain probabilities weighted by whether chord contains melody
+        (precomputed per key as cumulative weights). `rng` defaults to the
+        global random module; `uniform` is a precomputed draw to use instead.
+        With a trained Markov model the draw is conditioned on `history`
+        (the chords before `prev_chord`) as well.
+        """
+        # Find which scale degree the melody note is
+        melody_scale_degree = detected_key.degree_of[melody_pitch % 12]
         
-        # Normalize and select
-        total = sum(chord_scores.values())
-        if total == 0:
+        if melody_scale_degree < 0:
+            # Non-diatonic note, keep current chord
             return prev_chord
         
-        chords = list(chord_scores.keys())
-        weights = [chord_scores[c] / total for c in chords]
+        prev_chord = detected_key.resolve(prev_chord)
+        if self.chord_generator.model is not None:
+            return self.chord_generator.sample_chord(
+                detected_key.mode, tuple(history) + (prev_chord,), rng, melody_scale_degree, uniform
+            )
+        chords = detected_key.next_chords[prev_chord]
+        cum_weights = detected_key.melody_fit_cum_weights[prev_chord][melody_scale_degree]
         
-        return random.choices(chords, weights=weights)[0]
+        return sample(chords, cum_weights, rng or random, uniform)
     
-    def generate_harmony_note(self, melody_pitch, chord_pitches, detected_key, prev_harmony_pitch):
+    def generate_harmony_note(self, melody_pitch, chord_pitches, detected_key, prev_harmony_pitch, rng=None):
         """
-        Generate a harmony note from the current chord.
-        Prefers notes that create good voice leading.
+        Generate a harmony pitch (MIDI number) from the current chord's
+        pitch classes. Prefers notes that create good voice leading.
+        `rng` defaults to the global random module.
         """
         if not chord_pitches:
             return None
         
         # Target range: below melody, within an octave
-        target_octave = melody_pitch.octave - 1
+        # (MIDI octave numbering: C4 = 60, so octave n starts at (n + 1) * 12)
+        target_octave = melody_pitch // 12 - 2
         
         candidates = []
         
-        for chord_pitch in chord_pitches:
+        for pitch_class in chord_pitches:
             # Create candidate at different octaves
             for oct_adjust in [-1, 0, 1]:
-                candidate = note.Note(chord_pitch.name)
-                candidate.octave = target_octave + oct_adjust
+                candidate = (target_octave + oct_adjust + 1) * 12 + pitch_class
                 
                 # Skip if too close to or above melody
-                if candidate.pitch.midi >= melody_pitch.midi - 2:
+                if candidate >= melody_pitch - 2:
                     continue
                 
                 # Skip if too low
-                if candidate.pitch.midi < 48:  # Below C3
+                if candidate < 48:  # Below C3
                     continue
                 
                 # Calculate voice leading cost
                 vl_cost = self.voice_checker.calculate_voice_leading_cost(
-                    prev_harmony_pitch, candidate.pitch
+                    prev_harmony_pitch, candidate
                 )
                 
-                # Check for parallel fifths/octaves with melody
-                parallel_penalty = 0
-                if prev_harmony_pitch:
-                    # We need previous melody note too - approximate check
-                    pass  # Full check would need melody history
-                
                 # Prefer thirds and sixths with melody
-                interval_with_melody = (melody_pitch.midi - candidate.pitch.midi) % 12
+                interval_with_melody = (melody_pitch - candidate) % 12
                 if interval_with_melody in [3, 4, 8, 9]:  # thirds and sixths
                     interval_bonus = -1
                 else:
                     interval_bonus = 0
                 
-                total_cost = vl_cost + parallel_penalty + interval_bonus
+                total_cost = vl_cost + interval_bonus
                 candidates.append((candidate, total_cost))
         
         if not candidates:
-            # Fallback: create a third below melody
-            fallback = note.Note()
-            fallback.pitch.midi = melody_pitch.midi - 4  # Major third below
-            return fallback
+            # Fallback: a major third below melody
+            return melody_pitch - 4
         
         # Sort by cost and pick best (with some randomness for variety)
         candidates.sort(key=lambda x: x[1])
         
         # Pick from top 3 candidates with weighted probability
+        # (costs bottom out at -1, so shift by 2 to keep weights finite)
         top_candidates = candidates[:3]
-        weights = [1.0 / (c[1] + 1) for c in top_candidates]
-        total_weight = sum(weights)
-        weights = [w / total_weight for w in weights]
+        cum_weights = cumulative([1.0 / (c[1] + 2) for c in top_candidates])
         
-        selected = random.choices(top_candidates, weights=weights)[0]
+        selected = sample(top_candidates, cum_weights, rng or random)
         return selected[0]
     
     def generate_bass_note(self, chord_numeral, detected_key, prev_bass_pitch):
         """
-        Generate bass note (chord root) with smooth voice leading.
+        Generate bass pitch (chord root, MIDI number) with smooth voice leading.
         """
-        scale_pitches = self.get_scale_pitches(detected_key)
-        mode = 'major' if detected_key.mode == 'major' else 'minor'
-        chord_tones_map = self.major_chord_tones if mode == 'major' else self.minor_chord_tones
+        # Get root of chord (first chord tone)
+        root_pitch_class = detected_key.chord_pitches[detected_key.resolve(chord_numeral)][0]
         
-        if chord_numeral not in chord_tones_map:
-            chord_numeral = 'I' if mode == 'major' else 'i'
-        
-        # Get root of chord (first scale degree in chord)
-        root_degree = chord_tones_map[chord_numeral][0]
-        root_pitch = scale_pitches[root_degree]
-        
-        # Create bass note
-        bass = note.Note(root_pitch.name)
-        bass.octave = 2  # Bass range
+        # Bass range: octave 2 (C2 = 36)
+        bass = 36 + root_pitch_class
         
         # Apply voice leading - prefer stepwise motion
-        if prev_bass_pitch:
+        if prev_bass_pitch is not None:
             # Try different octaves to minimize movement
             best_bass = bass
-            best_movement = abs(bass.pitch.midi - prev_bass_pitch.midi)
+            best_movement = abs(bass - prev_bass_pitch)
             
             for oct in [2, 3]:
-                candidate = note.Note(root_pitch.name)
-                candidate.octave = oct
-                movement = abs(candidate.pitch.midi - prev_bass_pitch.midi)
-                if movement < best_movement and candidate.pitch.midi >= 36:  # Above C2
+                candidate = (oct + 1) * 12 + root_pitch_class
+                movement = abs(candidate - prev_bass_pitch)
+                if movement < best_movement and candidate >= 36:  # Above C2
                     best_movement = movement
                     best_bass = candidate
             
@@ -428,197 +650,522 @@ class MIDIHarmonizer:
         
         return bass
     
-    def harmonize(self, input_path, output_path):
+    def harmonize(self, input_path, output_path, ingest='mido', seed=None, mode='sampled',
+                  key_detection='profile', writer='mido', progress=None,
+                  track=None, channels=None, programs=None, chords='auto', pickup=None, chunked=False):
         """
         Main harmonization function with Markov chains and voice leading.
+
+        `ingest` selects the MIDI reader: 'mido' (fast, default) or
+        'music21' (full converter.parse, kept for comparing results).
+        `seed` makes every sampled choice (chords and harmony) reproducible;
+        all randomness comes from one per-call generator, so concurrent
+        calls on a shared harmonizer do not interfere.
+        `mode` is 'sampled' (default), 'optimal' (deterministic Viterbi search)
+        or 'satb' (four-part output: melody, alto, tenor and bass).
+        `key_detection` is 'profile' (default) or 'music21'.
+        `writer` is 'mido' (default) or 'music21'. With 'mido', `input_path`
+        and `output_path` may also be binary file objects (e.g. io.BytesIO).
+        `progress`, if given, is called as progress(notes_done, notes_total).
+        `track`, `channels` and `programs` choose where the melody is taken
+        from in multi-track input (default: the first track with notes).
+        `chords` is 'auto' (default), 'markov' or 'model' (see harmonize_melody).
+        `pickup` is the length (quarter lengths) of an incomplete first bar;
+        bars, beats and harmonic rhythm otherwise follow the file's time
+        signatures and tempo map.
+        `chunked` reads, harmonizes and writes the file in phrase-sized
+        windows so memory stays bounded however long it is (see chunked.py);
+        it supports the sampled mode with the Markov tables, mido ingest and
+        writer and profile key detection, and gives the same output. With a
+        chord model loaded, 'auto' would use the model, so chunked calls
+        must then pass chords='markov'.
         """
+        if writer not in WRITERS:
+            raise ValueError(f"Unknown writer: {writer!r} (expected one of {WRITERS})")
+        
+        if chunked:
+            supported = (mode, ingest, writer, key_detection) == ('sampled', 'mido', 'mido', 'profile')
+            if not supported or chords not in ('auto', 'markov'):
+                raise ValueError(
+                    "Chunked harmonization requires mode='sampled', Markov chords, "
+                    "ingest='mido', writer='mido' and key_detection='profile'"
+                )
+            if chords == 'auto' and self.chord_predictor is not None:
+                raise ValueError(
+                    "Chunked harmonization uses the Markov chord tables; "
+                    "pass chords='markov' when a chord model is loaded"
+                )
+            from chunked import harmonize_chunked
+            _, detected_key, notes = harmonize_chunked(
+                self, input_path, output_path, seed, progress, track, channels, programs, pickup
+            )
+            logger.info("Harmonized %d notes in %s (chunked) -> %s", notes, detected_key, output_path)
+            return output_path
+        
         # Load MIDI file
-        midi_stream = converter.parse(input_path)
+        with span('parse'):
+            melody, midi_stream = self.load_melody(input_path, ingest, track, channels, programs)
+            if pickup:
+                melody = melody.with_meter(melody.meter.with_pickup(pickup))
         
-        # Analyze key
-        detected_key = self.analyze_key(midi_stream)
-        mode = 'major' if detected_key.mode == 'major' else 'minor'
-        print(f"Detected key: {detected_key} ({mode})")
+        # Analyze key (music21 analyzes the whole parsed stream when available)
+        with span('key'):
+            if key_detection == 'music21' and midi_stream is not None:
+                detected_key = self.analyze_key(midi_stream, method='music21')
+            else:
+                detected_key = self.analyze_key(melody, method=key_detection)
+        logger.debug("Detected key: %s (%s)", detected_key, detected_key.mode)
         
-        # Create streams for each voice
-        melody_stream = stream.Part()
-        melody_stream.id = 'Melody'
+        # Detect phrase boundaries
+        with span('phrases'):
+            phrase_boundaries = self.phrase_detector.boundary_mask(melody)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Detected %d phrase boundaries", np.count_nonzero(phrase_boundaries))
         
-        harmony_stream = stream.Part()
-        harmony_stream.id = 'Harmony'
+        with span('harmonize'):
+            harmony, bass = self.harmonize_melody(
+                melody, detected_key, phrase_boundaries, seed=seed, mode=mode, progress=progress,
+                chords=chords,
+            )
         
-        bass_stream = stream.Part()
-        bass_stream.id = 'Bass'
+        with span('write'):
+            if writer == 'music21':
+                self.write_score(melody, harmony, bass, detected_key, output_path)
+            else:
+                write_midi(melody, harmony, bass, detected_key, output_path)
         
-        # Extract melody
-        parts = midi_stream.parts
-        if len(parts) > 0:
-            original_melody = parts[0]
-        else:
-            original_melody = midi_stream.flatten()
+        logger.info("Harmonized %d notes in %s (%s mode) -> %s", melody.note_count, detected_key, mode, output_path)
         
-        # Get all melody notes for phrase detection
-        melody_elements = list(original_melody.flatten().notesAndRests)
-        melody_notes_only = [e for e in melody_elements if isinstance(e, note.Note)]
+        return output_path
+    
+    def harmonize_melody(self, melody, detected_key, phrase_boundaries, seed=None, mode='sampled',
+                         progress=None, chords='auto'):
+        """
+        Generate harmony and bass voices for a compact Melody.
+        Works purely on MIDI numbers; returns (harmony, bass) Voices. In
+        'satb' mode `harmony` is the tuple of inner voices (alto, tenor).
+
+        `phrase_boundaries` is the boolean mask from PhraseDetector.boundary_mask.
+
+        `seed` seeds the per-phrase generators behind every sampled choice.
+        `progress(notes_done, notes_total)` is called as the voices are built.
+        `chords` picks the sampled path's chord source: the learned chord
+        model ('model'), the Markov tables ('markov'), or the model when one
+        is loaded ('auto'). The searched modes always use the Markov tables.
+        """
+        if mode not in HARMONIZATION_MODES:
+            raise ValueError(f"Unknown harmonization mode: {mode!r} (expected one of {HARMONIZATION_MODES})")
         
-        # Detect phrase boundaries
-        phrase_boundaries = self.phrase_detector.detect_boundaries(melody_elements)
-        print(f"Detected {len(phrase_boundaries)} phrase boundaries")
+        if mode == 'optimal':
+            _, harmony, bass = self.voice_search.search(
+                melody, detected_key, phrase_boundaries, progress=progress
+            )
+            NOTES_PROCESSED.inc(melody.note_count, mode=mode)
+            return harmony, bass
+        
+        if mode == 'satb':
+            _, alto, tenor, bass = self.satb_search.search(
+                melody, detected_key, phrase_boundaries, progress=progress
+            )
+            NOTES_PROCESSED.inc(melody.note_count, mode=mode)
+            return (alto, tenor), bass
+        
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        
+        chord_probabilities = self.chord_probabilities(melody, detected_key, phrase_boundaries, chords)
+        
+        harmony = Voice('Harmony')
+        bass = Voice('Bass')
+        total_notes = melody.note_count
+        if len(melody):
+            # All phrases in one pass: draws are keyed per phrase, so this
+            # equals harmonizing them one by one with harmonize_phrase
+            self.harmonize_phrases(
+                melody, phrase_starts(phrase_boundaries), len(melody), detected_key, phrase_boundaries, seed,
+                self.initial_phrase_state(detected_key), harmony, bass, chord_probabilities,
+                progress=(lambda done: progress(done, total_notes)) if progress else None,
+            )
+        
+        NOTES_PROCESSED.inc(total_notes, mode=mode)
+        return harmony, bass
+    
+    @staticmethod
+    def initial_phrase_state(detected_key):
+        """Voice-leading state before the first note: tonic chord, no previous pitches."""
+        return PhraseState(detected_key.tonic_numeral, None, None, None, None, None, ())
+    
+    def harmonize_phrase(self, melody, start, stop, detected_key, phrase_boundaries, seed, state,
+                         harmony, bass, chord_probabilities=None):
+        """
+        Harmonize melody events [start, stop) of one phrase, appending to the
+        `harmony` and `bass` Voices. `state` is the PhraseState left by the
+        previous phrase; returns the state at the end of this one.
+        `chord_probabilities` (see chord_probabilities) replaces the Markov
+        chord draw when given.
+
+        The phrase's random draws are keyed by its own events (see
+        phrase_uniforms), so a phrase with the same notes and the same entry
+        state is always harmonized the same way.
+        """
+        return self.harmonize_phrases(
+            melody, [start], stop, detected_key, phrase_boundaries, seed, state, harmony, bass, chord_probabilities
+        )
+    
+    def harmonize_phrases(self, melody, starts, stop, detected_key, phrase_boundaries, seed, state,
+                          harmony, bass, chord_probabilities=None, progress=None):
+        """
+        Harmonize melody events [starts[0], stop) as consecutive phrases
+        beginning at `starts`, in one chord, harmony and bass pass. The
+        result is the same as harmonize_phrase on each phrase in turn:
+        harmony windows are cut at every phrase start and each phrase keeps
+        its own draws. `progress(notes_done)` is called after every harmony
+        window. Returns the PhraseState after the last phrase.
+        """
+        offset = int(starts[0])
+        note_positions = np.flatnonzero(melody.pitches[offset:stop] != REST)
+        if len(note_positions) == 0:
+            return state
+        note_indices = offset + note_positions
+        
+        chord_draws, harmony_draws = phrase_uniforms(seed, melody, phrase_boundaries, starts, stop)
+        # Notes that open a phrase (the first note after its start)
+        phrase_ids = np.searchsorted(np.asarray(starts), note_indices, side='right')
+        phrase_entries = np.concatenate([[True], phrase_ids[1:] != phrase_ids[:-1]])
+        
+        # === CHORD PROGRESSION ===
+        chords, state = self.choose_chords(
+            melody, note_indices, detected_key, phrase_boundaries, state=state,
+            chord_probabilities=chord_probabilities, uniforms=chord_draws[note_positions],
+        )
+        
+        # === HARMONY ===
+        state = self.generate_harmony_voice(
+            melody, note_indices, chords, detected_key, None, state, harmony,
+            uniforms=harmony_draws[note_positions], window_starts=phrase_entries, progress=progress,
+        )
+        
+        # === BASS ===
+        state = self.generate_bass_voice(melody, note_indices, chords, detected_key, state, bass)
+        
+        return state
+    
+    def choose_chords(self, melody, note_indices, detected_key, phrase_boundaries, rng=None, state=None,
+                      chord_probabilities=None, uniforms=None):
+        """
+        Pick one chord numeral per melody note (aligned with note_indices).
+        Chords change once per harmonic slot of the melody's meter (half or
+        whole bars, see MeterIndex.grid), with V at phrase ends resolving to I.
+        New chords are drawn from `chord_probabilities[note]` when given,
+        otherwise from the Markov tables weighted by melody fit; a draw uses
+        `uniforms[k]` when given (see phrase_uniforms) and `rng` otherwise.
+        Returns (chords, state) with the chord fields of `state` advanced.
+        """
+        mode = detected_key.mode
+        tonic = detected_key.tonic_numeral
         
         # Initialize chord progression
-        current_chord = 'I' if mode == 'major' else 'i'
+        if state is None:
+            state = self.initial_phrase_state(detected_key)
+        current_chord = state.chord
+        last_chord_change = state.last_chord_change
+        history = state.chord_history
+        history_length = self.chord_generator.history_length
+        
+        onsets = melody.onsets[note_indices].tolist()
+        pitches = melody.pitches[note_indices].tolist()
+        slots = melody.grid.slots[note_indices].tolist()
+        last_slot = None if last_chord_change is None else melody.meter.slot(last_chord_change)
+        is_boundary = phrase_boundaries[note_indices].tolist()
+        # Whether the event before each note ends a phrase (rests included)
+        follows_boundary = (phrase_boundaries[note_indices - 1] & (note_indices > 0)).tolist()
+        if chord_probabilities is not None:
+            chord_cum_weights = np.cumsum(chord_probabilities[note_indices], axis=1).tolist()
+        draws = uniforms.tolist() if uniforms is not None else [None] * len(onsets)
+        chords = []
+        cadences = 0
+        
+        for k in range(len(onsets)):
+            current_offset = onsets[k]
+            previous_chord = current_chord
+            
+            # Change chord on entering a new harmonic slot
+            should_change_chord = slots[k] != last_slot
+            is_phrase_end = is_boundary[k]
+            
+            if should_change_chord:
+                if is_phrase_end:
+                    # Use cadence at phrase boundaries
+                    cadence = self.chord_generator.get_cadence_chords(mode)
+                    # If we're at phrase end, use V (will resolve to I next)
+                    current_chord = cadence[0]  # V
+                    cadences += 1
+                elif chord_probabilities is not None:
+                    # Learned prediction from the melody around this note
+                    current_chord = sample(
+                        detected_key.numerals, chord_cum_weights[k], rng or random, draws[k]
+                    )
+                else:
+                    # Normal Markov progression weighted by melody fit
+                    current_chord = self.find_best_chord_for_melody(
+                        pitches[k], detected_key, current_chord, rng, history, draws[k]
+                    )
+                last_chord_change = current_offset
+                last_slot = slots[k]
+            
+            # If previous was V at phrase end, now resolve to I
+            if follows_boundary[k]:
+                current_chord = tonic
+            
+            if history_length and (should_change_chord or follows_boundary[k]):
+                history = (history + (previous_chord,))[-history_length:]
+            
+            chords.append(current_chord)
+        
+        if cadences:
+            CADENCES_INSERTED.inc(cadences)
+        return chords, state._replace(
+            chord=current_chord, last_chord_change=last_chord_change, chord_history=history
+        )
+    
+    def generate_harmony_voice(self, melody, note_indices, chords, detected_key, rng, state, harmony,
+                               uniforms=None, window_starts=None, progress=None):
+        """
+        Append the harmony for `note_indices` to `harmony`, one chord window
+        at a time; returns `state` with the harmony fields advanced.
+        Draws come from `uniforms` (one per note) when given, else from
+        `rng`. `window_starts` (boolean per note) also starts a new window
+        where the chord does not change; `progress(notes_done)` is called
+        after every window.
+
+        All candidates of a window are scored in one array operation and the
+        top-3 weighted choice is precomputed for every possible previous
+        candidate, so walking the window is only index lookups. The
+        parallel fifth/octave fix-up can move a note off the candidate grid;
+        the next note is then re-scored against the actual pitch.
+        """
+        onsets = melody.onsets[note_indices].tolist()
+        durations = melody.durations[note_indices].tolist()
+        pitches = melody.pitches[note_indices].astype(np.int64)
+        if uniforms is None:
+            uniforms = rng.random(len(note_indices))
+        window_starts = window_starts.tolist() if window_starts is not None else None
         
         # Track previous notes for voice leading
-        prev_harmony_pitch = None
-        prev_bass_pitch = None
-        prev_melody_pitch = None
-        
-        # Track timing for chord changes
-        last_chord_change = -2.0
-        last_bass_offset = -2.0
-        
-        # Process each element
-        for i, element in enumerate(melody_elements):
-            if isinstance(element, note.Note):
-                current_offset = element.offset
-                
-                # === MELODY ===
-                melody_note = note.Note(element.pitch)
-                melody_note.duration = element.duration
-                melody_stream.insert(current_offset, melody_note)
-                
-                # === CHORD PROGRESSION ===
-                # Change chord every 2 beats or at phrase boundaries
-                should_change_chord = (current_offset - last_chord_change) >= 2.0
-                is_phrase_end = i in phrase_boundaries
-                
-                if should_change_chord:
-                    if is_phrase_end:
-                        # Use cadence at phrase boundaries
-                        cadence = self.chord_generator.get_cadence_chords(mode)
-                        # If we're at phrase end, use V (will resolve to I next)
-                        current_chord = cadence[0]  # V
-                    else:
-                        # Normal Markov progression weighted by melody fit
-                        current_chord = self.find_best_chord_for_melody(
-                            element.pitch, detected_key, current_chord
-                        )
-                    last_chord_change = current_offset
-                
-                # If previous was V at phrase end, now resolve to I
-                if i > 0 and (i - 1) in phrase_boundaries:
-                    current_chord = 'I' if mode == 'major' else 'i'
+        prev_harmony_pitch = state.harmony_pitch
+        prev_melody_pitch = state.melody_pitch
+        parallels_fixed = 0
+        
+        window_start = 0
+        while window_start < len(chords):
+            window_end = window_start + 1
+            while (window_end < len(chords) and chords[window_end] == chords[window_start]
+                   and not (window_starts and window_starts[window_end])):
+                window_end += 1
+            
+            chord_pitches = self.get_chord_from_melody(None, detected_key, chords[window_start])
+            window_pitches = pitches[window_start:window_end]
+            candidates, entry_costs, step_costs = score_harmony_window(
+                window_pitches, chord_pitches, prev_harmony_pitch
+            )
+            num_candidates = candidates.shape[1]
+            
+            # Top-3 choice for every (note, previous candidate) pair in one batch
+            entry_choice = choose_top_candidates(entry_costs, uniforms[window_start])[0]
+            if window_end - window_start > 1:
+                step_choice = choose_top_candidates(
+                    step_costs.reshape(-1, num_candidates),
+                    np.repeat(uniforms[window_start + 1:window_end], num_candidates)
+                ).reshape(-1, num_candidates)
+            
+            prev_column = None
+            for j in range(window_end - window_start):
+                k = window_start + j
+                melody_pitch = int(window_pitches[j])
                 
-                # Get chord tones for current chord
-                chord_pitches = self.get_chord_from_melody(
-                    [element], detected_key, current_chord
-                )
+                if j == 0:
+                    column = entry_choice
+                elif prev_column is not None:
+                    column = step_choice[j - 1, prev_column]
+                else:
+                    costs = row_costs(melody_pitch, candidates[j], prev_harmony_pitch)
+                    column = choose_top_candidates(costs, uniforms[k])[0]
                 
-                # === HARMONY ===
-                harmony_note = self.generate_harmony_note(
-                    element.pitch, chord_pitches, detected_key, prev_harmony_pitch
-                )
+                if column < 0:
+                    # Fallback: a major third below melody
+                    harmony_pitch = melody_pitch - 4
+                    prev_column = None
+                else:
+                    harmony_pitch = int(candidates[j, column])
+                    prev_column = column
                 
-                if harmony_note:
-                    # Check for parallel fifths/octaves with melody
-                    has_parallel_violation = False
-                    if prev_harmony_pitch and prev_melody_pitch:
-                        if self.voice_checker.is_parallel_fifth(
-                            prev_melody_pitch, prev_harmony_pitch,
-                            element.pitch, harmony_note.pitch
-                        ):
-                            has_parallel_violation = True
-                        if self.voice_checker.is_parallel_octave(
-                            prev_melody_pitch, prev_harmony_pitch,
-                            element.pitch, harmony_note.pitch
-                        ):
-                            has_parallel_violation = True
-                    
-                    if has_parallel_violation:
-                        # Try to find an alternative harmony note
-                        for alt_pitch in chord_pitches:
-                            alt_note = note.Note(alt_pitch.name)
-                            alt_note.octave = element.pitch.octave - 1
+                # Check for parallel fifths/octaves with melody
+                if prev_harmony_pitch is not None and prev_melody_pitch is not None:
+                    if self.voice_checker.is_parallel_fifth(
+                        prev_melody_pitch, prev_harmony_pitch, melody_pitch, harmony_pitch
+                    ) or self.voice_checker.is_parallel_octave(
+                        prev_melody_pitch, prev_harmony_pitch, melody_pitch, harmony_pitch
+                    ):
+                        # Try to find an alternative harmony note an octave below the melody's
+                        alt_base = (melody_pitch // 12 - 1) * 12
+                        for pitch_class in chord_pitches:
+                            alt_pitch = alt_base + pitch_class
                             if not self.voice_checker.is_parallel_fifth(
-                                prev_melody_pitch, prev_harmony_pitch,
-                                element.pitch, alt_note.pitch
+                                prev_melody_pitch, prev_harmony_pitch, melody_pitch, alt_pitch
                             ):
-                                harmony_note = alt_note
+                                harmony_pitch = alt_pitch
+                                prev_column = None
+                                parallels_fixed += 1
                                 break
-                    
-                    harmony_note.duration = element.duration
-                    harmony_stream.insert(current_offset, harmony_note)
-                    prev_harmony_pitch = harmony_note.pitch
-                
-                # === BASS ===
-                # Bass changes on strong beats (every 2 quarter notes)
-                if (current_offset - last_bass_offset) >= 2.0 or last_bass_offset < 0:
-                    bass_note = self.generate_bass_note(
-                        current_chord, detected_key, prev_bass_pitch
-                    )
-                    
-                    # Duration: until next bass note (default 2 beats)
-                    bass_note.duration.quarterLength = 2.0
-                    bass_stream.insert(current_offset, bass_note)
-                    
-                    prev_bass_pitch = bass_note.pitch
-                    last_bass_offset = current_offset
                 
-                prev_melody_pitch = element.pitch
+                harmony.append(onsets[k], durations[k], harmony_pitch)
+                prev_harmony_pitch = harmony_pitch
+                prev_melody_pitch = melody_pitch
             
-            elif isinstance(element, note.Rest):
-                # Add rest to melody
-                rest = note.Rest()
-                rest.duration = element.duration
-                melody_stream.insert(element.offset, rest)
+            window_start = window_end
+            if progress:
+                progress(window_end)
+        
+        if parallels_fixed:
+            PARALLELS_FIXED.inc(parallels_fixed)
+        return state._replace(harmony_pitch=prev_harmony_pitch, melody_pitch=prev_melody_pitch)
+    
+    def generate_bass_voice(self, melody, note_indices, chords, detected_key, state, bass):
+        """
+        Append the bass for `note_indices` to `bass`: chord roots on strong
+        beats (the first note of each harmonic slot). Returns `state` with
+        the bass fields advanced.
+        """
+        prev_bass_pitch = state.bass_pitch
+        last_bass_offset = state.last_bass_offset
+        last_slot = None if last_bass_offset is None else melody.meter.slot(last_bass_offset)
+        
+        onsets = melody.onsets[note_indices].tolist()
+        slots = melody.grid.slots[note_indices].tolist()
+        slot_ends = melody.grid.slot_ends[note_indices].tolist()
+        for k, current_offset in enumerate(onsets):
+            if slots[k] != last_slot:
+                bass_pitch = self.generate_bass_note(chords[k], detected_key, prev_bass_pitch)
+                
+                # Duration: until the end of the slot
+                bass.append(current_offset, slot_ends[k] - current_offset, bass_pitch)
+                
+                prev_bass_pitch = bass_pitch
+                last_bass_offset = current_offset
+                last_slot = slots[k]
+        
+        return state._replace(bass_pitch=prev_bass_pitch, last_bass_offset=last_bass_offset)
+    
+    def write_score(self, melody, harmony, bass, detected_key, output_path):
+        """
+        Assemble the voices into a music21 Score and write it as MIDI.
+        `harmony` is a Voice or a tuple of inner Voices (see harmonize_melody).
+        This is the only place music21 Note objects are created.
+        """
+        from music21 import instrument, note, stream
+        
+        melody_stream = stream.Part()
+        melody_stream.id = 'Melody'
+        for onset, duration, midi in zip(melody.onsets.tolist(), melody.durations.tolist(), melody.pitches.tolist()):
+            if midi == REST:
+                melody_stream.insert(onset, note.Rest(quarterLength=duration))
+            else:
+                melody_stream.insert(onset, note.Note(midi=midi, quarterLength=duration))
+        
+        inner_voices = harmony if isinstance(harmony, tuple) else (harmony,)
+        voice_streams = [melody_stream]
+        for voice in (*inner_voices, bass):
+            voice_stream = stream.Part()
+            voice_stream.id = voice.name
+            for onset, duration, midi in zip(voice.onsets.tolist(), voice.durations.tolist(), voice.pitches.tolist()):
+                voice_stream.insert(onset, note.Note(midi=midi, quarterLength=duration))
+            voice_streams.append(voice_stream)
         
         # === ASSEMBLE SCORE ===
         score = stream.Score()
         
         # Add instruments
-        melody_stream.insert(0, instrument.Piano())
-        harmony_stream.insert(0, instrument.Piano())
+        *upper_streams, bass_stream = voice_streams
+        for upper_stream in upper_streams:
+            upper_stream.insert(0, instrument.Piano())
         bass_stream.insert(0, instrument.AcousticBass())
         
-        score.insert(0, melody_stream)
-        score.insert(0, harmony_stream)
-        score.insert(0, bass_stream)
+        for voice_stream in voice_streams:
+            score.insert(0, voice_stream)
         
         # Add key signature
-        score.insert(0, detected_key)
+        score.insert(0, detected_key.to_music21())
         
         # Write output
         score.write('midi', fp=output_path)
-        print(f"Harmonized MIDI saved to: {output_path}")
-        
-        # Print statistics
-        print(f"\n=== Harmonization Statistics ===")
-        print(f"Total melody notes: {len(melody_notes_only)}")
-        print(f"Phrase boundaries detected: {len(phrase_boundaries)}")
-        print(f"Key: {detected_key}")
-        
         return output_path
     
-    def train_model(self, training_data_path):
-        """Placeholder for ML training (Phase 2)."""
-        print("ML training not yet implemented. Using rule-based system.")
-        pass
+    def chord_probabilities(self, melody, detected_key, phrase_boundaries, chords='auto'):
+        """
+        Per-event chord probabilities from the chord model for the whole
+        melody in one batched forward pass, or None to use the Markov
+        tables. With 'auto', a model that fails to load or run is logged
+        and this call falls back to the Markov tables (the model stays
+        loaded for the next one).
+        """
+        if chords not in CHORD_PREDICTION_MODES:
+            raise ValueError(f"Unknown chord prediction: {chords!r} (expected one of {CHORD_PREDICTION_MODES})")
+        if chords == 'markov' or (chords == 'auto' and self.chord_predictor is None):
+            return None
+        if self.chord_predictor is None:
+            raise ValueError("chords='model' needs a chord model (see load_model)")
+        
+        try:
+            return self.chord_predictor.predict_melody(melody, detected_key, phrase_boundaries)
+        except Exception:
+            if chords == 'model':
+                raise
+            logger.exception("Chord model failed, falling back to the Markov tables")
+            return None
+    
+    def train_model(self, training_data_path, epochs=20):
+        """
+        Train a chord model from an .npz file of `windows` and `labels`
+        arrays (see chord_model.training_arrays) and use it from now on.
+        """
+        data = np.load(training_data_path)
+        model = build_chord_model()
+        model.fit(data['windows'], data['labels'], epochs=epochs, validation_split=0.1, verbose=0)
+        self.chord_predictor = ChordPredictor(model=model)
+        self.chord_model_id = f'trained:{uuid.uuid4().hex[:16]}'
+        logger.info("Chord model trained on %d notes", len(data['labels']))
+        return model
     
     def load_model(self, model_path):
-        """Load pre-trained model."""
-        try:
-            from tensorflow import keras
-            self.model = keras.models.load_model(model_path)
-            print(f"Model loaded from {model_path}")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            print("Falling back to rule-based harmonization.")
+        """
+        Use the chord model saved at `model_path`. It is loaded on first use,
+        once per process; if that fails, harmonization falls back to the
+        rule-based Markov tables.
+        """
+        self.chord_predictor = load_chord_predictor(model_path)
+        self.chord_model_id = model_file_id(model_path)
+        logger.info("Using chord model %s", model_path)
+    
+    def load_markov_model(self, model_path):
+        """
+        Replace the functional-harmony transition tables with a trained
+        MarkovChordModel (.npz, see markov_model.py). The sampled path uses
+        its full order; the optimal and SATB searches its first-order
+        transitions.
+        """
+        model = MarkovChordModel.load(model_path)
+        self.markov_model_id = model_file_id(model_path)
+        self.chord_generator = ChordProgressionGenerator(model)
+        self.voice_search = ViterbiVoiceSearch(self)
+        self.satb_search = SATBVoiceSearch(self)
+        logger.info("Using order-%d Markov chord model %s", model.order, model_path)
+        return model
     
     def save_model(self, model_path):
         """Save trained model."""
-        if self.model:
-            self.model.save(model_path)
-            print(f"Model saved to {model_path}")
+        if self.chord_predictor:
+            self.chord_predictor.model.save(model_path)
+            logger.info("Model saved to %s", model_path)
 
 
 # === TESTING ===
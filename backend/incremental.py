@@ -0,0 +1,330 @@
+"""
+Incremental Re-Harmonization
+============================
+Re-harmonize an edited melody by recomputing only the phrases the edit
+touches.
+
+The sampled path harmonizes phrase by phrase (see
+`MIDIHarmonizer.harmonize_phrase`): each phrase's random draws are keyed
+by the seed and the phrase's notes (see phrase_uniforms), and only a small
+PhraseState (current chord, previous harmony/melody/bass pitches) flows
+from one phrase into the next. A HarmonizationState keeps that entry
+state and the voice offsets of every phrase, so after an edit:
+
+- phrases before the first changed event (or changed boundary flag) are
+  copied as they are;
+- phrases from there on are recomputed until one ends in the same state
+  the old harmonization had at that point, after which the old voices
+  are kept.
+
+The work done per update follows the edit, not the melody. Boundary flags
+are recomputed between the nearest events on either side of the edit
+where the old and new flags must agree (see _updated_boundaries). An edit
+that changes a duration also moves the mean duration long notes are
+measured against, so its cue flags are then rederived in one vectorized
+pass. The recomputed voices are spliced into the old ones in place. What
+still scales with the melody is copying: the edited Melody and its
+metric grid, and the per-phrase arrays.
+
+The result is identical to harmonizing the edited melody from scratch
+with the same key and seed, using the Markov chord tables (a learned
+chord model looks across phrase boundaries, so it is not used here).
+Edits must be time-preserving: events after the edit keep their onsets
+(use diff_melodies to derive an edit from two versions of a melody; a
+change that shifts everything after it simply produces an edit that runs
+to the end). Key analysis is not repeated; pass `detected_key` to
+update() to change it.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from harmonizer import PhraseDetector, phrase_starts
+from melody import Melody, Voice
+
+
+class MelodyEdit(namedtuple('MelodyEdit', ['start', 'stop', 'replacement'])):
+    """
+    Replace events [start, stop) of a melody with the events of
+    `replacement`, a Melody with absolute onsets. The replacement must fit
+    between the end of event start - 1 and the onset of event `stop`.
+    """
+
+    __slots__ = ()
+
+    def apply(self, melody):
+        """Return the edited Melody; raises ValueError if the edit does not fit."""
+        start, stop, replacement = self
+        if not 0 <= start <= stop <= len(melody):
+            raise ValueError(f"Edit range [{start}, {stop}) is outside the melody ({len(melody)} events)")
+
+        if len(replacement):
+            earliest = melody.onsets[start - 1] + melody.durations[start - 1] if start > 0 else 0.0
+            latest = melody.onsets[stop] if stop < len(melody) else np.inf
+            if replacement.onsets[0] < earliest or replacement.onsets[-1] + replacement.durations[-1] > latest:
+                raise ValueError("Edit replacement overlaps the events around it")
+
+        return melody.splice(start, stop, replacement)
+
+
+def diff_melodies(old, new):
+    """
+    Smallest MelodyEdit turning `old` into `new` (common prefix and suffix
+    of identical events are excluded), or None if they are equal.
+    """
+    limit = min(len(old), len(new))
+
+    def same_events(old_slice, new_slice):
+        return (
+            (old.onsets[old_slice] == new.onsets[new_slice])
+            & (old.durations[old_slice] == new.durations[new_slice])
+            & (old.pitches[old_slice] == new.pitches[new_slice])
+        )
+
+    same = same_events(slice(0, limit), slice(0, limit))
+    prefix = limit if same.all() else int(np.argmin(same))
+
+    tail = limit - prefix
+    same = same_events(slice(len(old) - tail, len(old)), slice(len(new) - tail, len(new)))[::-1]
+    suffix = tail if same.all() else int(np.argmin(same))
+
+    if prefix == len(old) == len(new):
+        return None
+
+    stop = len(new) - suffix
+    replacement = Melody(new.onsets[prefix:stop], new.durations[prefix:stop], new.pitches[prefix:stop])
+    return MelodyEdit(prefix, len(old) - suffix, replacement)
+
+
+class HarmonizationState:
+    """
+    A sampled harmonization plus what update() needs to reuse it: the
+    boundary flags and the cue flags and mean duration they came from
+    (see PhraseDetector.cue_mask), phrase starts, the PhraseState entering
+    each phrase (and after the last one) and where each phrase's notes
+    begin in the harmony and bass voices.
+    """
+
+    __slots__ = (
+        'melody', 'key', 'seed', 'boundaries', 'cues', 'mean_duration', 'starts', 'entry_states',
+        'harmony', 'bass', 'harmony_offsets', 'bass_offsets', 'recomputed',
+    )
+
+    def __init__(self, melody, key, seed, boundaries, cues, mean_duration, starts, entry_states,
+                 harmony, bass, harmony_offsets, bass_offsets, recomputed):
+        self.melody = melody
+        self.key = key
+        self.seed = seed
+        self.boundaries = boundaries
+        self.cues = cues
+        self.mean_duration = mean_duration
+        self.starts = starts
+        self.entry_states = entry_states
+        self.harmony = harmony
+        self.bass = bass
+        self.harmony_offsets = harmony_offsets
+        self.bass_offsets = bass_offsets
+        self.recomputed = recomputed      # phrases harmonized by the call that built this state
+
+    @property
+    def stops(self):
+        return np.append(self.starts[1:], len(self.melody))
+
+
+class IncrementalHarmonizer:
+    """
+    Sampled harmonization that can be updated after melody edits.
+    Uses the chord, harmony and bass passes of `harmonizer` (a MIDIHarmonizer).
+    """
+
+    def __init__(self, harmonizer):
+        self.harmonizer = harmonizer
+
+    def harmonize(self, melody, detected_key=None, seed=None):
+        """Harmonize `melody` from scratch and return its HarmonizationState."""
+        if detected_key is None:
+            detected_key = self.harmonizer.analyze_key(melody)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+        boundaries = PhraseDetector.boundary_mask(melody)
+        mean_duration = melody.durations.mean() if len(melody) else 0.0
+        cues = PhraseDetector.cue_mask(melody, mean_duration) if len(melody) >= 4 else np.zeros(len(melody), dtype=bool)
+        starts = phrase_starts(boundaries)
+        harmony = Voice('Harmony')
+        bass = Voice('Bass')
+        entry = self.harmonizer.initial_phrase_state(detected_key)
+
+        entry_states, harmony_offsets, bass_offsets, _ = self._harmonize_phrases(
+            melody, detected_key, boundaries, seed, starts, 0, entry, harmony, bass
+        )
+        return HarmonizationState(
+            melody, detected_key, seed, boundaries, cues, mean_duration, starts, entry_states, harmony, bass,
+            np.array(harmony_offsets, dtype=np.int64), np.array(bass_offsets, dtype=np.int64), len(starts),
+        )
+
+    def update(self, state, edit, detected_key=None):
+        """
+        Apply a MelodyEdit to a HarmonizationState and return the new state.
+        Only phrases from the first changed event up to the point where the
+        voice-leading state re-converges are harmonized again. An edit of
+        None (diff_melodies of equal melodies) returns `state` unchanged.
+
+        `state` is consumed: its voices are spliced in place and shared
+        with the returned state, so keep only the returned one.
+        """
+        if edit is None:
+            return state
+        melody = edit.apply(state.melody)
+        if (detected_key is not None and detected_key is not state.key) or min(len(melody), len(state.melody)) < 4:
+            return self.harmonize(melody, state.key if detected_key is None else detected_key, state.seed)
+
+        shift = len(melody) - len(state.melody)
+        boundaries, cues, mean_duration, lo, hi = _updated_boundaries(state, melody, edit)
+        starts = np.concatenate([
+            state.starts[:np.searchsorted(state.starts, lo, side='right')],
+            lo + 1 + np.flatnonzero(boundaries[lo:min(hi, len(melody) - 1)]),
+            state.starts[np.searchsorted(state.starts, hi - shift + 1):] + shift,
+        ])
+
+        # First event whose content or boundary flag may differ (flags
+        # outside [lo, hi) are unchanged)...
+        changed = np.flatnonzero(state.boundaries[lo:edit.start] != boundaries[lo:edit.start])
+        head = lo + int(changed[0]) if len(changed) else edit.start
+        # ...and the old index from which events and flags are unchanged
+        changed = np.flatnonzero(state.boundaries[edit.stop:hi - shift] != boundaries[edit.stop + shift:hi])
+        tail = edit.stop + int(changed[-1]) + 1 if len(changed) else edit.stop
+
+        # Old phrases that end before `head` are kept as they are (the last
+        # one ends with the melody, so an edit at the end reaches it)
+        kept = int(np.searchsorted(state.starts, head, side='right')) - 1
+        # Old phrases starting after `tail` can be reused once the state matches
+        first_reusable = int(np.searchsorted(state.starts, tail + 1))
+
+        def reusable(start, entry):
+            q = int(np.searchsorted(state.starts, start - shift))
+            if q >= first_reusable and q < len(state.starts) and state.starts[q] == start - shift:
+                if state.entry_states[q] == entry:
+                    return q
+            return None
+
+        harmony = Voice('Harmony')
+        bass = Voice('Bass')
+        entry_states, harmony_offsets, bass_offsets, converged = self._harmonize_phrases(
+            melody, state.key, boundaries, state.seed, starts, kept, state.entry_states[kept],
+            harmony, bass, reusable,
+        )
+
+        # Splice the recomputed phrases over old phrases [kept, end) in place;
+        # the voices of the phrases after them shift as a block
+        end = len(state.starts) if converged is None else converged
+        offsets = []
+        for voice, old_voice, old_offsets, new_offsets in (
+            (harmony, state.harmony, state.harmony_offsets, harmony_offsets),
+            (bass, state.bass, state.bass_offsets, bass_offsets),
+        ):
+            first, last = int(old_offsets[kept]), int(old_offsets[end])
+            old_voice.splice(first, last, voice)
+            offsets.append(np.concatenate([
+                old_offsets[:kept],
+                first + np.array(new_offsets[:-1], dtype=np.int64),
+                old_offsets[end:] + (len(voice) - (last - first)),
+            ]))
+        state.entry_states[kept:end + 1] = entry_states
+
+        return HarmonizationState(
+            melody, state.key, state.seed, boundaries, cues, mean_duration, starts, state.entry_states,
+            state.harmony, state.bass, offsets[0], offsets[1], len(entry_states) - 1,
+        )
+
+    def _harmonize_phrases(self, melody, detected_key, boundaries, seed, starts, first, entry, harmony, bass,
+                           reusable=None):
+        """
+        Harmonize the phrases beginning at starts[first:] in order, appending
+        to the voices. Stops early at a phrase for which `reusable(start,
+        state)` returns an old phrase index. Returns (entry_states,
+        harmony_offsets, bass_offsets, old phrase index or None) for the
+        phrases harmonized, plus the state after them.
+        """
+        entry_states = []
+        harmony_offsets = []
+        bass_offsets = []
+        converged = None
+        state = entry
+
+        for q in range(first, len(starts)):
+            start = int(starts[q])
+            if reusable is not None:
+                converged = reusable(start, state)
+                if converged is not None:
+                    break
+            stop = int(starts[q + 1]) if q + 1 < len(starts) else len(melody)
+            entry_states.append(state)
+            harmony_offsets.append(len(harmony))
+            bass_offsets.append(len(bass))
+            state = self.harmonizer.harmonize_phrase(
+                melody, start, stop, detected_key, boundaries, seed, state, harmony, bass
+            )
+
+        entry_states.append(state)
+        harmony_offsets.append(len(harmony))
+        bass_offsets.append(len(bass))
+        return entry_states, harmony_offsets, bass_offsets, converged
+
+
+def _updated_boundaries(state, melody, edit):
+    """
+    Cue and boundary flags of the edited `melody`, recomputed around the
+    edit only. Returns (boundaries, cues, mean_duration, lo, hi): flags
+    outside events [lo, hi) of `melody` are those of `state` (shifted
+    after the edit).
+    """
+    n = len(melody)
+    shift = n - len(state.melody)
+    start, stop = edit.start, edit.stop + shift
+
+    if np.array_equal(edit.replacement.durations, state.melody.durations[edit.start:edit.stop]):
+        # Same durations, same mean: a cue flag looks at its event and the
+        # two next to it, so only those around the edit can change
+        mean_duration = state.mean_duration
+        lo, hi = max(start - 1, 0), min(stop + 1, n)
+        first, last = max(lo - 1, 0), min(hi + 1, n)
+        window = PhraseDetector.cue_mask(_events(melody, first, last), mean_duration)
+        cues = np.concatenate([state.cues[:lo], window[lo - first:hi - first], state.cues[hi - shift:]])
+    else:
+        # The mean moved, and with it the long-note threshold of every event
+        mean_duration = melody.durations.mean()
+        cues = PhraseDetector.cue_mask(melody, mean_duration)
+        before = np.flatnonzero(cues[:start] != state.cues[:start])
+        after = np.flatnonzero(cues[stop:] != state.cues[edit.stop:])
+        lo = min(int(before[0]) if len(before) else start, max(start - 1, 0))
+        hi = max(stop + int(after[-1]) + 1 if len(after) else stop, min(stop + 1, n))
+
+    # Periodic boundaries look two cue flags either way and at the last
+    # periodic boundary within two events before them (added ones are the
+    # flags without a cue)
+    lo, hi = max(lo - 2, 0), min(hi + 2, n)
+    added = np.flatnonzero(state.boundaries[max(lo - 2, 0):lo] & ~state.cues[max(lo - 2, 0):lo])
+    last_added = max(lo - 2, 0) + int(added[-1]) if len(added) else lo - 3
+    while True:
+        first, last = max(lo - 2, 0), min(hi + 2, n)
+        mask = cues[first:last].copy()
+        new_last = first + PhraseDetector.add_periodic_boundaries(
+            _events(melody, first, last), mask, lo - first, hi - first, last_added - first
+        )
+        # Past `hi` the old and new flags agree once both chains do
+        old = hi - shift
+        added = np.flatnonzero(state.boundaries[max(old - 2, 0):old] & ~state.cues[max(old - 2, 0):old])
+        old_last = hi - old + max(old - 2, 0) + int(added[-1]) if len(added) else hi - 3
+        if hi == n or new_last == old_last or max(new_last, old_last) < hi - 2:
+            break
+        hi = min(hi + 3, n)
+
+    boundaries = np.concatenate([state.boundaries[:lo], mask[lo - first:hi - first], state.boundaries[hi - shift:]])
+    return boundaries, cues, mean_duration, lo, hi
+
+
+def _events(melody, start, stop):
+    """Events [start, stop) of `melody` as a Melody under the same meter."""
+    return Melody(melody.onsets[start:stop], melody.durations[start:stop], melody.pitches[start:stop], melody.meter)
@@ -0,0 +1,204 @@
+"""
+Harmonization Job Queue
+=======================
+Runs harmonizations in the background so /api/jobs can answer at once.
+
+- JobStore persists jobs in SQLite, so queued and running jobs survive a
+  restart and are picked up again by JobQueue.recover().
+- JobQueue runs jobs on a bounded thread pool and rejects new work with
+  QueueFullError once `max_pending` jobs are waiting or running. The
+  count comes from the store, so it covers every process sharing it.
+- Progress (notes processed / total) is written to the store at most
+  every `progress_interval` seconds while a job runs, so any worker
+  process can report it, and once more when the job finishes.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_COLUMNS = (
+    'id', 'status', 'filename', 'input_path', 'output_path', 'options',
+    'progress', 'total', 'error', 'created_at', 'updated_at',
+)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity."""
+
+
+class JobStore:
+    """SQLite-backed job records. Opens a short-lived connection per call."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    input_path TEXT NOT NULL,
+                    output_path TEXT NOT NULL,
+                    options TEXT NOT NULL DEFAULT '{}',
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )'''
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, job_id, filename, input_path, output_path, options, max_unfinished=None):
+        """
+        Insert a queued job; returns whether it was created. With
+        `max_unfinished`, it is only created while fewer jobs are queued or
+        running (counted by the same statement, so concurrent processes
+        cannot overshoot).
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (id, status, filename, input_path, output_path, options, created_at, updated_at) '
+                'SELECT ?, ?, ?, ?, ?, ?, ?, ? '
+                'WHERE ? IS NULL OR (SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)) < ?',
+                (job_id, QUEUED, filename, input_path, output_path, json.dumps(options), now, now,
+                 max_unfinished, QUEUED, RUNNING, max_unfinished),
+            )
+        return cursor.rowcount == 1
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def count_unfinished(self):
+        """Number of jobs queued or running."""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)).fetchone()[0]
+
+    def unfinished(self):
+        """Jobs that were queued or running, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs WHERE status IN (?, ?) ORDER BY created_at',
+                (QUEUED, RUNNING),
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(zip(JOB_COLUMNS, row))
+        job['options'] = json.loads(job['options'])
+        return job
+
+
+class JobQueue:
+    """
+    Bounded background executor for harmonization jobs.
+    `run_job(input_path, output_path, options, progress)` does the work;
+    results are written to `output_folder/<job_id>.mid`.
+
+    `max_pending` caps the jobs queued or running in the store, across all
+    processes sharing it. A job left running by a killed process counts
+    until recover() picks it up again.
+    """
+
+    def __init__(self, store, run_job, output_folder, workers=2, max_pending=16, progress_interval=0.5):
+        self.store = store
+        self.run_job = run_job
+        self.output_folder = output_folder
+        self.max_pending = max_pending
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='harmonize-job')
+        self._progress = {}
+
+    def submit(self, filename, input_path, options=None):
+        """Queue a job and return its id; raises QueueFullError at capacity."""
+        job_id = uuid.uuid4().hex
+        output_path = os.path.join(self.output_folder, f'{job_id}.mid')
+        if not self.store.create(job_id, filename, input_path, output_path, options or {}, self.max_pending):
+            raise QueueFullError(f'Job queue is full ({self.max_pending} pending)')
+        try:
+            self._executor.submit(self._run, job_id, input_path, output_path, options or {})
+        except Exception as e:
+            self.store.update(job_id, status=FAILED, error=str(e))
+            raise
+        return job_id
+
+    def recover(self):
+        """Re-queue jobs left queued or running by a previous process."""
+        jobs = self.store.unfinished()
+        for job in jobs:
+            self.store.update(job['id'], status=QUEUED, progress=0)
+            self._executor.submit(self._run, job['id'], job['input_path'], job['output_path'], job['options'])
+        return len(jobs)
+
+    def status(self, job_id):
+        """
+        Job record, or None. Progress comes from the store (at most
+        `progress_interval` old), or live for jobs running in this process.
+        """
+        job = self.store.get(job_id)
+        if job and job['id'] in self._progress:
+            job['progress'], job['total'] = self._progress[job['id']]
+        return job
+
+    @property
+    def pending(self):
+        """Jobs queued or running in all processes sharing the store."""
+        return self.store.count_unfinished()
+
+    def _run(self, job_id, input_path, output_path, options):
+        last_write = time.monotonic()
+
+        def progress(done, total):
+            nonlocal last_write
+            self._progress[job_id] = (done, total)
+            now = time.monotonic()
+            if now - last_write >= self.progress_interval:
+                last_write = now
+                self.store.update(job_id, progress=done, total=total)
+
+        try:
+            self.store.update(job_id, status=RUNNING)
+            self.run_job(input_path, output_path, options, progress)
+            done, total = self._progress.get(job_id, (0, 0))
+            self.store.update(job_id, status=DONE, progress=done, total=total)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self.store.update(job_id, status=FAILED, error=str(e))
+        finally:
+            self._progress.pop(job_id, None)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
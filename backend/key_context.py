@@ -0,0 +1,181 @@
+"""
+Per-Key Lookup Tables
+=====================
+Everything the harmonizer needs to know about a key, computed once.
+
+A `KeyContext` holds the scale pitch classes, the chord-tone pitch classes
+of every numeral, a pitch-class -> scale-degree index and cumulative
+transition weights for chord sampling. All 24 major/minor contexts are
+built at module load and shared by every request.
+"""
+
+from bisect import bisect
+
+import numpy as np
+
+# Scale steps in semitones above the tonic (minor = natural minor,
+# matching music21's Key.getScale())
+SCALE_STEPS = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+}
+
+# Tonic spellings used for display and export (music21 accidental style)
+TONIC_NAMES = ('C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B')
+
+# Chord definitions (scale degrees for each chord)
+# Scale degrees: 1=tonic, 2=supertonic, etc. (0-indexed: 0, 1, 2, 3, 4, 5, 6)
+MAJOR_CHORD_TONES = {
+    'I': [0, 2, 4],      # 1, 3, 5
+    'ii': [1, 3, 5],     # 2, 4, 6
+    'iii': [2, 4, 6],    # 3, 5, 7
+    'IV': [3, 5, 0],     # 4, 6, 1
+    'V': [4, 6, 1],      # 5, 7, 2
+    'vi': [5, 0, 2],     # 6, 1, 3
+    'viio': [6, 1, 3],   # 7, 2, 4
+}
+
+MINOR_CHORD_TONES = {
+    'i': [0, 2, 4],
+    'iio': [1, 3, 5],
+    'III': [2, 4, 6],
+    'iv': [3, 5, 0],
+    'V': [4, 6, 1],      # Raised 7th for dominant
+    'VI': [5, 0, 2],
+    'viio': [6, 1, 3],
+}
+
+# Transition probabilities: from_chord -> {to_chord: probability}
+# Based on functional harmony analysis of classical music
+MAJOR_TRANSITIONS = {
+    'I': {'I': 0.05, 'ii': 0.15, 'iii': 0.05, 'IV': 0.25, 'V': 0.30, 'vi': 0.15, 'viio': 0.05},
+    'ii': {'I': 0.05, 'ii': 0.05, 'iii': 0.05, 'IV': 0.10, 'V': 0.60, 'vi': 0.05, 'viio': 0.10},
+    'iii': {'I': 0.05, 'ii': 0.10, 'iii': 0.05, 'IV': 0.30, 'V': 0.10, 'vi': 0.35, 'viio': 0.05},
+    'IV': {'I': 0.20, 'ii': 0.15, 'iii': 0.05, 'IV': 0.05, 'V': 0.40, 'vi': 0.05, 'viio': 0.10},
+    'V': {'I': 0.55, 'ii': 0.05, 'iii': 0.05, 'IV': 0.10, 'V': 0.05, 'vi': 0.15, 'viio': 0.05},
+    'vi': {'I': 0.10, 'ii': 0.25, 'iii': 0.10, 'IV': 0.30, 'V': 0.15, 'vi': 0.05, 'viio': 0.05},
+    'viio': {'I': 0.70, 'ii': 0.05, 'iii': 0.05, 'IV': 0.05, 'V': 0.05, 'vi': 0.05, 'viio': 0.05},
+}
+
+MINOR_TRANSITIONS = {
+    'i': {'i': 0.05, 'iio': 0.10, 'III': 0.10, 'iv': 0.25, 'V': 0.30, 'VI': 0.15, 'viio': 0.05},
+    'iio': {'i': 0.05, 'iio': 0.05, 'III': 0.05, 'iv': 0.10, 'V': 0.60, 'VI': 0.05, 'viio': 0.10},
+    'III': {'i': 0.10, 'iio': 0.05, 'III': 0.05, 'iv': 0.30, 'V': 0.10, 'VI': 0.35, 'viio': 0.05},
+    'iv': {'i': 0.20, 'iio': 0.10, 'III': 0.05, 'iv': 0.05, 'V': 0.45, 'VI': 0.05, 'viio': 0.10},
+    'V': {'i': 0.55, 'iio': 0.05, 'III': 0.05, 'iv': 0.10, 'V': 0.05, 'VI': 0.15, 'viio': 0.05},
+    'VI': {'i': 0.10, 'iio': 0.20, 'III': 0.10, 'iv': 0.30, 'V': 0.20, 'VI': 0.05, 'viio': 0.05},
+    'viio': {'i': 0.70, 'iio': 0.05, 'III': 0.05, 'iv': 0.05, 'V': 0.05, 'VI': 0.05, 'viio': 0.05},
+}
+
+CHORD_TONES = {'major': MAJOR_CHORD_TONES, 'minor': MINOR_CHORD_TONES}
+TRANSITIONS = {'major': MAJOR_TRANSITIONS, 'minor': MINOR_TRANSITIONS}
+
+# find_best_chord_for_melody weighting: chords containing the melody note
+# score 2.0x their transition probability, others (passing tones) 0.3x
+CHORD_FIT_WEIGHT = 2.0
+CHORD_MISFIT_WEIGHT = 0.3
+
+
+def cumulative(weights):
+    """Running totals of `weights` as a tuple (for bisect-style sampling)."""
+    return tuple(np.cumsum(weights).tolist())
+
+
+def sample(population, cum_weights, rng, uniform=None):
+    """
+    Draw one item using precomputed cumulative weights.
+    `rng` is anything with a random() method returning [0, 1): a seeded
+    np.random.Generator, a random.Random, or the random module itself.
+    A precomputed draw in [0, 1) can be passed as `uniform` instead.
+    """
+    if uniform is None:
+        uniform = rng.random()
+    return population[bisect(cum_weights, uniform * cum_weights[-1])]
+
+
+class KeyContext:
+    """
+    Lookup tables for one key. Build through get_key_context() so the
+    shared, precomputed instance is reused.
+    """
+
+    __slots__ = (
+        'tonic', 'mode', 'tonic_name', 'tonic_numeral', 'numerals',
+        'scale_pitches', 'chord_pitches', 'degree_of', 'chord_degrees',
+        'next_chords', 'transition_cum_weights', 'melody_fit_cum_weights',
+    )
+
+    def __init__(self, tonic, mode):
+        self.tonic = tonic % 12
+        self.mode = mode
+        self.tonic_name = TONIC_NAMES[self.tonic]
+
+        chord_tones = CHORD_TONES[mode]
+        transitions = TRANSITIONS[mode]
+        self.numerals = tuple(chord_tones)
+        self.tonic_numeral = self.numerals[0]
+
+        # Scale pitch classes and the reverse index (-1 = non-diatonic)
+        self.scale_pitches = tuple((self.tonic + step) % 12 for step in SCALE_STEPS[mode])
+        self.degree_of = [-1] * 12
+        for degree, pitch_class in enumerate(self.scale_pitches):
+            self.degree_of[pitch_class] = degree
+
+        # Chord tones per numeral, as scale degrees and as pitch classes
+        self.chord_degrees = {n: frozenset(degrees) for n, degrees in chord_tones.items()}
+        self.chord_pitches = {
+            n: tuple(self.scale_pitches[d] for d in degrees) for n, degrees in chord_tones.items()
+        }
+
+        # Markov sampling tables: plain transitions, and transitions weighted by
+        # whether the next chord contains melody scale degree d
+        self.next_chords = {}
+        self.transition_cum_weights = {}
+        self.melody_fit_cum_weights = {}
+        for prev_chord, probs in transitions.items():
+            next_chords = tuple(probs)
+            weights = [probs[c] for c in next_chords]
+            self.next_chords[prev_chord] = next_chords
+            self.transition_cum_weights[prev_chord] = cumulative(weights)
+            self.melody_fit_cum_weights[prev_chord] = tuple(
+                cumulative([
+                    w * (CHORD_FIT_WEIGHT if degree in self.chord_degrees[c] else CHORD_MISFIT_WEIGHT)
+                    for c, w in zip(next_chords, weights)
+                ])
+                for degree in range(len(self.scale_pitches))
+            )
+
+    def __repr__(self):
+        return f"<KeyContext {self}>"
+
+    def __str__(self):
+        # Same convention as music21: lowercase tonic for minor keys
+        tonic_name = self.tonic_name if self.mode == 'major' else self.tonic_name.lower()
+        return f"{tonic_name} {self.mode}"
+
+    def resolve(self, numeral):
+        """Map unknown numerals to the tonic, as the harmonizer always has."""
+        return numeral if numeral in self.chord_pitches else self.tonic_numeral
+
+    def to_music21(self):
+        """Build the equivalent music21 Key (only needed for music21 export)."""
+        from music21 import key
+        return key.Key(self.tonic_name if self.mode == 'major' else self.tonic_name.lower())
+
+    @classmethod
+    def from_key(cls, music21_key):
+        """Shared context for a music21 Key (or anything with .tonic and .mode)."""
+        mode = 'major' if music21_key.mode == 'major' else 'minor'
+        return get_key_context(music21_key.tonic.pitchClass, mode)
+
+
+KEY_CONTEXTS = {
+    (tonic, mode): KeyContext(tonic, mode)
+    for mode in ('major', 'minor')
+    for tonic in range(12)
+}
+
+
+def get_key_context(tonic, mode):
+    """Return the precomputed context for a tonic pitch class and mode."""
+    return KEY_CONTEXTS[(tonic % 12, 'major' if mode == 'major' else 'minor')]
@@ -0,0 +1,121 @@
+"""
+Fast Key Detection
+==================
+Profile-correlation key finder working directly on a compact Melody.
+
+Builds a duration-weighted pitch-class histogram with NumPy and correlates
+it against all 24 rotated major/minor key profiles in one matrix multiply
+(Pearson correlation, as in music21's KeyWeightKeyAnalysis). The default
+Aarden-Essen weights are the ones behind music21's `analyze('key')`, so
+results match the slow path without building a music21 stream.
+
+A windowed mode reports local keys over time from the same histogram
+machinery (cumulative per-beat histograms, one matmul for all windows).
+"""
+
+import numpy as np
+
+from key_context import get_key_context
+from melody import REST
+
+# Key profiles indexed by semitones above the tonic
+KEY_PROFILES = {
+    'aarden-essen': (
+        [17.7661, 0.145624, 14.9265, 0.160186, 19.8049, 11.3587,
+         0.291248, 22.062, 0.145624, 8.15494, 0.232998, 4.95122],
+        [18.2648, 0.737619, 14.0499, 16.8599, 0.702494, 14.4362,
+         0.702494, 18.6161, 4.56621, 1.93186, 7.37619, 1.75623],
+    ),
+    'krumhansl': (
+        [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+        [6.33, 2.68, 3.52, 5.38, 2.6, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17],
+    ),
+}
+
+# Row k of the profile matrix is tonic k % 12, major for k < 12 else minor
+KEY_MODES = ('major',) * 12 + ('minor',) * 12
+
+
+def _standardize(rows):
+    """Center each row and scale it to unit length (zero rows stay zero)."""
+    centered = rows - rows.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=-1, keepdims=True)
+    return np.divide(centered, norms, out=np.zeros_like(centered), where=norms > 0)
+
+
+class KeyDetector:
+    """
+    Correlates pitch-class histograms against precomputed key profiles.
+    Use get_key_detector() to share one instance per profile.
+    """
+
+    def __init__(self, profile='aarden-essen'):
+        if profile not in KEY_PROFILES:
+            raise ValueError(f"Unknown key profile: {profile!r} (expected one of {tuple(KEY_PROFILES)})")
+        self.profile = profile
+
+        major, minor = (np.array(p, dtype=np.float64) for p in KEY_PROFILES[profile])
+        # Profile for tonic t: weight of pitch class j is profile[(j - t) % 12]
+        shifts = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+        self.profiles = _standardize(np.vstack([major[shifts], minor[shifts]]))   # (24, 12)
+
+    @staticmethod
+    def histogram(melody):
+        """Duration-weighted pitch-class histogram of the melody's notes."""
+        notes = melody.pitches != REST
+        return np.bincount(
+            melody.pitches[notes] % 12, weights=melody.durations[notes], minlength=12
+        )
+
+    def correlations(self, histograms):
+        """Pearson correlation of each histogram (..., 12) with all 24 keys."""
+        return _standardize(np.asarray(histograms, dtype=np.float64)) @ self.profiles.T
+
+    def detect(self, melody):
+        """Return the KeyContext that best matches the whole melody."""
+        return self.detect_histogram(self.histogram(melody))
+
+    def detect_histogram(self, histogram):
+        """Return the KeyContext that best matches a pitch-class histogram (see histogram)."""
+        scores = self.correlations(histogram)
+        best = int(np.argmax(scores))
+        return get_key_context(best % 12, KEY_MODES[best])
+
+    def detect_windowed(self, melody, window=8.0, hop=4.0):
+        """
+        Local keys over time.
+
+        Notes are binned per beat by onset, cumulative histograms give every
+        window's histogram by subtraction, and all windows are correlated in
+        one matmul. Returns a list of (window_start, KeyContext, correlation).
+        """
+        notes = melody.pitches != REST
+        if not np.any(notes):
+            return []
+
+        beats = np.floor(melody.onsets[notes]).astype(np.int64)
+        num_beats = int(beats.max()) + 1
+        per_beat = np.zeros((num_beats + 1, 12))
+        np.add.at(per_beat, (beats + 1, melody.pitches[notes] % 12), melody.durations[notes])
+        cumulative = np.cumsum(per_beat, axis=0)
+
+        starts = np.arange(0, max(num_beats - window, 0) + hop, hop)
+        start_beats = np.minimum(np.floor(starts).astype(np.int64), num_beats)
+        end_beats = np.minimum(np.floor(starts + window).astype(np.int64), num_beats)
+        scores = self.correlations(cumulative[end_beats] - cumulative[start_beats])
+
+        best = np.argmax(scores, axis=1)
+        return [
+            (float(start), get_key_context(k % 12, KEY_MODES[k]), float(scores[w, k]))
+            for w, (start, k) in enumerate(zip(starts.tolist(), best.tolist()))
+        ]
+
+
+_DETECTORS = {}
+
+
+def get_key_detector(profile='aarden-essen'):
+    """Shared KeyDetector per profile (profiles are standardized once)."""
+    if profile not in _DETECTORS:
+        _DETECTORS[profile] = KeyDetector(profile)
+    return _DETECTORS[profile]
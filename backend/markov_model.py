@@ -0,0 +1,376 @@
+"""
+Trainable Markov Chord Model
+============================
+n-th order Markov model over the seven diatonic chords of a mode, trained
+from a local corpus and used in place of the hand-written functional
+harmony tables of ChordProgressionGenerator.
+
+Chords are integer ids (their index in the mode's numerals, I..viio or
+i..viio). For every context length k = 0..order the model keeps transition
+counts indexed by (mode, context code, next chord), where the context code
+is the last k chord ids in base 7. Short contexts are dense NumPy tables;
+once 2 x 7^k rows exceed DENSE_MAX_ROWS a level is stored sparsely as the
+sorted codes of the contexts actually seen plus one count row each.
+
+Probabilities interpolate each level with the one below (Dirichlet
+smoothing, weight `concentration`), so unseen contexts back off to
+shorter ones:
+
+    P_k(c | ctx) = (count_k(ctx, c) + concentration * P_k-1(c | ctx[1:])) / (count_k(ctx) + concentration)
+
+Dense levels are turned into probability tables once; sampling and
+scoring are integer-index lookups. Models save to and load from .npz.
+
+Training reads roman-numeral text (one progression per line, e.g.
+"major: I vi ii V I") and MIDI files (key detected from the pitch-class
+histogram, one chord per harmonic slot of the file's meter by template
+matching, repeats merged),
+counting n-grams in a process pool and summing the counts.
+
+Usage (from backend/):
+    python markov_model.py CORPUS [CORPUS ...] -o chords.npz [--order 2] [-j WORKERS]
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from bisect import bisect
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from key_context import CHORD_TONES
+
+MODES = ('major', 'minor')
+NUMERALS = {mode: tuple(CHORD_TONES[mode]) for mode in MODES}
+CHORD_IDS = {mode: {numeral: i for i, numeral in enumerate(NUMERALS[mode])} for mode in MODES}
+NUM_CHORDS = 7
+
+# Levels with more (mode, context) rows than this are stored sparsely
+DENSE_MAX_ROWS = 2 * NUM_CHORDS ** 4
+
+CORPUS_EXTENSIONS = ('.txt', '.mid', '.midi')
+
+
+class MarkovChordModel:
+    """
+    Chord transition counts for context lengths 0..order, with smoothed
+    probabilities. Build with fit() or load().
+    """
+
+    def __init__(self, order=1, concentration=2.0):
+        if order < 1:
+            raise ValueError("order must be at least 1")
+        self.order = order
+        self.concentration = concentration
+        # Per level: (keys, counts). keys is None for dense levels (row = mode * 7^k + context)
+        self.levels = [(None, np.zeros((2 * NUM_CHORDS ** k, NUM_CHORDS))) for k in range(order + 1)]
+        for k in range(order + 1):
+            if self.is_sparse(k):
+                self.levels[k] = (np.zeros(0, dtype=np.int64), np.zeros((0, NUM_CHORDS)))
+        self._tables = []
+
+    def is_sparse(self, k):
+        return 2 * NUM_CHORDS ** k > DENSE_MAX_ROWS
+
+    # === TRAINING ===
+
+    def fit(self, sequences):
+        """Count the n-grams of (mode, chord ids) sequences; returns self."""
+        return self.add_counts(ngram_counts(sequences, self.order))
+
+    def add_counts(self, level_counts):
+        """
+        Add n-gram counts as produced by ngram_counts(): one (codes, counts)
+        pair per level, codes being (mode * 7^k + context) * 7 + next.
+        """
+        for k, (codes, counts) in enumerate(level_counts):
+            rows, nexts = np.divmod(codes, NUM_CHORDS)
+            keys, table = self.levels[k]
+            if keys is None:
+                np.add.at(table, (rows, nexts), counts)
+                continue
+            merged_keys, inverse = np.unique(np.concatenate([keys, rows]), return_inverse=True)
+            merged = np.zeros((len(merged_keys), NUM_CHORDS))
+            merged[inverse[:len(keys)]] = table
+            np.add.at(merged, (inverse[len(keys):], nexts), counts)
+            self.levels[k] = (merged_keys, merged)
+        self._tables = []
+        return self
+
+    # === PROBABILITIES ===
+
+    def _build_tables(self):
+        """Probability tables of the dense levels, each smoothed with the level below."""
+        tables = []
+        for k, (keys, counts) in enumerate(self.levels):
+            if keys is not None:
+                break
+            if k == 0:
+                tables.append((counts + 1.0) / (counts.sum(axis=1, keepdims=True) + NUM_CHORDS))
+                continue
+            rows = np.arange(2 * NUM_CHORDS ** k)
+            mode, context = np.divmod(rows, NUM_CHORDS ** k)
+            shorter = tables[-1][mode * NUM_CHORDS ** (k - 1) + context % NUM_CHORDS ** (k - 1)]
+            tables.append(
+                (counts + self.concentration * shorter)
+                / (counts.sum(axis=1, keepdims=True) + self.concentration)
+            )
+        self._tables = tables
+
+    def probabilities(self, mode, history):
+        """
+        Distribution of the next chord id given `history`, a sequence of
+        chord ids (most recent last). Only the last `order` ids are used;
+        shorter histories use the matching lower level.
+        """
+        if not self._tables:
+            self._build_tables()
+        mode_index = MODES.index(mode)
+        length = min(len(history), self.order)
+        context = 0
+        for chord_id in history[len(history) - length:]:
+            context = context * NUM_CHORDS + chord_id
+
+        dense = min(length, len(self._tables) - 1)
+        probs = self._tables[dense][mode_index * NUM_CHORDS ** dense + context % NUM_CHORDS ** dense]
+        for k in range(dense + 1, length + 1):
+            keys, counts = self.levels[k]
+            row = mode_index * NUM_CHORDS ** k + context % NUM_CHORDS ** k
+            i = int(np.searchsorted(keys, row))
+            if i < len(keys) and keys[i] == row:
+                probs = (counts[i] + self.concentration * probs) / (counts[i].sum() + self.concentration)
+        return probs
+
+    def transition_matrix(self, mode):
+        """First-order (7, 7) transition probabilities of a mode."""
+        return np.array([self.probabilities(mode, [c]) for c in range(NUM_CHORDS)])
+
+    def transition_dict(self, mode):
+        """transition_matrix() as {from_numeral: {to_numeral: probability}} (the key_context layout)."""
+        numerals = NUMERALS[mode]
+        return {
+            a: {b: float(p) for b, p in zip(numerals, row)}
+            for a, row in zip(numerals, self.transition_matrix(mode).tolist())
+        }
+
+    def sample(self, mode, history, rng, weights=None):
+        """Draw the next chord id; `weights` (7,) rescales the distribution first."""
+        probs = self.probabilities(mode, history)
+        if weights is not None:
+            probs = probs * weights
+        cum_weights = np.cumsum(probs).tolist()
+        return bisect(cum_weights, rng.random() * cum_weights[-1])
+
+    def log_likelihood(self, mode, chord_ids):
+        """Sum of log P(chord | preceding chords) over a sequence of chord ids."""
+        chord_ids = list(chord_ids)
+        return float(sum(
+            np.log(self.probabilities(mode, chord_ids[:i])[c]) for i, c in enumerate(chord_ids)
+        ))
+
+    # === STORAGE ===
+
+    def save(self, path):
+        """Write the counts to an .npz file."""
+        arrays = {'order': self.order, 'concentration': self.concentration}
+        for k, (keys, counts) in enumerate(self.levels):
+            arrays[f'counts_{k}'] = counts
+            if keys is not None:
+                arrays[f'keys_{k}'] = keys
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls(int(data['order']), float(data['concentration']))
+            for k in range(model.order + 1):
+                keys = data[f'keys_{k}'] if f'keys_{k}' in data else None
+                model.levels[k] = (keys, data[f'counts_{k}'])
+        return model
+
+
+def ngram_counts(sequences, order):
+    """
+    Count the n-grams (context length 0..order) of (mode, chord ids)
+    sequences. Returns one (codes, counts) pair of arrays per level.
+    """
+    levels = []
+    for k in range(order + 1):
+        codes = []
+        for mode, chord_ids in sequences:
+            chord_ids = np.asarray(chord_ids, dtype=np.int64)
+            if len(chord_ids) <= k:
+                continue
+            context = np.zeros(len(chord_ids) - k, dtype=np.int64)
+            for j in range(k):
+                context = context * NUM_CHORDS + chord_ids[j:len(chord_ids) - k + j]
+            rows = MODES.index(mode) * NUM_CHORDS ** k + context
+            codes.append(rows * NUM_CHORDS + chord_ids[k:])
+        codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+        unique, counts = np.unique(codes, return_counts=True)
+        levels.append((unique, counts.astype(np.float64)))
+    return levels
+
+
+# === CORPUS READING ===
+
+_NUMERAL = re.compile(r'^(?:b|#)?([ivIV]+)(o|°|ø)?')
+
+
+def normalize_numeral(token, mode):
+    """Chord id of a roman numeral token such as 'V7', 'ii6' or 'vii°', or None."""
+    match = _NUMERAL.match(token)
+    if not match or token[0] in 'b#':
+        return None
+    numeral = match.group(1) + ('o' if match.group(2) or match.group(1).lower() == 'vii' else '')
+    if mode == 'minor' and numeral == 'ii':
+        numeral = 'iio'
+    return CHORD_IDS[mode].get(numeral)
+
+
+def read_roman_numerals(path):
+    """
+    Chord sequences from a text file with one progression per line,
+    "major: I IV V I" or "minor: i iv V i". Unknown chords split a line.
+    """
+    sequences = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            mode, _, progression = line.partition(':')
+            mode = mode.strip().lower()
+            if mode not in MODES:
+                continue
+            current = []
+            for token in progression.split():
+                chord_id = normalize_numeral(token, mode)
+                if chord_id is None:
+                    if len(current) > 1:
+                        sequences.append((mode, current))
+                    current = []
+                else:
+                    current.append(chord_id)
+            if len(current) > 1:
+                sequences.append((mode, current))
+    return sequences
+
+
+def read_midi_chords(path):
+    """
+    One chord sequence per MIDI file: key from the duration-weighted
+    pitch-class histogram, the best-matching diatonic triad in every
+    harmonic slot of the file's meter (the harmonizer's chord rhythm),
+    consecutive repeats merged.
+    """
+    import mido
+
+    from extraction import DRUM_CHANNEL, NoteEvents
+    from key_context import get_key_context
+    from key_detection import KEY_MODES, get_key_detector
+
+    events = NoteEvents.from_midi_file(mido.MidiFile(path))
+    pitched = events.channels != DRUM_CHANNEL
+    if not pitched.any():
+        return []
+    pitch_classes = events.pitches[pitched] % 12
+    durations = (events.ends - events.onsets)[pitched]
+
+    scores = get_key_detector().correlations(np.bincount(pitch_classes, weights=durations, minlength=12))
+    best = int(np.argmax(scores))
+    mode = KEY_MODES[best]
+    detected_key = get_key_context(best % 12, mode)
+
+    # Chord templates: +1 for chord tones, -0.5 for the other pitch classes
+    templates = np.full((NUM_CHORDS, 12), -0.5)
+    for c, numeral in enumerate(NUMERALS[mode]):
+        templates[c, list(detected_key.chord_pitches[numeral])] = 1.0
+
+    _, segments = np.unique(events.meter.grid(events.onsets[pitched]).slots, return_inverse=True)
+    histograms = np.zeros((int(segments.max()) + 1, 12))
+    np.add.at(histograms, (segments, pitch_classes), durations)
+    sounding = histograms.sum(axis=1) > 0
+    chord_ids = np.argmax(histograms[sounding] @ templates.T, axis=1)
+    chord_ids = chord_ids[np.append(True, chord_ids[1:] != chord_ids[:-1])]
+    return [(mode, chord_ids.tolist())] if len(chord_ids) > 1 else []
+
+
+def read_chord_sequences(path):
+    """Chord sequences of one corpus file (by extension)."""
+    if path.lower().endswith('.txt'):
+        return read_roman_numerals(path)
+    return read_midi_chords(path)
+
+
+def collect_corpus(patterns):
+    """Corpus files under directories (recursively) or matching glob patterns."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.lower().endswith(CORPUS_EXTENSIONS))
+        else:
+            paths.extend(path for path in sorted(glob.glob(pattern, recursive=True))
+                         if path.lower().endswith(CORPUS_EXTENSIONS))
+    return paths
+
+
+def _count_files(paths, order):
+    """Worker: n-gram counts of a chunk of corpus files, plus the files that failed."""
+    sequences = []
+    failed = []
+    for path in paths:
+        try:
+            sequences.extend(read_chord_sequences(path))
+        except Exception as e:
+            failed.append((path, str(e)))
+    return ngram_counts(sequences, order), len(sequences), failed
+
+
+def train(paths, order=2, concentration=2.0, workers=None, chunk_size=64):
+    """
+    Train a MarkovChordModel on corpus files in a process pool. Each
+    worker counts a chunk of files; the counts are summed in this process.
+    Returns (model, sequences_read, failed_files).
+    """
+    model = MarkovChordModel(order, concentration)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    num_sequences = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for level_counts, sequences, chunk_failed in executor.map(_count_files, chunks, [order] * len(chunks)):
+            model.add_counts(level_counts)
+            num_sequences += sequences
+            failed.extend(chunk_failed)
+    return model, num_sequences, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', nargs='+', help='directories or glob patterns (.txt, .mid, .midi)')
+    parser.add_argument('-o', '--output', required=True, help='model file (.npz)')
+    parser.add_argument('--order', type=int, default=2)
+    parser.add_argument('--concentration', type=float, default=2.0)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    args = parser.parse_args(argv)
+
+    paths = collect_corpus(args.corpus)
+    if not paths:
+        print("No corpus files found")
+        return 1
+
+    start = time.perf_counter()
+    model, sequences, failed = train(paths, args.order, args.concentration, args.workers)
+    model.save(args.output)
+    for path, error in failed:
+        print(f"[error] {path}: {error}")
+    print(f"{len(paths) - len(failed)} files, {sequences} progressions, order {args.order} "
+          f"in {time.perf_counter() - start:.2f}s -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
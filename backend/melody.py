@@ -0,0 +1,233 @@
+"""
+Compact Melody Representation
+=============================
+Parallel-array melody and voice models used by every harmonization stage.
+
+A melody is three aligned NumPy arrays:
+- onsets:    start of each event in quarter lengths
+- durations: length of each event in quarter lengths
+- pitches:   MIDI note number, or REST for silence
+
+plus the piece's MeterIndex (time signatures, tempo map), whose per-event
+MetricGrid (bars, beat strengths, harmonic slots) is computed once on
+first use.
+
+`Melody.from_midi` reads note-on/note-off events straight from the file
+with mido, skipping music21's object graph entirely, and picks the melody
+line with the skyline extraction in extraction.py. `Melody.from_stream`
+converts an already-parsed music21 stream so both ingest paths feed the
+same pipeline and their results can be compared.
+
+Generated harmony and bass lines are collected in `Voice` objects, which
+append into typed arrays instead of allocating a music21 Note per event.
+"""
+
+import os
+from array import array
+
+import mido
+import numpy as np
+
+from extraction import NoteEvents
+from meter import DEFAULT_METER, MeterIndex, MetricGrid
+
+REST = -1
+
+# Gaps shorter than this (in quarter lengths) are treated as articulation,
+# not as rests. music21 hides them the same way by quantizing to 16ths.
+MIN_REST_LENGTH = 0.25
+
+
+class Melody:
+    """
+    Monophonic melody stored as parallel onset/duration/pitch arrays.
+    Rests are events whose pitch is REST. `meter` defaults to 4/4 at 120 BPM.
+    """
+
+    __slots__ = ('onsets', 'durations', 'pitches', 'meter', '_grid')
+
+    def __init__(self, onsets, durations, pitches, meter=None):
+        self.onsets = np.asarray(onsets, dtype=np.float64)
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.pitches = np.asarray(pitches, dtype=np.int16)
+        self.meter = meter or DEFAULT_METER
+        self._grid = None
+
+    def __len__(self):
+        return len(self.pitches)
+
+    @property
+    def note_mask(self):
+        """Boolean mask of pitched (non-rest) events."""
+        return self.pitches != REST
+
+    @property
+    def note_count(self):
+        return int(np.count_nonzero(self.pitches != REST))
+
+    @property
+    def grid(self):
+        """MetricGrid of every event (see MeterIndex.grid), computed on first use."""
+        if self._grid is None:
+            self._grid = self.meter.grid(self.onsets)
+        return self._grid
+
+    def with_meter(self, meter):
+        """The same events under another MeterIndex."""
+        return Melody(self.onsets, self.durations, self.pitches, meter)
+
+    def splice(self, start, stop, replacement):
+        """
+        The melody with events [start, stop) replaced by those of
+        `replacement` (absolute onsets), under this melody's meter. A grid
+        already computed is carried over, as every other event keeps its
+        onset; only the replacement's grid is computed.
+        """
+        melody = Melody(
+            np.concatenate([self.onsets[:start], replacement.onsets, self.onsets[stop:]]),
+            np.concatenate([self.durations[:start], replacement.durations, self.durations[stop:]]),
+            np.concatenate([self.pitches[:start], replacement.pitches, self.pitches[stop:]]),
+            self.meter,
+        )
+        if self._grid is not None:
+            inserted = self.meter.grid(melody.onsets[start:start + len(replacement)])
+            melody._grid = MetricGrid(*(
+                np.concatenate([old[:start], new, old[stop:]]) for old, new in zip(self._grid, inserted)
+            ))
+        return melody
+
+    @classmethod
+    def from_notes(cls, notes, min_rest=MIN_REST_LENGTH, meter=None):
+        """
+        Build a melody from (onset, duration, midi_pitch) tuples.
+        Simultaneous onsets keep the highest pitch, overlapping notes are
+        cut at the next onset and gaps of at least `min_rest` become rests.
+        """
+        # Sort by onset, highest pitch first so it survives the de-duplication
+        notes = sorted(notes, key=lambda n: (n[0], -n[2]))
+        distinct = [n for i, n in enumerate(notes) if i == 0 or n[0] != notes[i - 1][0]]
+
+        onsets = []
+        durations = []
+        pitches = []
+        cursor = 0.0
+
+        for i, (onset, duration, midi) in enumerate(distinct):
+            if onset - cursor >= min_rest:
+                onsets.append(cursor)
+                durations.append(onset - cursor)
+                pitches.append(REST)
+
+            # Cut legato overlaps at the next onset
+            end = onset + duration
+            if i + 1 < len(distinct):
+                end = min(end, distinct[i + 1][0])
+
+            onsets.append(onset)
+            durations.append(end - onset)
+            pitches.append(midi)
+            cursor = end
+
+        return cls(onsets, durations, pitches, meter)
+
+    @classmethod
+    def from_midi(cls, source, track=None, channels=None, programs=None):
+        """
+        Read a melody directly from a MIDI file with mido.
+
+        `source` is a path or a binary file object. By default the first
+        track that contains (non-drum) notes is used, matching
+        `midi_stream.parts[0]` on the music21 path; pass `track` to pick a
+        track index, and/or `channels` or `programs` (General MIDI) to take
+        the notes of those channels/instruments from every track. Chords and
+        overlapping voices are reduced to their top line (see NoteEvents).
+        The melody keeps the file's time signatures and tempo map.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            midi_file = mido.MidiFile(source)
+        else:
+            midi_file = mido.MidiFile(file=source)
+
+        if track is not None and not 0 <= track < len(midi_file.tracks):
+            raise ValueError(f"Track {track} does not exist (the file has {len(midi_file.tracks)} tracks)")
+
+        events = NoteEvents.from_midi_file(midi_file)
+        return cls.from_notes(events.melody_notes(track, channels, programs), meter=events.meter)
+
+    @classmethod
+    def from_stream(cls, midi_stream):
+        """
+        Convert a parsed music21 stream (the original ingest path).
+        Notes and rests of the first part are kept; chords contribute
+        their top note.
+        """
+        from music21 import chord, note
+
+        parts = midi_stream.parts
+        original_melody = parts[0] if len(parts) > 0 else midi_stream
+
+        onsets = []
+        durations = []
+        pitches = []
+
+        for element in original_melody.flatten().notesAndRests:
+            if isinstance(element, note.Note):
+                pitches.append(element.pitch.midi)
+            elif isinstance(element, chord.Chord):
+                pitches.append(max(p.midi for p in element.pitches))
+            elif isinstance(element, note.Rest):
+                pitches.append(REST)
+            else:
+                continue
+            onsets.append(float(element.offset))
+            durations.append(float(element.duration.quarterLength))
+
+        return cls(onsets, durations, pitches, MeterIndex.from_stream(midi_stream))
+
+
+class Voice:
+    """
+    Append-only generated voice (harmony, bass, ...) stored as typed arrays.
+    Pitches are MIDI note numbers; onsets and durations are quarter lengths.
+    """
+
+    __slots__ = ('name', '_onsets', '_durations', '_pitches')
+
+    def __init__(self, name):
+        self.name = name
+        self._onsets = array('d')
+        self._durations = array('d')
+        self._pitches = array('h')
+
+    def __len__(self):
+        return len(self._pitches)
+
+    def append(self, onset, duration, midi):
+        self._onsets.append(onset)
+        self._durations.append(duration)
+        self._pitches.append(midi)
+
+    def extend(self, onsets, durations, pitches):
+        """Append many events at once from array-likes."""
+        self._onsets.frombytes(np.asarray(onsets, dtype=np.float64).tobytes())
+        self._durations.frombytes(np.asarray(durations, dtype=np.float64).tobytes())
+        self._pitches.frombytes(np.asarray(pitches, dtype=np.int16).tobytes())
+
+    def splice(self, start, stop, other):
+        """Replace events [start, stop) with the events of Voice `other`, in place."""
+        self._onsets[start:stop] = other._onsets
+        self._durations[start:stop] = other._durations
+        self._pitches[start:stop] = other._pitches
+
+    @property
+    def onsets(self):
+        return np.array(self._onsets, dtype=np.float64)
+
+    @property
+    def durations(self):
+        return np.array(self._durations, dtype=np.float64)
+
+    @property
+    def pitches(self):
+        return np.array(self._pitches, dtype=np.int16)
+
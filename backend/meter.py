@@ -0,0 +1,226 @@
+"""
+Meter and Tempo Index
+=====================
+Time signatures and tempo changes of a piece, built once from the MIDI
+meta events (or a music21 stream), with bar/beat lookups by bisection.
+
+Each time signature starts a segment with its bar and beat length in
+quarter lengths; compound meters (6/8, 9/8, 12/8) beat in dotted notes.
+A pickup shifts the bar lines of the first segment so the first full bar
+starts after it (the pickup is bar -1). Tempo changes are kept as
+(offset, microseconds per quarter) with the elapsed seconds at each one.
+
+grid() maps a whole array of onsets to their metric position in one
+vectorized pass (one searchsorted per map):
+
+- bar number and beat index within the bar;
+- beat strength: 1 on the downbeat, 0.5 on the mid-bar strong beat of
+  4-beat meters, 0.25 on other beats, 0.125 on beat subdivisions and
+  0.0625 elsewhere;
+- harmonic slot: the span a chord lasts. Bars of four (or six, ...)
+  beats hold two chords, others one; a half bar shorter than
+  MIN_HARMONIC_SECONDS at the local tempo also gets a single chord.
+  Slot ids grow with time, so a note starts a new chord when its slot
+  differs from the last change's.
+
+The default index (4/4 at 120 BPM, no pickup) puts a chord every 2 beats
+and phrase checkpoints every 8, the fixed grid the harmonizer used before.
+"""
+
+import math
+from bisect import bisect_right
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_TIME_SIGNATURE = (4, 4)
+DEFAULT_TEMPO = 500000   # microseconds per quarter note (120 BPM), the MIDI default
+
+# A half-bar chord span shorter than this (seconds) is merged into the whole bar
+MIN_HARMONIC_SECONDS = 0.75
+
+# Beat strengths by metric level
+DOWNBEAT = 1.0
+STRONG_BEAT = 0.5
+BEAT = 0.25
+SUBDIVISION = 0.125
+OFFBEAT = 0.0625
+
+# Tolerance (quarter lengths) for an onset to count as on a grid line
+GRID_TOLERANCE = 1e-6
+
+# Per-onset metric position; see MeterIndex.grid
+MetricGrid = namedtuple('MetricGrid', ['bars', 'beats', 'strengths', 'slots', 'slot_ends'])
+
+
+class MeterIndex:
+    """
+    Time signature and tempo map. `time_signatures` holds (offset,
+    numerator, denominator) and `tempos` (offset, microseconds per quarter),
+    offsets in quarter lengths; both default to the MIDI defaults.
+    `pickup` is the length of an incomplete first bar.
+    """
+
+    __slots__ = (
+        'starts', 'origins', 'first_bars', 'numerators', 'denominators', 'bar_lengths', 'beat_lengths',
+        'split', 'tempo_starts', 'tempos', 'tempo_seconds', 'pickup', '_starts_list', '_tempo_list',
+    )
+
+    def __init__(self, time_signatures=(), tempos=(), pickup=0.0):
+        signatures = _changes(time_signatures, (0.0, *DEFAULT_TIME_SIGNATURE))
+        self.starts = np.array([s[0] for s in signatures], dtype=np.float64)
+        self.numerators = np.array([s[1] for s in signatures], dtype=np.int64)
+        self.denominators = np.array([s[2] for s in signatures], dtype=np.int64)
+        self.bar_lengths = self.numerators * 4.0 / self.denominators
+        compound = (self.numerators % 3 == 0) & (self.numerators > 3)
+        self.beat_lengths = np.where(compound, 12.0, 4.0) / self.denominators
+        beats_per_bar = np.rint(self.bar_lengths / self.beat_lengths).astype(np.int64)
+        self.split = (beats_per_bar >= 4) & (beats_per_bar % 2 == 0)
+
+        # Bar lines: segment i counts bars first_bars[i], first_bars[i] + 1, ... from origins[i]
+        self.pickup = float(pickup) % self.bar_lengths[0] if pickup else 0.0
+        self.origins = self.starts.copy()
+        self.first_bars = np.zeros(len(signatures), dtype=np.int64)
+        if self.pickup:
+            self.origins[0] = self.pickup - self.bar_lengths[0]
+            self.first_bars[0] = -1
+        for i in range(1, len(signatures)):
+            elapsed = (self.starts[i] - self.origins[i - 1]) / self.bar_lengths[i - 1]
+            self.first_bars[i] = self.first_bars[i - 1] + math.ceil(elapsed - GRID_TOLERANCE)
+
+        changes = _changes(tempos, (0.0, DEFAULT_TEMPO))
+        self.tempo_starts = np.array([t[0] for t in changes], dtype=np.float64)
+        self.tempos = np.array([t[1] for t in changes], dtype=np.float64)
+        self.tempo_seconds = np.concatenate([
+            [0.0], np.cumsum(np.diff(self.tempo_starts) * self.tempos[:-1] / 1e6)
+        ])
+
+        # Python lists for the scalar (bisect) lookups
+        self._starts_list = self.starts.tolist()
+        self._tempo_list = self.tempo_starts.tolist()
+
+    @classmethod
+    def from_midi_events(cls, ticks_per_beat, time_signatures, tempos, pickup=0.0):
+        """Build from (tick, numerator, denominator) and (tick, tempo) meta events."""
+        return cls(
+            [(tick / ticks_per_beat, numerator, denominator) for tick, numerator, denominator in time_signatures],
+            [(tick / ticks_per_beat, tempo) for tick, tempo in tempos],
+            pickup,
+        )
+
+    @classmethod
+    def from_stream(cls, midi_stream, pickup=0.0):
+        """Build from the TimeSignature and MetronomeMark objects of a music21 stream."""
+        flat = midi_stream.flatten()
+        signatures = [
+            (float(ts.offset), ts.numerator, ts.denominator) for ts in flat.getElementsByClass('TimeSignature')
+        ]
+        tempos = [
+            (float(mark.offset), 60e6 / mark.getQuarterBPM())
+            for mark in flat.getElementsByClass('MetronomeMark') if mark.getQuarterBPM()
+        ]
+        return cls(signatures, tempos, pickup)
+
+    def with_pickup(self, pickup):
+        """The same meter with a pickup of `pickup` quarter lengths."""
+        return MeterIndex(
+            zip(self._starts_list, self.numerators.tolist(), self.denominators.tolist()),
+            zip(self._tempo_list, self.tempos.tolist()),
+            pickup,
+        )
+
+    # === SCALAR LOOKUPS ===
+
+    def locate(self, offset):
+        """(bar, beat, position in bar) of an offset, by bisection."""
+        i = max(bisect_right(self._starts_list, offset) - 1, 0)
+        bar_length = float(self.bar_lengths[i])
+        bars, position = divmod(offset - float(self.origins[i]), bar_length)
+        beat = int((position + GRID_TOLERANCE) // float(self.beat_lengths[i]))
+        return int(self.first_bars[i]) + int(bars), beat, position
+
+    def tempo_at(self, offset):
+        """Microseconds per quarter note in effect at `offset`."""
+        return float(self.tempos[max(bisect_right(self._tempo_list, offset) - 1, 0)])
+
+    def slot(self, offset):
+        """Harmonic slot id of an offset (see grid)."""
+        i = max(bisect_right(self._starts_list, offset) - 1, 0)
+        bar, _, position = self.locate(offset)
+        half = float(self.bar_lengths[i]) / 2
+        split = bool(self.split[i]) and half * self.tempo_at(offset) / 1e6 >= MIN_HARMONIC_SECONDS
+        return 2 * bar + int(split and position >= half - GRID_TOLERANCE)
+
+    # === VECTORIZED LOOKUPS ===
+
+    def seconds(self, offsets):
+        """Elapsed seconds at each offset, following the tempo map."""
+        offsets = np.asarray(offsets, dtype=np.float64)
+        i = np.maximum(np.searchsorted(self.tempo_starts, offsets, side='right') - 1, 0)
+        return self.tempo_seconds[i] + (offsets - self.tempo_starts[i]) * self.tempos[i] / 1e6
+
+    def grid(self, onsets):
+        """MetricGrid of every onset: bar, beat, beat strength, harmonic slot and slot end."""
+        onsets = np.asarray(onsets, dtype=np.float64)
+        i = np.maximum(np.searchsorted(self.starts, onsets, side='right') - 1, 0)
+        bar_lengths = self.bar_lengths[i]
+        beat_lengths = self.beat_lengths[i]
+
+        bars, positions = np.divmod(onsets - self.origins[i], bar_lengths)
+        bars = bars.astype(np.int64) + self.first_bars[i]
+        beats = np.floor((positions + GRID_TOLERANCE) / beat_lengths).astype(np.int64)
+
+        half = bar_lengths / 2
+        tempos = self.tempos[np.maximum(np.searchsorted(self.tempo_starts, onsets, side='right') - 1, 0)]
+        split = self.split[i] & (half * tempos / 1e6 >= MIN_HARMONIC_SECONDS)
+        second_half = split & (positions >= half - GRID_TOLERANCE)
+
+        compound = beat_lengths * self.denominators[i] == 12.0
+        subdivisions = np.where(compound, beat_lengths / 3, beat_lengths / 2)
+        strengths = np.select(
+            [
+                _on_grid(positions, bar_lengths),
+                split & _on_grid(positions - half, bar_lengths),
+                _on_grid(positions, beat_lengths),
+                _on_grid(positions, subdivisions),
+            ],
+            [DOWNBEAT, STRONG_BEAT, BEAT, SUBDIVISION],
+            OFFBEAT,
+        )
+
+        bar_starts = onsets - positions
+        slot_ends = bar_starts + np.where(split & ~second_half, half, bar_lengths)
+        return MetricGrid(bars, beats, strengths, 2 * bars + second_half, slot_ends)
+
+    # === EXPORT ===
+
+    def meta_messages(self, ticks_per_beat):
+        """(tick, type, attributes) of every time signature and tempo change, in tick order."""
+        events = [
+            (round(start * ticks_per_beat), 'time_signature', {'numerator': num, 'denominator': den})
+            for start, num, den in zip(self._starts_list, self.numerators.tolist(), self.denominators.tolist())
+        ]
+        events += [
+            (round(start * ticks_per_beat), 'set_tempo', {'tempo': int(tempo)})
+            for start, tempo in zip(self._tempo_list, self.tempos.tolist())
+        ]
+        return sorted(events, key=lambda event: event[0])
+
+
+def _changes(events, default):
+    """Sorted (offset, ...) changes, the last one winning at equal offsets, starting at 0."""
+    changes = {}
+    for event in sorted(events, key=lambda e: e[0]):
+        changes[max(float(event[0]), 0.0)] = tuple(event[1:])
+    if 0.0 not in changes:
+        changes[0.0] = tuple(default[1:])
+    return [(offset, *values) for offset, values in sorted(changes.items())]
+
+
+def _on_grid(positions, unit):
+    """Whether each position is a whole multiple of `unit`."""
+    steps = positions / unit
+    return np.abs(steps - np.rint(steps)) * unit < GRID_TOLERANCE
+
+
+DEFAULT_METER = MeterIndex()
@@ -0,0 +1,280 @@
+"""
+Direct MIDI Export
+==================
+Writes the harmonized voices straight to a Standard MIDI File with mido,
+without building a music21 Score.
+
+Layout matches the music21 export: a conductor track (tempo, key and time
+signature) followed by one track per voice with its instrument program.
+The conductor track carries the melody's time signatures and tempo map.
+Note events are built from the compact arrays in one vectorized pass per
+voice; every note lasts at least one tick, so none can end before it
+starts. Output goes to a path or any binary file object, e.g. io.BytesIO
+for in-memory streaming.
+
+For output too long to hold in memory (see chunked.py), TrackSpool
+encodes each voice track to a temporary file as notes arrive and
+write_spooled_midi() assembles the finished tracks; the bytes are the
+same as write_midi's for the same voices.
+"""
+
+import io
+import shutil
+import struct
+import tempfile
+
+import mido
+import numpy as np
+
+from melody import REST
+
+TICKS_PER_BEAT = 480
+DEFAULT_VELOCITY = 90
+
+# General MIDI programs (0-indexed) for each voice
+VOICE_PROGRAMS = {
+    'Melody': 0,     # Acoustic Grand Piano
+    'Harmony': 0,    # Acoustic Grand Piano
+    'Alto': 0,       # Acoustic Grand Piano (four-part output)
+    'Tenor': 0,      # Acoustic Grand Piano
+    'Bass': 32,      # Acoustic Bass
+}
+
+
+def key_signature_name(detected_key):
+    """mido key_signature name for a KeyContext, e.g. 'Eb' or 'F#m'."""
+    name = detected_key.tonic_name.replace('-', 'b')
+    return name + 'm' if detected_key.mode == 'minor' else name
+
+
+def note_ticks(voice, ticks_per_beat=TICKS_PER_BEAT):
+    """
+    (pitches, start ticks, end ticks) of the notes of a Melody or Voice
+    (rests are skipped). Every note lasts at least one tick: a note whose
+    end rounds to its start would put its note-off before its note-on
+    (note-offs go first at equal ticks) and hang on playback.
+    """
+    notes = voice.pitches != REST
+    pitches = voice.pitches[notes].astype(np.int64)
+    starts = np.rint(voice.onsets[notes] * ticks_per_beat).astype(np.int64)
+    ends = np.maximum(np.rint((voice.onsets[notes] + voice.durations[notes]) * ticks_per_beat).astype(np.int64),
+                      starts + 1)
+    return pitches, starts, ends
+
+
+def voice_track(name, voice, channel, program, velocity=DEFAULT_VELOCITY, ticks_per_beat=TICKS_PER_BEAT):
+    """Build a MidiTrack for a Melody or Voice (rests are skipped)."""
+    track = mido.MidiTrack()
+    track.append(mido.MetaMessage('track_name', name=name, time=0))
+    track.append(mido.Message('program_change', channel=channel, program=program, time=0))
+
+    pitches, starts, ends = note_ticks(voice, ticks_per_beat)
+
+    # Interleave offs and ons; at equal ticks note-offs go first
+    ticks = np.concatenate([ends, starts])
+    is_on = np.concatenate([np.zeros(len(ends), dtype=bool), np.ones(len(starts), dtype=bool)])
+    event_pitches = np.concatenate([pitches, pitches])
+    order = np.lexsort((is_on, ticks))
+    deltas = np.diff(ticks[order], prepend=0)
+
+    for delta, on, midi in zip(deltas.tolist(), is_on[order].tolist(), event_pitches[order].tolist()):
+        message_type = 'note_on' if on else 'note_off'
+        track.append(mido.Message(message_type, channel=channel, note=midi,
+                                  velocity=velocity if on else 0, time=delta))
+
+    track.append(mido.MetaMessage('end_of_track', time=0))
+    return track
+
+
+def conductor_track(melody, detected_key, tempo=None, ticks_per_beat=TICKS_PER_BEAT):
+    """
+    Tempo, key and time signature events: the melody's tempo map (or one
+    `tempo` throughout) and time signatures.
+    """
+    meter_events = melody.meter.meta_messages(ticks_per_beat)
+    if tempo is not None:
+        meter_events = [e for e in meter_events if e[1] != 'set_tempo'] + [(0, 'set_tempo', {'tempo': tempo})]
+    # Same order at tick 0 as before: tempo, key, time signature
+    events = [(0, 'key_signature', {'key': key_signature_name(detected_key)})] + meter_events
+    rank = {'set_tempo': 0, 'key_signature': 1, 'time_signature': 2}
+    events.sort(key=lambda event: (event[0], rank[event[1]]))
+
+    track = mido.MidiTrack()
+    tick = 0
+    for event_tick, message_type, attributes in events:
+        track.append(mido.MetaMessage(message_type, time=event_tick - tick, **attributes))
+        tick = event_tick
+    track.append(mido.MetaMessage('end_of_track', time=0))
+    return track
+
+
+def build_midi_file(melody, harmony, bass, detected_key, tempo=None, ticks_per_beat=TICKS_PER_BEAT):
+    """
+    Assemble the conductor track and the Melody/Harmony/Bass tracks.
+    `harmony` may also be a tuple of inner Voices (alto, tenor), one track each.
+    `tempo` (microseconds per quarter) overrides the melody's tempo map.
+    """
+    midi_file = mido.MidiFile(type=1, ticks_per_beat=ticks_per_beat)
+
+    conductor = conductor_track(melody, detected_key, tempo, ticks_per_beat)
+    midi_file.tracks.append(conductor)
+
+    inner_voices = harmony if isinstance(harmony, tuple) else (harmony,)
+    parts = [('Melody', melody), *((voice.name, voice) for voice in inner_voices), ('Bass', bass)]
+    for channel, (name, voice) in enumerate(parts):
+        midi_file.tracks.append(
+            voice_track(name, voice, channel, VOICE_PROGRAMS[name], ticks_per_beat=ticks_per_beat)
+        )
+
+    return midi_file
+
+
+def variable_int(value):
+    """MIDI variable-length quantity encoding of a non-negative integer."""
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def encode_messages(messages, running_status=None):
+    """
+    MTrk data bytes of mido meta and channel messages (delta times in
+    `msg.time`), laid out as mido saves them: channel messages repeating
+    the previous status byte omit it, meta messages reset it.
+    Returns (data, running_status).
+    """
+    data = bytearray()
+    for msg in messages:
+        data += variable_int(msg.time)
+        msg_bytes = msg.bytes()
+        if msg.is_meta:
+            data += bytes(msg_bytes)
+            running_status = None
+            continue
+        if msg_bytes[0] == running_status:
+            data += bytes(msg_bytes[1:])
+        else:
+            data += bytes(msg_bytes)
+        running_status = msg_bytes[0] if msg_bytes[0] < 0xF0 else None
+    return data, running_status
+
+
+class TrackSpool:
+    """
+    A voice track written as it is generated. Notes from add() wait until
+    flush(tick) is told no later note starts before `tick`; they are then
+    encoded (same event order and bytes as voice_track) into a temporary
+    file, so memory holds only the notes still open at the flush point.
+    """
+
+    def __init__(self, name, channel, program, velocity=DEFAULT_VELOCITY, ticks_per_beat=TICKS_PER_BEAT):
+        self.channel = channel
+        self.velocity = velocity
+        self.ticks_per_beat = ticks_per_beat
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.tick = 0
+        self.notes = 0
+        self.pending = []
+        data, self.running_status = encode_messages([
+            mido.MetaMessage('track_name', name=name, time=0),
+            mido.Message('program_change', channel=channel, program=program, time=0),
+        ])
+        self._write(data)
+
+    def _write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def add(self, voice):
+        """Queue the notes of a Melody or Voice (rests are skipped)."""
+        pitches, starts, ends = note_ticks(voice, self.ticks_per_beat)
+        index = self.notes + np.arange(len(pitches))
+        self.notes += len(pitches)
+        self.pending.append((
+            np.concatenate([ends, starts]),
+            np.concatenate([np.zeros(len(ends), dtype=bool), np.ones(len(starts), dtype=bool)]),
+            np.concatenate([index, index]),
+            np.concatenate([pitches, pitches]),
+        ))
+
+    def flush(self, before_tick=None):
+        """Encode the queued events before `before_tick` (all of them if None)."""
+        if not self.pending:
+            return
+        ticks, is_on, index, pitches = (np.concatenate(parts) for parts in zip(*self.pending))
+
+        # voice_track's order: by tick, note-offs first, then by note
+        order = np.lexsort((index, is_on, ticks))
+        ready = len(order) if before_tick is None else int(np.searchsorted(ticks[order], before_tick))
+        kept = order[ready:]
+        self.pending = [(ticks[kept], is_on[kept], index[kept], pitches[kept])] if len(kept) else []
+
+        data = bytearray()
+        running_status = self.running_status
+        note_on, note_off = 0x90 | self.channel, 0x80 | self.channel
+        tick = self.tick
+        for event_tick, on, midi in zip(ticks[order[:ready]].tolist(), is_on[order[:ready]].tolist(),
+                                        pitches[order[:ready]].tolist()):
+            data += variable_int(event_tick - tick)
+            status = note_on if on else note_off
+            if status != running_status:
+                data.append(status)
+                running_status = status
+            data += bytes((midi, self.velocity if on else 0))
+            tick = event_tick
+        self.tick = tick
+        self.running_status = running_status
+        self._write(data)
+
+    def close(self):
+        """Encode everything still queued and end the track."""
+        self.flush()
+        data, self.running_status = encode_messages([mido.MetaMessage('end_of_track', time=0)])
+        self._write(data)
+
+    def copy_to(self, output):
+        """Write the track as an MTrk chunk to a binary file object and release the spool."""
+        output.write(b'MTrk' + struct.pack('>L', self.size))
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, output)
+        self.file.close()
+
+
+def write_spooled_midi(output, conductor, spools, ticks_per_beat=TICKS_PER_BEAT):
+    """
+    Write a type 1 file from a conductor MidiTrack and closed TrackSpools
+    to `output`, a path or a binary file object.
+    """
+    if not hasattr(output, 'write'):
+        with open(output, 'wb') as f:
+            write_spooled_midi(f, conductor, spools, ticks_per_beat)
+        return output
+
+    header = struct.pack('>hhh', 1, 1 + len(spools), ticks_per_beat)
+    output.write(b'MThd' + struct.pack('>L', len(header)) + header)
+    data, _ = encode_messages(conductor)
+    output.write(b'MTrk' + struct.pack('>L', len(data)) + bytes(data))
+    for spool in spools:
+        spool.copy_to(output)
+    return output
+
+
+def write_midi(melody, harmony, bass, detected_key, output):
+    """Write the voices to `output`, a path or a binary file object."""
+    midi_file = build_midi_file(melody, harmony, bass, detected_key)
+    if hasattr(output, 'write'):
+        midi_file.save(file=output)
+    else:
+        midi_file.save(output)
+    return output
+
+
+def midi_bytes(melody, harmony, bass, detected_key):
+    """Render the voices to an in-memory MIDI file and return its bytes."""
+    buffer = io.BytesIO()
+    write_midi(melody, harmony, bass, detected_key, buffer)
+    return buffer.getvalue()
@@ -0,0 +1,140 @@
+"""
+Harmonization Result Cache
+==========================
+Content-addressed, size-bounded LRU cache of harmonized MIDI files.
+
+Keys are SHA-256 hashes of the input bytes plus the harmonizer options
+(mode, seed, ...) and the chord sources in use (see
+MIDIHarmonizer.chord_sources), so re-uploading the same file with the
+same settings is a hit no matter what it is called, and swapping a model
+file is not. Entries live on disk as `<key>.mid`.
+
+The folder is the index: the LRU order is the files' modification times,
+and every eviction scans the folder under a file lock. Processes sharing
+the folder (pre-forked server workers) thus keep to one byte budget, and
+the cache survives a restart. Hit/miss counters are exposed through
+stats() and count this process's lookups only.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no pre-forking server, the thread lock is enough
+    fcntl = None
+
+# Bump when harmonizer output changes so stale results are not served
+CACHE_VERSION = 7
+
+_ENTRY_NAME = re.compile(r'^[0-9a-f]{64}\.mid$')
+_LOCK_NAME = '.cache.lock'
+
+
+class ResultCache:
+    """LRU cache of result files in `folder`, limited to `max_bytes` in total."""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        with self._locked():
+            self._evict()
+
+    @staticmethod
+    def make_key(input_bytes, options):
+        """Hash of the input bytes and the (JSON-serializable) options."""
+        digest = hashlib.sha256()
+        digest.update(input_bytes)
+        digest.update(json.dumps({'version': CACHE_VERSION, **options}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def owns(name):
+        """True if a file name in the cache folder belongs to the cache (an entry or its lock file)."""
+        return bool(_ENTRY_NAME.match(name)) or name == _LOCK_NAME
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f'{key}.mid')
+
+    def get(self, key):
+        """Path of the cached result for `key`, or None on a miss."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # mark as most recently used, for every process
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, result_path):
+        """Move a finished result file into the cache and evict to stay in budget."""
+        path = self.path_for(key)
+        with self._locked():
+            os.replace(result_path, path)
+            os.utime(path)  # stored now, not when the result was written
+            self._evict(keep=key)
+        return path
+
+    def stats(self):
+        entries = self._scan()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, _, size in entries),
+                'max_bytes': self.max_bytes,
+            }
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the folder, across threads and processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.folder, _LOCK_NAME), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield   # released when the file is closed
+
+    def _scan(self):
+        """(modification time, key, size) of every entry on disk, oldest first."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if _ENTRY_NAME.match(entry.name):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue   # evicted concurrently
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        entries.sort()
+        return entries
+
+    def _evict(self, keep=None):
+        """Remove the least recently used entries on disk until they fit the budget (lock held)."""
+        entries = self._scan()
+        if keep is not None:
+            # The entry just stored counts as the newest, whatever the clock resolution
+            entries.sort(key=lambda entry: entry[1] == keep)
+        total = sum(size for _, _, size in entries)
+        # Keep the newest entry even if it alone exceeds the budget
+        for _, key, size in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,83 @@
+"""
+Upload/Output Retention
+=======================
+Keeps uploads/ and outputs/ from growing without bound.
+
+sweep() removes files older than a maximum age from one folder, sparing
+paths still in use (inputs of unfinished jobs) and files owned by someone
+else (result cache entries, which the cache evicts itself).
+RetentionSweeper runs the sweeps periodically on a daemon thread.
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def sweep(folder, max_age, keep=(), skip=None, now=None):
+    """
+    Delete regular files in `folder` not modified for `max_age` seconds.
+
+    `keep` is a collection of paths that must survive; `skip(name)` returns
+    True for file names that this sweep does not manage. Returns the list
+    of removed paths.
+    """
+    now = time.time() if now is None else now
+    keep = {os.path.abspath(path) for path in keep}
+    removed = []
+
+    for entry in os.scandir(folder):
+        if not entry.is_file() or (skip and skip(entry.name)):
+            continue
+        if os.path.abspath(entry.path) in keep:
+            continue
+        try:
+            if now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                removed.append(entry.path)
+        except FileNotFoundError:
+            pass   # removed concurrently
+    return removed
+
+
+class RetentionSweeper:
+    """
+    Periodically sweeps a set of folders.
+    `folders` maps folder -> max age in seconds; `keep()` returns the paths
+    to spare on each pass and `skip(name)` excludes files from every folder.
+    """
+
+    def __init__(self, folders, interval=3600, keep=None, skip=None):
+        self.folders = folders
+        self.interval = interval
+        self.keep = keep
+        self.skip = skip
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        keep = self.keep() if self.keep else ()
+        removed = []
+        for folder, max_age in self.folders.items():
+            removed.extend(sweep(folder, max_age, keep=keep, skip=self.skip))
+        return removed
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='retention-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except OSError as e:
+                logger.warning("Retention sweep failed: %s", e)
+            if self._stop.wait(self.interval):
+                return
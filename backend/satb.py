@@ -0,0 +1,304 @@
+"""
+Four-Part (SATB) Voicing Search
+===============================
+Chorale-style harmonization: the melody is the soprano and every chord
+change gets a full alto/tenor/bass voicing, held until the next change.
+
+Voicings come from precomputed tables, one per chord (keyed by its pitch
+classes, so keys share them). A table lists every alto, tenor and bass
+combination of chord tones that already satisfies the rules that do not
+depend on the melody:
+
+- ranges:   alto G3-D5, tenor C3-G4, bass C2-C4 (root or third in the bass)
+- crossing: bass < tenor <= alto
+- spacing:  alto-tenor within an octave, tenor-bass within a twelfth
+
+At each chord change the search scores every table row against the
+soprano notes of the span (alto not above the lowest of them, soprano
+within an octave of the alto, root and third present, melody fit) and
+every transition from the surviving voicings of the previous change.
+These melody terms are soft costs, not rules. A high soprano over a
+chord with no tone near the top of the alto range cannot be spaced
+within an octave (C6 over V = E-G-B in A minor: the alto reaches B4 at
+most), and a larger SPACING_COST only trades such spans for parallels.
+The transition terms are:
+
+- chord transitions:  -log P from the Markov tables, as ViterbiVoiceSearch
+- voice motion:       VOICE_LEADING_COSTS for alto, tenor and bass
+- parallels:          fifths/octaves between all six voice pairs, as
+                      defined by VoiceLeadingChecker
+
+Everything that does not involve the soprano (chord transition, motion
+and parallels among alto, tenor and bass) is precomputed per key as one
+voicing-to-voicing cost matrix; only the three soprano pairs are checked
+per step. Only the BEAM_WIDTH cheapest voicings survive each change, so every step
+costs O(BEAM_WIDTH x table rows) and the search is linear in melody
+length. Chord changes use the same harmonic slots (MeterIndex.grid) and
+phrase-end cadences as the other paths.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from melody import Voice
+from scoring import VOICE_LEADING_COSTS
+from voice_search import MELODY_MISFIT_COST, PARALLEL_PENALTY, chord_change_grid, parallel_motion
+
+# Voice ranges as inclusive MIDI pitch bounds
+ALTO_RANGE = (55, 74)     # G3-D5
+TENOR_RANGE = (48, 67)    # C3-G4
+BASS_RANGE = (36, 60)     # C2-C4, the register of generate_bass_note
+
+MAX_UPPER_SPACING = 12    # soprano-alto and alto-tenor
+MAX_BASS_SPACING = 19     # tenor-bass
+
+# Soft costs for what the tables cannot rule out in advance
+INVERSION_COST = 1.5      # third in the bass
+CROSSING_COST = 20.0      # alto above the soprano (only when the melody dips below the alto range)
+SPACING_COST = 4.0        # soprano more than an octave above the alto (soft, see above)
+INCOMPLETE_COST = 6.0     # root or third missing from all four voices
+
+# Voicings kept after each chord change
+BEAM_WIDTH = 32
+
+# Chord changes between progress callbacks
+PROGRESS_INTERVAL = 128
+
+# Voicing tables by chord pitch classes
+_VOICING_TABLES = {}
+
+# Voicing tables of all chords of a key, concatenated row-wise, plus the
+# cost of moving from any row to any other (see SATBVoiceSearch.key_tables)
+KeyVoicings = namedtuple('KeyVoicings', ['pitches', 'bits', 'costs', 'chords', 'required', 'change_costs'])
+
+
+def voicing_table(chord_pitches):
+    """
+    All alto/tenor/bass voicings of a triad (pitch classes, root first)
+    within range, without crossing and with legal spacing.
+    Returns (pitches, pitch_class_bits, costs): a (V, 3) array of
+    [alto, tenor, bass], a bitmask of the pitch classes each voicing
+    sounds and its inversion cost.
+    """
+    chord_pitches = tuple(chord_pitches)
+    if chord_pitches not in _VOICING_TABLES:
+        root, third = chord_pitches[:2]
+
+        def chord_tones(pitch_range, pitch_classes):
+            pitches = np.arange(pitch_range[0], pitch_range[1] + 1)
+            return pitches[np.isin(pitches % 12, pitch_classes)]
+
+        alto, tenor, bass = (
+            grid.ravel() for grid in np.meshgrid(
+                chord_tones(ALTO_RANGE, chord_pitches),
+                chord_tones(TENOR_RANGE, chord_pitches),
+                chord_tones(BASS_RANGE, (root, third)),
+                indexing='ij',
+            )
+        )
+        legal = (
+            (bass < tenor) & (tenor <= alto)
+            & (alto - tenor <= MAX_UPPER_SPACING) & (tenor - bass <= MAX_BASS_SPACING)
+        )
+        pitches = np.stack([alto[legal], tenor[legal], bass[legal]], axis=1).astype(np.int64)
+        bits = np.bitwise_or.reduce(np.left_shift(1, pitches % 12), axis=1)
+        costs = np.where(pitches[:, 2] % 12 == root, 0.0, INVERSION_COST)
+        _VOICING_TABLES[chord_pitches] = (pitches, bits, costs)
+    return _VOICING_TABLES[chord_pitches]
+
+
+class SATBVoiceSearch:
+    """
+    Deterministic four-part harmonization by beam search over voicing
+    tables. Reuses the chord numerals and transition costs of the
+    harmonizer's ViterbiVoiceSearch.
+    """
+
+    def __init__(self, harmonizer):
+        self.harmonizer = harmonizer
+        self._key_tables = {}
+
+    def key_tables(self, detected_key):
+        """KeyVoicings for a KeyContext, built on first use."""
+        cache_key = (detected_key.tonic, detected_key.mode)
+        if cache_key not in self._key_tables:
+            viterbi = self.harmonizer.voice_search
+            numerals = viterbi.numerals[detected_key.mode]
+            tables = [voicing_table(detected_key.chord_pitches[n]) for n in numerals]
+            sizes = [len(table[0]) for table in tables]
+            pitches = np.concatenate([table[0] for table in tables])
+            chords = np.repeat(np.arange(len(numerals)), sizes)
+
+            # Root and third of each row's chord must sound somewhere
+            required = np.repeat([
+                (1 << detected_key.chord_pitches[n][0]) | (1 << detected_key.chord_pitches[n][1])
+                for n in numerals
+            ], sizes)
+
+            # Row-to-row cost of a chord change, axes [previous row, next row]
+            prev = pitches[:, None, :]
+            curr = pitches[None, :, :]
+            upper, lower = np.triu_indices(3, k=1)
+            change_costs = (
+                viterbi.transition_costs[detected_key.mode][chords][:, chords]
+                + VOICE_LEADING_COSTS[np.abs(curr - prev)].sum(axis=2)
+                + PARALLEL_PENALTY * parallel_motion(
+                    prev[..., upper], prev[..., lower], curr[..., upper], curr[..., lower]
+                ).sum(axis=2)
+            )
+
+            self._key_tables[cache_key] = KeyVoicings(
+                pitches,
+                np.concatenate([table[1] for table in tables]),
+                np.concatenate([table[2] for table in tables]),
+                chords,
+                required,
+                change_costs,
+            )
+        return self._key_tables[cache_key]
+
+    def search(self, melody, detected_key, phrase_boundaries, progress=None):
+        """
+        Harmonize `melody` in four parts. `phrase_boundaries` is a boolean
+        mask over melody events (PhraseDetector.boundary_mask).
+        `progress(notes_done, notes_total)` is called during the search.
+        Returns (chords, alto, tenor, bass): one chord numeral per note plus Voices.
+        """
+        alto = Voice('Alto')
+        tenor = Voice('Tenor')
+        bass = Voice('Bass')
+
+        note_indices = np.flatnonzero(melody.note_mask)
+        if len(note_indices) == 0:
+            return [], alto, tenor, bass
+
+        viterbi = self.harmonizer.voice_search
+        mode = detected_key.mode
+        numerals = viterbi.numerals[mode]
+        transition_costs = viterbi.transition_costs[mode]
+        num_chords = len(numerals)
+        tonic = numerals.index(detected_key.tonic_numeral)
+        dominant = numerals.index('V')
+
+        pitches = melody.pitches[note_indices].astype(np.int64)
+        onsets = melody.onsets[note_indices]
+        ends = onsets + melody.durations[note_indices]
+        n = len(pitches)
+
+        is_change, allowed = chord_change_grid(
+            note_indices, melody.grid.slots[note_indices], phrase_boundaries, num_chords, tonic, dominant
+        )
+        changes = np.flatnonzero(is_change)
+        span_ends = np.append(changes[1:], n) - 1
+
+        # === PER-SPAN MELODY TERMS ===
+        # Lowest/highest soprano note of each span, its first and last note
+        lowest = np.minimum.reduceat(pitches, changes)
+        highest = np.maximum.reduceat(pitches, changes)
+        first_bits = np.left_shift(1, pitches[changes] % 12)
+        entering = pitches[changes]
+        leaving = pitches[span_ends]
+
+        # Melody fit: diatonic non-chord tones, summed per span
+        chord_sets = np.zeros((num_chords, 12), dtype=bool)
+        for c, numeral in enumerate(numerals):
+            chord_sets[c, list(detected_key.chord_pitches[numeral])] = True
+        scale_set = np.zeros(12, dtype=bool)
+        scale_set[list(detected_key.scale_pitches)] = True
+        pitch_classes = pitches % 12
+        misfit = ~chord_sets[:, pitch_classes].T & scale_set[pitch_classes][:, None]
+        misfit_costs = MELODY_MISFIT_COST * np.add.reduceat(misfit.astype(np.float64), changes)
+        span_allowed = allowed[changes]
+
+        voicings, bits, voicing_costs, row_chords, required, change_costs = self.key_tables(detected_key)
+
+        def span_costs(s):
+            """Melody-dependent cost of every table row for span s (inf = chord not allowed)."""
+            costs = voicing_costs + misfit_costs[s][row_chords]
+            costs = costs + CROSSING_COST * (voicings[:, 0] > lowest[s])
+            costs = costs + SPACING_COST * (highest[s] - voicings[:, 0] > MAX_UPPER_SPACING)
+            costs = costs + INCOMPLETE_COST * (((bits | first_bits[s]) & required) != required)
+            return np.where(span_allowed[s][row_chords], costs, np.inf)
+
+        def prune(scores):
+            """Rows of the BEAM_WIDTH lowest finite scores."""
+            rows = np.flatnonzero(np.isfinite(scores))
+            if len(rows) > BEAM_WIDTH:
+                rows = rows[np.argpartition(scores[rows], BEAM_WIDTH)[:BEAM_WIDTH]]
+            return rows
+
+        # === BEAM SEARCH ===
+        # The piece starts from the tonic; opening on it is free
+        initial_costs = transition_costs[tonic].copy()
+        initial_costs[tonic] = 0.0
+        scores = initial_costs[row_chords] + span_costs(0)
+        beam = prune(scores)
+        beams = [beam]
+        backpointers = [np.zeros(len(beam), dtype=np.int64)]
+        beam_scores = scores[beam]
+
+        for s in range(1, len(changes)):
+            if progress and s % PROGRESS_INTERVAL == 0:
+                progress(int(changes[s]), n)
+            costs = span_costs(s)
+            candidates = np.flatnonzero(np.isfinite(costs))
+
+            total = (
+                beam_scores[:, None]
+                + change_costs[beam[:, None], candidates]
+                + costs[candidates][None, :]
+            )
+            self._add_soprano_parallels(
+                total, leaving[s - 1], entering[s], voicings[beam], voicings[candidates]
+            )
+            best_prev = np.argmin(total, axis=0)
+            scores = total[best_prev, np.arange(len(candidates))]
+
+            kept = prune(scores)
+            beam = candidates[kept]
+            beams.append(beam)
+            backpointers.append(best_prev[kept])
+            beam_scores = scores[kept]
+
+        # === BACKTRACK ===
+        rows = np.empty(len(changes), dtype=np.int64)
+        position = int(np.argmin(beam_scores))
+        for s in range(len(changes) - 1, -1, -1):
+            rows[s] = beams[s][position]
+            position = backpointers[s][position]
+
+        # Voicings sound from each change to the end of the span's last melody note
+        span_onsets = onsets[changes]
+        span_durations = ends[span_ends] - span_onsets
+        for v, voice in enumerate((alto, tenor, bass)):
+            voice.extend(span_onsets, span_durations, voicings[rows, v])
+
+        span_chords = row_chords[rows]
+        chords = [numerals[c] for c in np.repeat(span_chords, np.diff(np.append(changes, n))).tolist()]
+
+        if progress:
+            progress(n, n)
+
+        return chords, alto, tenor, bass
+
+    @staticmethod
+    def _add_soprano_parallels(total, prev_soprano, curr_soprano, prev_voicings, curr_voicings):
+        """
+        Add PARALLEL_PENALTY to total[b, c] for every lower voice moving in
+        parallel fifths/octaves with the soprano from prev_voicings[b] to
+        curr_voicings[c]. Only voicing pairs forming the same perfect
+        interval with the soprano on both sides are compared.
+        """
+        soprano_step = curr_soprano - prev_soprano
+        if soprano_step == 0:
+            return
+        prev_intervals = np.abs(prev_soprano - prev_voicings) % 12
+        curr_intervals = np.abs(curr_soprano - curr_voicings) % 12
+        for v in range(prev_voicings.shape[1]):
+            for interval in (0, 7):
+                prev_rows = np.flatnonzero(prev_intervals[:, v] == interval)
+                curr_rows = np.flatnonzero(curr_intervals[:, v] == interval)
+                if len(prev_rows) and len(curr_rows):
+                    steps = curr_voicings[curr_rows, v][None, :] - prev_voicings[prev_rows, v][:, None]
+                    total[np.ix_(prev_rows, curr_rows)] += PARALLEL_PENALTY * (steps * soprano_step > 0)
@@ -0,0 +1,114 @@
+"""
+Vectorized Harmony Candidate Scoring
+====================================
+NumPy version of the candidate scoring in
+`MIDIHarmonizer.generate_harmony_note`.
+
+For a chord window (consecutive melody notes sharing one chord) every
+chord-tone x octave candidate of every note is laid out in one grid and
+scored in a single array operation. Candidates keep the scalar loop's
+order (chord tone, then octave -1/0/+1) and ties are broken with a stable
+sort, so the cost ordering is identical to the per-note version.
+"""
+
+import numpy as np
+
+# Octave adjustments tried around the target octave, in loop order
+OCTAVE_ADJUSTMENTS = np.array([-1, 0, 1])
+
+# Lowest allowed harmony pitch (C3)
+HARMONY_FLOOR = 48
+
+# VoiceLeadingChecker.calculate_voice_leading_cost indexed by movement in semitones
+VOICE_LEADING_COSTS = np.array([0.5, 0, 0, 1, 1, 2, 2, 2] + [4] * 120, dtype=np.float64)
+
+# Thirds and sixths (3, 4, 8, 9 semitones) earn a -1 bonus against the melody
+INTERVAL_BONUS = np.zeros(12, dtype=np.float64)
+INTERVAL_BONUS[[3, 4, 8, 9]] = -1
+
+TOP_CANDIDATES = 3
+
+
+def harmony_candidates(melody_pitches, chord_pitches):
+    """
+    Build the candidate grid for a window of melody notes.
+
+    Returns (candidates, valid) where both have shape (n, 3 * len(chord_pitches)):
+    candidate MIDI pitches and a mask of those below the melody and above C3.
+    """
+    melody_pitches = np.asarray(melody_pitches, dtype=np.int64)
+    chord_pitches = np.asarray(chord_pitches, dtype=np.int64)
+
+    # (n, 1) target octave base + (tones, octaves) offsets, flattened tone-major
+    target_base = (melody_pitches // 12 - 1) * 12
+    offsets = (chord_pitches[:, None] + OCTAVE_ADJUSTMENTS[None, :] * 12).ravel()
+    candidates = target_base[:, None] + offsets[None, :]
+
+    valid = (candidates < melody_pitches[:, None] - 2) & (candidates >= HARMONY_FLOOR)
+    return candidates, valid
+
+
+def voice_leading_costs(prev_pitches, candidates):
+    """Vectorized calculate_voice_leading_cost; broadcasts prev against candidates."""
+    movement = np.abs(np.asarray(candidates) - np.asarray(prev_pitches))
+    return VOICE_LEADING_COSTS[np.minimum(movement, len(VOICE_LEADING_COSTS) - 1)]
+
+
+def score_harmony_window(melody_pitches, chord_pitches, prev_harmony_pitch=None):
+    """
+    Score every candidate of every note in a chord window at once.
+
+    Returns (candidates, entry_costs, step_costs):
+    - candidates:  (n, K) candidate pitches
+    - entry_costs: (K,) cost of each first-note candidate given prev_harmony_pitch
+    - step_costs:  (n - 1, K, K) cost of moving from candidate j of note i
+                   to candidate k of note i + 1
+    Invalid candidates cost +inf.
+    """
+    melody_pitches = np.asarray(melody_pitches, dtype=np.int64)
+    candidates, valid = harmony_candidates(melody_pitches, chord_pitches)
+
+    bonus = INTERVAL_BONUS[(melody_pitches[:, None] - candidates) % 12]
+    bonus = np.where(valid, bonus, np.inf)
+
+    if prev_harmony_pitch is None:
+        entry_costs = bonus[0].copy()
+    else:
+        entry_costs = voice_leading_costs(prev_harmony_pitch, candidates[0]) + bonus[0]
+
+    step_costs = voice_leading_costs(candidates[:-1, :, None], candidates[1:, None, :]) + bonus[1:, None, :]
+    return candidates, entry_costs, step_costs
+
+
+def row_costs(melody_pitch, candidates_row, prev_harmony_pitch):
+    """Score one note's candidates against an arbitrary previous pitch."""
+    costs = INTERVAL_BONUS[(melody_pitch - candidates_row) % 12]
+    if prev_harmony_pitch is not None:
+        costs = costs + voice_leading_costs(prev_harmony_pitch, candidates_row)
+    valid = (candidates_row < melody_pitch - 2) & (candidates_row >= HARMONY_FLOOR)
+    return np.where(valid, costs, np.inf)
+
+
+def choose_top_candidates(costs, uniforms):
+    """
+    Batched version of the top-3 weighted choice.
+
+    `costs` is (n, K) with +inf for invalid candidates and `uniforms` holds
+    one draw in [0, 1) per row (e.g. `rng.random(n)` from a seeded
+    generator). Each row picks among its 3 cheapest valid candidates with
+    weight 1 / (cost + 2). Returns the chosen column per row, or -1 for
+    rows without any valid candidate.
+    """
+    costs = np.atleast_2d(costs)
+    rows = np.arange(costs.shape[0])[:, None]
+    order = np.argsort(costs, axis=1, kind='stable')[:, :TOP_CANDIDATES]
+    top_costs = costs[rows, order]
+
+    weights = np.where(np.isfinite(top_costs), 1.0 / (top_costs + 2), 0.0)
+    totals = weights.sum(axis=1)
+    cumulative = np.cumsum(weights, axis=1)
+
+    picks = (cumulative <= (np.atleast_1d(uniforms) * totals)[:, None]).sum(axis=1)
+    picks = np.minimum(picks, order.shape[1] - 1)
+    chosen = order[rows[:, 0], picks]
+    return np.where(totals > 0, chosen, -1)
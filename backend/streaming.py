@@ -0,0 +1,485 @@
+"""
+Real-Time Streaming Harmonizer
+==============================
+Harmonizes a melody as it is played, one note at a time.
+
+StreamingHarmonizer consumes complete melody events (onset, duration,
+pitch in quarter lengths; pitch REST for silence) and emits harmony and
+bass HarmonyEvents. It runs the same chord, harmony and bass passes as
+the sampled path of MIDIHarmonizer, carrying the PhraseState (current
+chord, previous harmony/melody/bass pitches) from note to note.
+
+Phrase-end cadences need to know whether a note ends a phrase, which
+depends on the events after it (a following rest, a melodic peak), so
+each note is harmonized once `lookahead` further events have arrived.
+Boundaries follow PhraseDetector's rules, except that "long" notes are
+judged against the running mean duration and the periodic rule only
+sees the lookahead window. Bars, beats and harmonic rhythm come from a
+MeterIndex: the replayed file's, or 4/4 at --bpm for live input.
+
+Live input cannot wait that long: a melody note is only complete when it
+is released. There note_on() harmonizes a note the moment it starts,
+with a provisional boundary (the periodic rule only; rule boundaries of
+the note itself are not known yet and only resolve the next chord to the
+tonic) and a harmony that is held until the melody note is released
+(see PortOutput). push() then records the finished note as usual.
+
+NoteAssembler turns raw note_on/note_off messages into melody events
+(monophonic: a new note cuts the held one). replay_messages() plays a
+MIDI file back at real-time speed as an in-process event source, and
+the command line runs either a replay or live ports:
+
+Usage (from backend/):
+    python streaming.py --replay melody.mid [--key C] [--output harmonized.mid] [--speed 0]
+    python streaming.py --input-port NAME [--output-port NAME | --virtual] [--key C]
+
+Live ports use mido's rtmidi backend (python-rtmidi), imported only when a
+port is opened.
+"""
+
+import argparse
+import heapq
+import sys
+import time
+from collections import deque, namedtuple
+
+import mido
+import numpy as np
+
+from extraction import NoteEvents
+from harmonizer import PHRASE_BARS, MIDIHarmonizer
+from key_context import TONIC_NAMES, get_key_context
+from melody import MIN_REST_LENGTH, REST, Melody, Voice
+from meter import DEFAULT_METER, MeterIndex
+
+HarmonyEvent = namedtuple('HarmonyEvent', ['voice', 'onset', 'duration', 'pitch'])
+
+# Output channels match the file export: melody 0, harmony 1, bass 2
+VOICE_CHANNELS = {'Harmony': 1, 'Bass': 2}
+
+
+class StreamingHarmonizer:
+    """
+    Incremental harmonizer for a live melody in a known key.
+
+    push(onset, duration, pitch) returns the HarmonyEvents that became
+    final with this event; flush() emits the rest at the end of input.
+    note_on(onset, pitch) harmonizes a note as it starts (live input).
+    Pass `on_event` to receive events through a callback instead.
+    `meter` (a MeterIndex) defaults to 4/4 at 120 BPM.
+    """
+
+    def __init__(self, harmonizer, detected_key, lookahead=1, seed=None, on_event=None, meter=None):
+        if lookahead < 1:
+            raise ValueError("lookahead must be at least 1 event")
+        self.harmonizer = harmonizer
+        self.key = detected_key
+        self.lookahead = lookahead
+        self.on_event = on_event
+        self.meter = meter or DEFAULT_METER
+        self.rng = np.random.default_rng(seed)
+        self.state = harmonizer.initial_phrase_state(detected_key)
+
+        # Events not yet harmonized plus the two before them (peak and
+        # periodic rules look back); each entry is [onset, duration, pitch, rule, boundary]
+        self._window = deque()
+        self._pending = 0            # events in the window still waiting for a decision
+        self._sounding = None        # entry of a note started by note_on() and not pushed yet
+        self._duration_sum = 0.0
+        self._event_count = 0
+        self._last_periodic = -3     # index of the last periodic boundary
+        self._next_index = 0         # index of the next event to decide
+        self._prev_boundary = False
+
+    def push(self, onset, duration, pitch):
+        """Add the next melody event; returns the HarmonyEvents now decided."""
+        sounding = self._sounding
+        if sounding is not None and sounding[0] == onset and sounding[2] == pitch:
+            # The note started by note_on() is complete now
+            sounding[1] = float(duration)
+            self._sounding = None
+        else:
+            self._window.append([float(onset), float(duration), int(pitch), None, None])
+        self._pending += 1
+        self._duration_sum += duration
+        self._event_count += 1
+
+        emitted = []
+        while self._pending > self.lookahead:
+            emitted.extend(self._decide_next(final=False))
+        return self._emit(emitted)
+
+    def note_on(self, onset, pitch):
+        """
+        Harmonize a melody note the moment it starts; returns its
+        HarmonyEvents. Every earlier event is decided first (the new pitch
+        is their successor). The note's own boundary is provisional: only
+        the periodic rule can place one before its duration and successor
+        are known. The harmony duration is provisional as well (the running
+        mean duration) and should end when the melody note is released;
+        bass durations are final. Call push() with the complete note once
+        it ends.
+        """
+        if self._sounding is not None:
+            raise ValueError("note_on() before the previous note was pushed")
+        entry = [float(onset), None, int(pitch), None, None]
+        self._window.append(entry)
+        self._sounding = entry
+
+        emitted = []
+        while self._pending:
+            emitted.extend(self._decide_next(final=False))
+
+        window = self._window
+        position = len(window) - 1
+        boundary = False
+        if onset > 0 and self._next_index - self._last_periodic > 2 and self._on_phrase_bar(onset):
+            # Periodic boundary unless one of the last 2 events ends a phrase
+            if not any(window[other][3] for other in range(max(0, position - 2), position)):
+                boundary = True
+                self._last_periodic = self._next_index
+        entry[4] = boundary
+
+        mean_duration = self._duration_sum / self._event_count if self._event_count else 1.0
+        emitted.extend(self._harmonize([entry[0], mean_duration, entry[2]], boundary))
+        return self._emit(emitted)
+
+    def flush(self):
+        """Decide the remaining events at the end of the melody."""
+        emitted = []
+        while self._pending:
+            emitted.extend(self._decide_next(final=True))
+        return self._emit(emitted)
+
+    def _emit(self, events):
+        if self.on_event:
+            for event in events:
+                self.on_event(event)
+        return events
+
+    def _rule_flag(self, position, final):
+        """Non-periodic boundary rules for the window entry at `position` (None if not yet known)."""
+        window = self._window
+        if position + 1 >= len(window) and not final:
+            return None
+        onset, duration, pitch, _, _ = window[position]
+        has_next = position + 1 < len(window)
+
+        flag = duration >= self._duration_sum / self._event_count * 1.5
+        if has_next and window[position + 1][2] == REST:
+            flag = True
+        if has_next and position > 0 and pitch != REST:
+            before, after = window[position - 1][2], window[position + 1][2]
+            if before != REST and after != REST and pitch > before and pitch > after:
+                flag = True
+        return flag
+
+    def _decide_next(self, final):
+        """
+        Fix the boundary flag of the oldest pending event and harmonize it
+        (a note already harmonized by note_on() only gets its flag).
+        """
+        window = self._window
+        sounding = self._sounding is not None
+        position = len(window) - self._pending - sounding
+        entry = window[position]
+        index = self._next_index
+
+        if entry[3] is None:
+            entry[3] = self._rule_flag(position, final)
+        boundary = entry[3]
+
+        onset = entry[0]
+        if entry[4] is not None:
+            # Started by note_on(): harmonized already, periodic boundary decided
+            boundary = bool(boundary) or entry[4]
+            events = []
+        else:
+            if not boundary and onset > 0 and index - self._last_periodic > 2 and self._on_phrase_bar(onset):
+                # Periodic boundary unless a rule boundary is within 2 events
+                nearby = False
+                for other in range(max(0, position - 2), min(len(window), position + 3)):
+                    if other != position:
+                        if window[other][3] is None:
+                            window[other][3] = self._rule_flag(other, final)
+                        nearby = nearby or bool(window[other][3])
+                if not nearby:
+                    boundary = True
+                    self._last_periodic = index
+            events = self._harmonize(entry, boundary)
+        entry[4] = boundary
+
+        self._prev_boundary = boundary
+        self._pending -= 1
+        self._next_index += 1
+        while len(window) - self._pending - sounding > 2:
+            window.popleft()
+        return events
+
+    def _on_phrase_bar(self, onset):
+        """Whether `onset` is on the first beat of a periodic phrase bar (as PhraseDetector)."""
+        bar, beat, _ = self.meter.locate(onset)
+        return bar % PHRASE_BARS == 0 and beat == 0
+
+    def _harmonize(self, entry, boundary):
+        """Run the chord, harmony and bass passes on one note."""
+        onset, duration, pitch = entry[0], entry[1], entry[2]
+        if pitch == REST:
+            return []
+
+        # The event before the note only contributes its boundary flag
+        melody = Melody([onset - 1.0, onset], [1.0, duration], [REST, pitch], self.meter)
+        mask = np.array([self._prev_boundary, boundary])
+        note_indices = np.array([1])
+
+        harmonizer = self.harmonizer
+        harmony = Voice('Harmony')
+        bass = Voice('Bass')
+        chords, state = harmonizer.choose_chords(melody, note_indices, self.key, mask, self.rng, self.state)
+        state = harmonizer.generate_harmony_voice(melody, note_indices, chords, self.key, self.rng, state, harmony)
+        self.state = harmonizer.generate_bass_voice(melody, note_indices, chords, self.key, state, bass)
+
+        return [
+            HarmonyEvent(voice.name, onset, duration, pitch)
+            for voice in (harmony, bass)
+            for onset, duration, pitch in zip(voice.onsets.tolist(), voice.durations.tolist(), voice.pitches.tolist())
+        ]
+
+
+class NoteAssembler:
+    """
+    Turns timed note_on/note_off messages into monophonic melody events.
+    Times are in quarter lengths; gaps of at least `min_rest` become rests.
+    """
+
+    def __init__(self, min_rest=MIN_REST_LENGTH):
+        self.min_rest = min_rest
+        self._held = None        # (onset, pitch) of the sounding note
+        self._cursor = 0.0       # end of the last emitted event
+
+    def feed(self, beat, message):
+        """Process one message at time `beat`; returns completed (onset, duration, pitch) events."""
+        events = []
+        if message.type == 'note_on' and message.velocity > 0:
+            if self._held:
+                events.extend(self._release(beat))
+            if beat - self._cursor >= self.min_rest:
+                events.append((self._cursor, beat - self._cursor, REST))
+            self._held = (beat, message.note)
+        elif message.type in ('note_on', 'note_off') and self._held and self._held[1] == message.note:
+            events.extend(self._release(beat))
+        return events
+
+    @property
+    def held(self):
+        """(onset, pitch) of the sounding note, or None."""
+        return self._held
+
+    def close(self, beat=None):
+        """Release a still-held note (at `beat`, default: now)."""
+        if self._held:
+            return self._release(self._held[0] if beat is None else beat)
+        return []
+
+    def _release(self, beat):
+        onset, pitch = self._held
+        self._held = None
+        self._cursor = max(beat, onset)
+        return [(onset, self._cursor - onset, pitch)]
+
+
+def replay_messages(path, realtime=True, speed=1.0):
+    """
+    Yield (beat, message) for the channel messages of a MIDI file in time
+    order. With `realtime`, sleeps between messages to play the file back
+    at `speed` times its tempo.
+    """
+    midi_file = mido.MidiFile(path)
+    ticks_per_beat = midi_file.ticks_per_beat
+    tempo = 500000
+    tick = 0
+    seconds = 0.0
+    start = time.perf_counter()
+
+    for message in mido.merge_tracks(midi_file.tracks):
+        if message.time:
+            seconds += mido.tick2second(message.time, ticks_per_beat, tempo)
+            tick += message.time
+        if message.type == 'set_tempo':
+            tempo = message.tempo
+        if message.is_meta:
+            continue
+        if realtime and speed > 0:
+            delay = seconds / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        yield tick / ticks_per_beat, message
+
+
+class PortOutput:
+    """
+    Sends HarmonyEvents to a MIDI output port. Notes sent with
+    `held=True` sound until release() (the melody note ends); the others
+    get a note-off scheduled from their duration. `clock` returns seconds.
+    """
+
+    def __init__(self, port, seconds_per_beat, clock=time.perf_counter):
+        self.port = port
+        self.seconds_per_beat = seconds_per_beat
+        self.clock = clock
+        self._note_offs = []     # heap of (due_time, channel, pitch)
+        self._held = []          # (channel, pitch) ending with the melody note
+
+    def send(self, event, now_beat, held=False):
+        channel = VOICE_CHANNELS[event.voice]
+        self.port.send(mido.Message('note_on', channel=channel, note=event.pitch, velocity=80))
+        if held:
+            self._held.append((channel, event.pitch))
+            return
+        remaining = max(event.onset + event.duration - now_beat, 0.0) * self.seconds_per_beat
+        heapq.heappush(self._note_offs, (self.clock() + remaining, channel, event.pitch))
+
+    def release(self):
+        """End the notes sent with `held=True`."""
+        for channel, pitch in self._held:
+            self.port.send(mido.Message('note_off', channel=channel, note=pitch, velocity=0))
+        self._held = []
+
+    def poll(self, flush=False):
+        now = self.clock()
+        while self._note_offs and (flush or self._note_offs[0][0] <= now):
+            _, channel, pitch = heapq.heappop(self._note_offs)
+            self.port.send(mido.Message('note_off', channel=channel, note=pitch, velocity=0))
+        if flush:
+            self.release()
+
+
+def parse_key(name):
+    """KeyContext from a name like 'C', 'F#', 'Bb' or 'a' / 'c#' (lowercase = minor)."""
+    mode = 'minor' if name[0].islower() else 'major'
+    spelled = name[0].upper() + name[1:].replace('b', '-')
+    if spelled not in TONIC_NAMES:
+        flats = {'D-': 'C#', 'G-': 'F#', 'A#': 'B-', 'D#': 'E-', 'G#': 'A-'}
+        spelled = flats.get(spelled, spelled)
+    if spelled not in TONIC_NAMES:
+        raise ValueError(f"Unknown key: {name!r}")
+    return get_key_context(TONIC_NAMES.index(spelled), mode)
+
+
+def run_replay(args, harmonizer, detected_key):
+    """Replay a file through the streaming harmonizer and report per-note latency."""
+    meter = NoteEvents.from_midi_file(mido.MidiFile(args.replay)).meter
+    streamer = StreamingHarmonizer(harmonizer, detected_key, lookahead=args.lookahead, seed=args.seed, meter=meter)
+    assembler = NoteAssembler()
+    melody_events = []
+    harmony_events = []
+    latencies = []
+    beat = 0.0
+
+    for beat, message in replay_messages(args.replay, realtime=args.speed > 0, speed=args.speed):
+        for event in assembler.feed(beat, message):
+            start = time.perf_counter()
+            harmony_events.extend(streamer.push(*event))
+            latencies.append(time.perf_counter() - start)
+            melody_events.append(event)
+    for event in assembler.close(beat):
+        harmony_events.extend(streamer.push(*event))
+        melody_events.append(event)
+    harmony_events.extend(streamer.flush())
+
+    if latencies:
+        latencies = np.array(latencies) * 1e3
+        print(f"{len(latencies)} events, per-event latency: median {np.median(latencies):.3f} ms, "
+              f"p99 {np.percentile(latencies, 99):.3f} ms, max {latencies.max():.3f} ms")
+
+    if args.output:
+        from midi_writer import write_midi
+        voices = {'Harmony': Voice('Harmony'), 'Bass': Voice('Bass')}
+        for event in harmony_events:
+            voices[event.voice].append(event.onset, event.duration, event.pitch)
+        melody = Melody.from_notes([e for e in melody_events if e[2] != REST], meter=meter)
+        write_midi(melody, voices['Harmony'], voices['Bass'], detected_key, args.output)
+        print(f"Harmonized MIDI saved to: {args.output}")
+
+
+def live_step(beat, message, assembler, streamer, output=None):
+    """
+    Handle one input message of a live session at time `beat`: harmony
+    and bass start with each melody note (StreamingHarmonizer.note_on),
+    and the harmony stops when the melody note is released.
+    """
+    held = assembler.held
+    for event in assembler.feed(beat, message):
+        for harmony_event in streamer.push(*event):
+            if output:
+                output.send(harmony_event, beat)
+    if assembler.held is held:
+        return
+    if output and held is not None:
+        output.release()
+    if assembler.held is not None:
+        for harmony_event in streamer.note_on(*assembler.held):
+            if output:
+                output.send(harmony_event, beat, held=harmony_event.voice == 'Harmony')
+
+
+def run_live(args, harmonizer, detected_key):
+    """Harmonize a live input port, sending harmony and bass to an output port."""
+    seconds_per_beat = 60.0 / args.bpm
+    inport = mido.open_input(args.input_port)
+    outport = mido.open_output(args.output_port, virtual=args.virtual) if (args.output_port or args.virtual) else None
+    output = PortOutput(outport, seconds_per_beat) if outport else None
+    meter = MeterIndex(tempos=[(0.0, seconds_per_beat * 1e6)])
+    streamer = StreamingHarmonizer(harmonizer, detected_key, lookahead=args.lookahead, seed=args.seed, meter=meter)
+    assembler = NoteAssembler()
+    start = time.perf_counter()
+
+    print(f"Harmonizing {args.input_port} in {detected_key} (Ctrl+C to stop)")
+    try:
+        while True:
+            for message in inport.iter_pending():
+                beat = (time.perf_counter() - start) / seconds_per_beat
+                if outport:
+                    outport.send(message)
+                live_step(beat, message, assembler, streamer, output)
+            if output:
+                output.poll()
+            time.sleep(0.0005)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output:
+            output.poll(flush=True)
+            outport.close()
+        inport.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--replay', help='MIDI file to replay as the live input')
+    source.add_argument('--input-port', help='MIDI input port name')
+    parser.add_argument('--output-port', help='MIDI output port for harmony and bass')
+    parser.add_argument('--virtual', action='store_true', help='open --output-port (or "Harmonizer") as a virtual port')
+    parser.add_argument('--output', help='with --replay: write the harmonized result to this file')
+    parser.add_argument('--key', default='C', help="key, e.g. 'C', 'Bb' or 'f#' (lowercase = minor)")
+    parser.add_argument('--lookahead', type=int, default=1,
+                        help='with --replay: events to wait for before harmonizing a note')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed (0 = as fast as possible)')
+    parser.add_argument('--bpm', type=float, default=120.0, help='tempo for live input')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.virtual and not args.output_port:
+        args.output_port = 'Harmonizer'
+
+    harmonizer = MIDIHarmonizer()
+    detected_key = parse_key(args.key)
+    if args.replay:
+        run_replay(args, harmonizer, detected_key)
+    else:
+        run_live(args, harmonizer, detected_key)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
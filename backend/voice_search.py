@@ -0,0 +1,262 @@
+"""
+Optimal Voice-Leading Search
+============================
+Deterministic alternative to the sampled chord/voice choice in
+`MIDIHarmonizer.harmonize_melody`.
+
+A Viterbi search runs over states (chord numeral, harmony pitch, bass
+octave) for every melody note and returns the single cheapest
+harmonization under one cost model:
+
+- chord transitions:  -log P from ChordProgressionGenerator's Markov tables
+- melody fit:         penalty when the melody note is not a chord tone
+- harmony motion:     calculate_voice_leading_cost plus the third/sixth bonus
+- bass motion:        the same voice-leading table applied to the bass
+- parallels:          fifths/octaves between every voice pair, as defined by
+                      VoiceLeadingChecker
+
+All per-pair costs come from precomputed tables, so each step is a fixed
+number of array operations over S = 7 chords x 2 bass octaves x 10 harmony
+slots. The search is O(n * S^2) and linear in melody length.
+
+Chord and bass changes follow the same harmonic slots of the melody's
+meter (MeterIndex.grid) and phrase-end cadences (V, then I) as the
+sampled path. The bass is re-struck when the
+cadence resolves so it always sounds the current chord's root.
+"""
+
+import numpy as np
+
+from melody import Voice
+from scoring import (
+    INTERVAL_BONUS,
+    VOICE_LEADING_COSTS,
+    harmony_candidates,
+)
+
+# Harmony slots per chord: 3 chord tones x 3 octaves + the "third below" fallback
+HARMONY_SLOTS = 10
+FALLBACK_SLOT = HARMONY_SLOTS - 1
+FALLBACK_COST = 4.0
+
+BASS_OCTAVES = 2
+
+# Cost of a melody note that is diatonic but not in the chord
+# (the sampled path weights fitting chords 2.0 vs 0.3)
+MELODY_MISFIT_COST = float(np.log(2.0 / 0.3))
+
+PARALLEL_PENALTY = 6.0
+
+# Transition probabilities of zero still get a finite (large) cost
+MIN_TRANSITION_PROBABILITY = 1e-4
+
+# Notes between progress callbacks during the forward pass
+PROGRESS_INTERVAL = 256
+
+
+def parallel_motion(prev_upper, prev_lower, curr_upper, curr_lower):
+    """
+    Vectorized is_parallel_fifth | is_parallel_octave.
+    Arguments broadcast against each other; returns a boolean array.
+    """
+    prev_interval = np.abs(prev_upper - prev_lower) % 12
+    curr_interval = np.abs(curr_upper - curr_lower) % 12
+    same_direction = (curr_upper - prev_upper) * (curr_lower - prev_lower) > 0
+    perfect = ((prev_interval == 7) & (curr_interval == 7)) | ((prev_interval == 0) & (curr_interval == 0))
+    return perfect & same_direction
+
+
+def chord_change_grid(note_indices, slots, phrase_boundaries, num_chords, tonic, dominant):
+    """
+    Where chords may change, as in the sampled path: at the first note of
+    each harmonic slot (`slots`, aligned with note_indices; see
+    MeterIndex.grid), with a phrase-end change forced to the dominant and
+    the note after a boundary forced to resolve to the tonic. `tonic` and
+    `dominant` are chord indices.
+    Returns (is_change, allowed): a boolean per note and a (notes, chords)
+    mask of the chords each note may take.
+    """
+    n = len(note_indices)
+    is_change = np.zeros(n, dtype=bool)
+    allowed = np.ones((n, num_chords), dtype=bool)
+    last_slot = None
+    is_boundary = phrase_boundaries.tolist()
+    for k, (i, slot) in enumerate(zip(note_indices.tolist(), slots.tolist())):
+        if slot != last_slot:
+            is_change[k] = True
+            last_slot = slot
+            if is_boundary[i]:
+                allowed[k] = False
+                allowed[k, dominant] = True
+        if i > 0 and is_boundary[i - 1]:
+            # Cadence resolution: force the tonic (and re-strike the bass)
+            is_change[k] = True
+            allowed[k] = False
+            allowed[k, tonic] = True
+    return is_change, allowed
+
+
+class ViterbiVoiceSearch:
+    """
+    Globally optimal chord, harmony and bass selection by dynamic programming.
+    Chord transition cost matrices are built once per mode.
+    """
+
+    def __init__(self, harmonizer):
+        self.harmonizer = harmonizer
+        generator = harmonizer.chord_generator
+        self.numerals = {
+            'major': list(generator.major_transitions),
+            'minor': list(generator.minor_transitions),
+        }
+        self.transition_costs = {
+            'major': self._transition_cost_matrix(generator.major_transitions),
+            'minor': self._transition_cost_matrix(generator.minor_transitions),
+        }
+
+    @staticmethod
+    def _transition_cost_matrix(transitions):
+        numerals = list(transitions)
+        probs = np.array([[transitions[a].get(b, 0.0) for b in numerals] for a in numerals])
+        return -np.log(np.maximum(probs, MIN_TRANSITION_PROBABILITY))
+
+    def search(self, melody, detected_key, phrase_boundaries, progress=None):
+        """
+        Harmonize `melody` optimally. `phrase_boundaries` is a boolean mask
+        over melody events (PhraseDetector.boundary_mask).
+        `progress(notes_done, notes_total)` is called during the forward pass.
+        Returns (chords, harmony, bass): one chord numeral per note plus Voices.
+        """
+        harmony = Voice('Harmony')
+        bass = Voice('Bass')
+
+        note_indices = np.flatnonzero(melody.note_mask)
+        if len(note_indices) == 0:
+            return [], harmony, bass
+
+        mode = detected_key.mode
+        numerals = self.numerals[mode]
+        transition_costs = self.transition_costs[mode]
+        num_chords = len(numerals)
+        tonic = numerals.index(detected_key.tonic_numeral)
+        dominant = numerals.index('V')
+
+        # Per-chord pitch classes and bass pitches (root in octaves 2 and 3)
+        scale_pitches = list(detected_key.scale_pitches)
+        chord_pitches = [list(detected_key.chord_pitches[n]) for n in numerals]
+        chord_pitch_sets = np.zeros((num_chords, 12), dtype=bool)
+        for c, pitch_classes in enumerate(chord_pitches):
+            chord_pitch_sets[c, pitch_classes] = True
+        bass_pitches = np.array([[36 + pcs[0] + 12 * o for o in range(BASS_OCTAVES)] for pcs in chord_pitches])
+        scale_set = np.zeros(12, dtype=bool)
+        scale_set[scale_pitches] = True
+
+        pitches = melody.pitches[note_indices].astype(np.int64)
+        onsets = melody.onsets[note_indices]
+        durations = melody.durations[note_indices]
+        n = len(pitches)
+
+        # Chord changes once per harmonic slot; the same gating drives the bass
+        is_change, allowed = chord_change_grid(
+            note_indices, melody.grid.slots[note_indices], phrase_boundaries, num_chords, tonic, dominant
+        )
+
+        # === CANDIDATE TABLES ===
+        # candidates[k, c, h]: harmony pitch of slot h under chord c at note k
+        candidates = np.empty((n, num_chords, HARMONY_SLOTS), dtype=np.int64)
+        static_costs = np.empty((n, num_chords, HARMONY_SLOTS))
+        for c, pitch_classes in enumerate(chord_pitches):
+            grid, valid = harmony_candidates(pitches, pitch_classes)
+            candidates[:, c, :FALLBACK_SLOT] = grid
+            bonus = INTERVAL_BONUS[(pitches[:, None] - grid) % 12]
+            static_costs[:, c, :FALLBACK_SLOT] = np.where(valid, bonus, np.inf)
+        candidates[:, :, FALLBACK_SLOT] = (pitches - 4)[:, None]
+        static_costs[:, :, FALLBACK_SLOT] = FALLBACK_COST
+
+        # Melody fit: diatonic non-chord tones are penalized
+        pitch_classes = pitches % 12
+        misfit = ~chord_pitch_sets[:, pitch_classes].T & scale_set[pitch_classes][:, None]
+        static_costs += np.where(misfit, MELODY_MISFIT_COST, 0.0)[:, :, None]
+        static_costs[~allowed] = np.inf
+
+        # === FORWARD PASS ===
+        # Scores are indexed [chord, bass octave, harmony slot]
+        num_states = num_chords * BASS_OCTAVES * HARMONY_SLOTS
+        backpointers = np.zeros((n, num_states), dtype=np.int16)
+        state_grid = np.arange(num_states).reshape(num_chords, BASS_OCTAVES, HARMONY_SLOTS)
+
+        # The piece starts from the tonic; opening on it is free
+        initial_costs = transition_costs[tonic].copy()
+        initial_costs[tonic] = 0.0
+        scores = (
+            initial_costs[:, None, None]
+            + static_costs[0][:, None, :]
+            + np.zeros((1, BASS_OCTAVES, 1))
+        )
+
+        for k in range(1, n):
+            if progress and k % PROGRESS_INTERVAL == 0:
+                progress(k, n)
+            prev_melody, curr_melody = pitches[k - 1], pitches[k]
+            prev_harmony = candidates[k - 1]   # (C, H)
+            curr_harmony = candidates[k]       # (C, H)
+
+            if is_change[k]:
+                # Full transition (c', o', h') -> (c, o, h), axes [c', o', h', c, o, h]
+                ph = prev_harmony[:, None, :, None, None, None]
+                ch = curr_harmony[None, None, None, :, None, :]
+                pb = bass_pitches[:, :, None, None, None, None]
+                cb = bass_pitches[None, None, None, :, :, None]
+
+                cost = (
+                    transition_costs[:, None, None, :, None, None]
+                    + VOICE_LEADING_COSTS[np.abs(ch - ph)]
+                    + VOICE_LEADING_COSTS[np.abs(cb - pb)]
+                    + PARALLEL_PENALTY * parallel_motion(prev_melody, ph, curr_melody, ch)
+                    + PARALLEL_PENALTY * parallel_motion(ph, pb, ch, cb)
+                    + PARALLEL_PENALTY * parallel_motion(prev_melody, pb, curr_melody, cb)
+                    + static_costs[k][None, None, None, :, None, :]
+                )
+                total = (scores[:, :, :, None, None, None] + cost).reshape(num_states, num_states)
+                best_prev = np.argmin(total, axis=0)
+                scores = total[best_prev, np.arange(num_states)].reshape(scores.shape)
+                backpointers[k] = best_prev
+            else:
+                # Chord and bass hold; only the harmony moves. Axes [c, h', h]
+                ph = prev_harmony[:, :, None]
+                ch = curr_harmony[:, None, :]
+                cost = (
+                    VOICE_LEADING_COSTS[np.abs(ch - ph)]
+                    + PARALLEL_PENALTY * parallel_motion(prev_melody, ph, curr_melody, ch)
+                    + static_costs[k][:, None, :]
+                )
+                total = scores[:, :, :, None] + cost[:, None, :, :]   # [c, o, h', h]
+                best_slot = np.argmin(total, axis=2)                   # [c, o, h]
+                scores = np.take_along_axis(total, best_slot[:, :, None, :], axis=2)[:, :, 0, :]
+                backpointers[k] = (state_grid[:, :, :1] + best_slot).ravel()
+
+        # === BACKTRACK ===
+        states = np.empty(n, dtype=np.int64)
+        states[-1] = int(np.argmin(scores))
+        for k in range(n - 1, 0, -1):
+            states[k - 1] = backpointers[k, states[k]]
+
+        chord_ids, bass_octaves, slots = np.unravel_index(states, state_grid.shape)
+        harmony_pitches = candidates[np.arange(n), chord_ids, slots]
+        chords = [numerals[c] for c in chord_ids.tolist()]
+
+        for k in range(n):
+            harmony.append(float(onsets[k]), float(durations[k]), int(harmony_pitches[k]))
+
+        # Bass sounds from each change until the next one (at most to the end of its slot)
+        change_points = np.flatnonzero(is_change)
+        bass_onsets = onsets[change_points]
+        bass_ends = np.append(bass_onsets[1:], np.inf)
+        bass_durations = np.minimum(bass_ends, melody.grid.slot_ends[note_indices[change_points]]) - bass_onsets
+        for k, onset, duration in zip(change_points.tolist(), bass_onsets.tolist(), bass_durations.tolist()):
+            bass.append(onset, duration, int(bass_pitches[chord_ids[k], bass_octaves[k]]))
+
+        if progress:
+            progress(n, n)
+
+        return chords, harmony, bass
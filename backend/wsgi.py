@@ -0,0 +1,13 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+gunicorn.conf.py preloads the app in the master process (the harmonizer
+and its warm caches are then shared copy-on-write by the workers) and calls
+app.init_worker after each fork. Any other WSGI server can serve
+`application` directly; pre-forking ones should do the same: set
+HARMONIZER_PREFORK=1 before import and call init_worker in each worker.
+"""
+
+from app import app as application